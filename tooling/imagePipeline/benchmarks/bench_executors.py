@@ -0,0 +1,123 @@
+"""
+Measures which executor (see `utils/executors.py`) each op runs fastest on:
+every op of `ParallelTransformer.ops` runs alone as the recipe of every
+channel, through `process_tiles` on a persistent pool, with `executor`
+'serial', 'threads' and 'processes' and --procs workers. It prints the
+speedup of each executor over 'serial', and the `executor` of each op for
+`preprocess_funcs/op_registry.py`: threads, unless processes are faster
+by more than --tolerance.
+
+Threads only beat processes for ops that release the GIL, and only with
+more than one core: run it on the machine the pipeline runs on, with
+--procs set to its `parallel_procs`.
+
+EXAMPLE run from: tooling/
+
+python imagePipeline/benchmarks/bench_executors.py --sizes 512 1024 --procs 4
+"""
+
+import argparse
+import sys
+import os
+
+# make local modules discoverable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+import imagePipeline.data_io.loaders as _read
+import imagePipeline.benchmarks.bench_ops as _bench
+import imagePipeline.preprocess_funcs.op_registry as _registry
+
+
+EXECUTORS = ('serial', 'threads', 'processes')
+
+
+def time_executors(params, stack, op, procs, repeats):
+    """A function to time one op through `process_tiles` on each executor
+
+    Parameters:
+    -----------------------------
+        : params (dict): the parameter file
+        : stack (np.array): (1, T, C, tiles, Y, X) stack
+        : op (str): the op to run on every channel
+        : procs (int): `parallel_procs`
+        : repeats (int): timing repeats
+
+    Returns:
+    -----------------------------
+        : timings (dict): executor -> seconds, or an error message
+    """
+    recipe = {name: [op] for name in params['process_channels']}
+    timings = {}
+    for executor in EXECUTORS:
+        case = dict(params, process_channels=recipe, executor=executor)
+        transformer = _bench.make_transformer(case, stack, procs=procs)
+        try:
+            with transformer.open_pool() as pool:
+                # start the workers before timing
+                transformer.process_tiles(stack[:, :1], pool=pool)
+                run = lambda: transformer.process_tiles(stack, pool=pool)
+                timings[executor] = _bench.best_time(run, repeats)
+        except Exception as e:
+            timings[executor] = f"error: {type(e).__name__}: {e}"
+    return timings
+
+
+def pick_executor(timings, tolerance):
+    """A function to pick threads, unless processes are faster by more
+    than the tolerance
+
+    Returns:
+    -----------------------------
+        : executor (str): 'threads', 'processes', or None if either failed
+    """
+    threads, processes = timings.get('threads'), timings.get('processes')
+    if not isinstance(threads, float) or not isinstance(processes, float):
+        return None
+    return 'threads' if threads <= processes * (1 + tolerance) else 'processes'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--params", default=_bench.DEFAULT_PARAMS,
+                        help="parameter file with the op params")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512])
+    parser.add_argument("--procs", type=int, default=2)
+    parser.add_argument("--timepoints", type=int, default=4)
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--tiles", type=int, default=4)
+    parser.add_argument("--dtype", default="float32",
+                        help="stack dtype: `otsu` on integer frames bins their full range")
+    parser.add_argument("--content", default="blobs", choices=["blobs", "noise"])
+    parser.add_argument("--ops", nargs="+", default=None, help="ops to time, default all")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args, unknown = parser.parse_known_args()
+
+    params = _read.load_params(args.params)
+
+    picks = {}
+    for size in args.sizes:
+        stack = _bench.make_stack(args.timepoints, args.channels, args.tiles, size,
+                                  args.dtype, content=args.content)
+        transformer = _bench.make_transformer(params, stack, procs=1)
+        ops = args.ops or list(transformer.ops)
+        for op in ops:
+            timings = time_executors(params, stack, op, args.procs, args.repeats)
+            serial = timings['serial']
+            line = f"{op:<16} {size:>5}"
+            for executor, seconds in timings.items():
+                if not isinstance(seconds, float):
+                    line += f" | {executor} {seconds}"
+                elif isinstance(serial, float):
+                    line += f" | {executor} {seconds * 1e3:>9.1f}ms {serial / seconds:>5.2f}x"
+            print(line)
+            picks.setdefault(op, []).append(pick_executor(timings, args.tolerance))
+
+    # an op runs on threads only if it does at every size
+    print(f"\nexecutors (procs={args.procs}, sizes={args.sizes}):")
+    for op, executors in picks.items():
+        if None in executors:
+            continue
+        executor = 'threads' if all(e == 'threads' for e in executors) else 'processes'
+        current = _registry.resolve(_registry.get_spec(op)['executor'], transformer)
+        note = "" if executor == current else f"  # registered: {current!r}"
+        print(f"    {op:<16} executor='{executor}'{note}")
@@ -0,0 +1,84 @@
+"""
+Measures the cost model of every op in `ParallelTransformer.ops`: each op
+is timed per frame on one core across frame sizes, and a line
+
+    seconds per frame = seconds per call + seconds per pixel * pixels
+
+is fitted by least squares. The table is printed in the form of the `cost`
+entries of `preprocess_funcs/op_registry.py`, and can be saved as a JSON
+file for the `op_costs` parameter, which overrides the registered costs
+on the machine that measured them.
+
+EXAMPLE run from: tooling/
+
+python imagePipeline/benchmarks/bench_op_costs.py --sizes 128 256 512 1024 --save op_costs.json
+"""
+
+import argparse
+import sys
+import os
+import json
+import numpy as np
+
+# make local modules discoverable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+import imagePipeline.data_io.loaders as _read
+import imagePipeline.benchmarks.bench_ops as _bench
+
+
+def fit_cost(pixels, seconds):
+    """A function to fit seconds = per_call + per_pixel * pixels, by
+    least squares on the relative error, so small frames weigh as much as
+    large ones
+
+    Parameters:
+    -----------------------------
+        : pixels (list of int): pixels per frame
+        : seconds (list of float): seconds per frame
+
+    Returns:
+    -----------------------------
+        : cost (tuple): (seconds per call, seconds per pixel), non-negative
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    per_pixel, per_call = np.polyfit(np.asarray(pixels, dtype=np.float64), seconds, 1,
+                                     w=1 / np.maximum(seconds, 1e-9))
+    return max(float(per_call), 0.0), max(float(per_pixel), 0.0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--params", default=_bench.DEFAULT_PARAMS,
+                        help="parameter file with the op params")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512, 1024])
+    parser.add_argument("--frames", type=int, default=4)
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--content", default="blobs", choices=["blobs", "noise"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--save", default=None, help="JSON file to save the costs to")
+    args, unknown = parser.parse_known_args()
+
+    params = _read.load_params(args.params)
+
+    timings = {}
+    for size in args.sizes:
+        stack = _bench.make_stack(1, 1, args.frames, size, args.dtype, content=args.content)
+        transformer = _bench.make_transformer(params, stack, procs=1)
+        for op, seconds in _bench.time_ops(transformer, stack[0, 0, 0], args.repeats).items():
+            timings.setdefault(op, {})[size * size] = seconds
+
+    costs = {}
+    for op, by_pixels in timings.items():
+        failed = [s for s in by_pixels.values() if not isinstance(s, float)]
+        if failed:
+            print(f"{op:<16} {failed[0]}")
+            continue
+        costs[op] = fit_cost(list(by_pixels), list(by_pixels.values()))
+        per_call, per_pixel = costs[op]
+        fitted = ", ".join(f"{int(np.sqrt(n))}: {s * 1e3:.2f}ms" for n, s in by_pixels.items())
+        print(f"{op:<16} cost=({per_call:.1e}, {per_pixel:.1e})   {fitted}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(costs, f, indent=1)
+        print(f"Saved: `{args.save}`")
@@ -0,0 +1,312 @@
+"""
+Benchmarks every op in `ParallelTransformer.ops`, each channel recipe of a
+parameter file, `process_tiles`, `stitch` and `process_stitched` on
+synthetic CZI-shaped stacks, across frame sizes and `parallel_procs`.
+Results can be saved as a baseline, and later runs are compared against
+it: timings slower than the baseline by more than --threshold are flagged.
+
+Timings are the best of --repeats runs. Ops and recipes are timed per
+frame in the calling process, the pipeline stages on the whole stack.
+Everything runs offline on synthetic data.
+
+EXAMPLE run from: tooling/
+
+# record a baseline on this machine
+python imagePipeline/benchmarks/bench_ops.py --sizes 256 512 --procs 1 2 --save
+
+# compare against it, exit with an error on regressions
+python imagePipeline/benchmarks/bench_ops.py --sizes 256 512 --procs 1 2 --fail-on-regression
+"""
+
+import argparse
+import sys
+import os
+import json
+import time
+import platform
+import numpy as np
+from scipy import ndimage as ndi
+from easydict import EasyDict
+
+# make local modules discoverable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+import imagePipeline.data_io.loaders as _read
+import imagePipeline.preprocess_funcs.transform as _prep
+
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+DEFAULT_PARAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../inputs/test.json")
+
+
+def make_stack(n_timepoints, n_channels, n_tiles, size, dtype, content='blobs', seed=0):
+    """A function to make a synthetic CZI-shaped stack
+
+    Parameters:
+    -----------------------------
+        : n_timepoints, n_channels, n_tiles (int): stack dimensions
+        : size (int): frame height and width
+        : dtype (str): stack dtype
+        : content (str): 'blobs' (nuclei-like spots on a smooth background,
+        with noise) or 'noise' (uniform noise)
+        : seed (int): random seed
+
+    Returns:
+    -----------------------------
+        : stack (np.array): (1, T, C, tiles, size, size) stack in [0, 1]
+        for floats and the full range for integers
+    """
+    rng = np.random.default_rng(seed)
+    shape = (n_timepoints, n_channels, n_tiles, size, size)
+
+    if content == 'noise':
+        stack = rng.random(shape)
+    elif content == 'blobs':
+        n_blobs = max(1, size * size // 400)
+        spots = np.zeros(shape)
+        idx = [rng.integers(0, n, size=shape[:3] + (n_blobs,)) for n in (size, size)]
+        frames = spots.reshape(-1, size, size)
+        for k, (yy, xx) in enumerate(zip(idx[0].reshape(-1, n_blobs), idx[1].reshape(-1, n_blobs))):
+            frames[k, yy, xx] = 1.0
+        spots = ndi.gaussian_filter(spots, sigma=(0, 0, 0, 3, 3))
+        spots /= max(spots.max(), 1e-12)
+
+        yy, xx = np.mgrid[0:size, 0:size] / size
+        background = 0.2 + 0.2 * (yy + xx)
+        stack = 0.6 * spots + background + 0.05 * rng.random(shape)
+        stack /= stack.max()
+    else:
+        raise ValueError(f"unknown content: {content}")
+
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        stack = stack * np.iinfo(dtype).max
+    return np.expand_dims(stack.astype(dtype), 0)
+
+
+def get_grid_shape(n_tiles):
+    """A function to return the most square (rows, columns) grid for n tiles"""
+    rows = max(r for r in range(1, int(np.sqrt(n_tiles)) + 1) if n_tiles % r == 0)
+    return [rows, n_tiles // rows]
+
+
+def make_transformer(params, stack, procs):
+    """A function to build a transformer for a synthetic stack
+
+    Parameters:
+    -----------------------------
+        : params (dict): the parameter file
+        : stack (np.array): (1, T, C, tiles, Y, X) stack
+        : procs (int): `parallel_procs`
+
+    Returns:
+    -----------------------------
+        : transformer (ParallelTransformer)
+    """
+    names = list(params['process_channels'])
+    n_channels = stack.shape[2]
+    names = (names + [f"C{i}" for i in range(len(names), n_channels)])[:n_channels]
+
+    params = EasyDict(dict(params))
+    params['parallel_procs'] = procs
+    params['grid_shape'] = get_grid_shape(stack.shape[3])
+    params['process_channels'] = {n: params['process_channels'].get(n, []) for n in names}
+    for key in ('op_cache_directory', 'checkpoint', 'profile_ops'):
+        params.pop(key, None)
+
+    metadata = {
+        'channel_map': dict(zip(names, range(n_channels))),
+        'image_shape': stack.shape[-2:],
+        'czi_path': 'synthetic.czi',
+    }
+    return _prep.ParallelTransformer(params, metadata)
+
+
+def best_time(func, repeats):
+    """A function to return the best wall time of repeated calls"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def time_ops(transformer, frames, repeats):
+    """A function to time every op on each frame
+
+    Parameters:
+    -----------------------------
+        : transformer (ParallelTransformer)
+        : frames (np.array): (n, Y, X) frames
+        : repeats (int): timing repeats
+
+    Returns:
+    -----------------------------
+        : timings (dict): op name -> seconds per frame, or an error message
+    """
+    timings = {}
+    # temporal ops subtract a fitted model: time them against a flat one,
+    # and the global intensity ops against the range of the frames
+    transformer.frame_background = np.zeros(frames.shape[-2:], dtype=np.float32)
+    transformer.frame_intensity_range = (float(frames.min()), float(frames.max()))
+
+    for op in transformer.ops:
+        def run():
+            for frame in frames:
+                transformer._process_image(frame, [op])
+        try:
+            run()
+            timings[op] = best_time(run, repeats) / len(frames)
+        except Exception as e:
+            timings[op] = f"error: {type(e).__name__}: {e}"
+
+    transformer.frame_background = None
+    transformer.frame_intensity_range = None
+    return timings
+
+
+def time_recipes(transformer, frames, repeats):
+    """A function to time each channel recipe on each frame, with the
+    temporal ops against a flat model and the global intensity ops against
+    the input range
+
+    Returns:
+    -----------------------------
+        : timings (dict): channel name -> seconds per frame
+    """
+    timings = {}
+    background = np.zeros(frames.shape[-2:], dtype=np.float32)
+    intensity_range = (float(frames.min()), float(frames.max()))
+
+    for name, func_list in transformer.process_channels.items():
+        def run():
+            for frame in frames:
+                transformer._process_frame(frame, func_list, background=background, 
+                                           intensity_range=intensity_range)
+        try:
+            timings[name] = best_time(run, repeats) / len(frames)
+        except Exception as e:
+            timings[name] = f"error: {type(e).__name__}: {e}"
+    return timings
+
+
+def time_pipeline(transformer, stack, repeats):
+    """A function to time `process_tiles`, `stitch` and `process_stitched`
+    on one persistent pool
+
+    Returns:
+    -----------------------------
+        : timings (dict): stage name -> seconds
+    """
+    timings = {}
+    with transformer.open_pool() as pool:
+        # start the workers before timing
+        transformer.process_tiles(stack[:, :1], pool=pool)
+
+        processed = transformer.process_tiles(stack, pool=pool)
+        timings['process_tiles'] = best_time(lambda: transformer.process_tiles(stack, pool=pool),
+                                             repeats)
+        stitched = transformer.stitch(processed)
+        timings['stitch'] = best_time(lambda: transformer.stitch(processed), repeats)
+        timings['process_stitched'] = best_time(lambda: transformer.process_stitched(stitched, pool=pool),
+                                                repeats)
+    return timings
+
+
+def compare(results, baseline, threshold):
+    """A function to flag timings slower than the baseline
+
+    Parameters:
+    -----------------------------
+        : results (dict): benchmark name -> seconds
+        : baseline (dict): benchmark name -> seconds
+        : threshold (float): allowed relative slowdown, e.g. 0.25
+
+    Returns:
+    -----------------------------
+        : regressions (list of str): names of the regressed benchmarks
+    """
+    regressions = []
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if not isinstance(seconds, float) or not isinstance(base, float):
+            continue
+
+        ratio = seconds / base
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- REGRESSION"
+            regressions.append(name)
+        print(f"{name:<45} {base * 1e3:>10.2f}ms -> {seconds * 1e3:>10.2f}ms ({ratio:.2f}x){flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--params", default=DEFAULT_PARAMS,
+                        help="parameter file with the op params and channel recipes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512])
+    parser.add_argument("--procs", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--timepoints", type=int, default=2)
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--tiles", type=int, default=4)
+    parser.add_argument("--dtype", default="uint16")
+    parser.add_argument("--content", default="blobs", choices=["blobs", "noise"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--baseline", default=None,
+                        help="baseline file, defaults to baselines/<host>.json")
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args, unknown = parser.parse_known_args()
+
+    params = _read.load_params(args.params)
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f"{platform.node()}.json")
+
+    results = {}
+    for size in args.sizes:
+        stack = make_stack(args.timepoints, args.channels, args.tiles, size,
+                           args.dtype, content=args.content)
+        frames = stack[0, 0, 0]
+        config = f"{args.dtype}/{args.content}/{size}"
+
+        transformer = make_transformer(params, stack, procs=1)
+        for op, seconds in time_ops(transformer, frames, args.repeats).items():
+            results[f"op/{op}/{config}"] = seconds
+        for name, seconds in time_recipes(transformer, frames, args.repeats).items():
+            results[f"recipe/{name}/{config}"] = seconds
+
+        for procs in args.procs:
+            transformer = make_transformer(params, stack, procs=procs)
+            for stage, seconds in time_pipeline(transformer, stack, args.repeats).items():
+                results[f"{stage}/{config}/procs={procs}"] = seconds
+
+    for name, seconds in results.items():
+        if isinstance(seconds, float):
+            print(f"{name:<45} {seconds * 1e3:>10.2f}ms")
+        else:
+            print(f"{name:<45} {seconds}")
+
+    regressions = []
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        print(f"\ncompared to: {baseline_path} ({baseline['created']})")
+        regressions = compare(results, baseline['results'], args.threshold)
+        print(f"regressions above {args.threshold:.0%}: {len(regressions)}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        baseline = {
+            'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'machine': platform.platform(),
+            'processor': platform.processor(),
+            'numpy': np.__version__,
+            'args': vars(args),
+            'results': results,
+        }
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f, indent=1)
+        print(f"Saved: `{baseline_path}`")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(f"{len(regressions)} benchmarks regressed")
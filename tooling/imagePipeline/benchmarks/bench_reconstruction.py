@@ -0,0 +1,108 @@
+"""
+Benchmarks the fast reconstruction by dilation against the skimage 
+baseline on synthetic frames, for the seeds used by the `dilate` and 
+`dilate_s` ops, and checks that the outputs are identical.
+
+EXAMPLE run from: tooling/
+
+python imagePipeline/benchmarks/bench_reconstruction.py --size 1024 --frames 8 --threads 4
+"""
+
+import argparse
+import sys
+import os
+import time
+import numpy as np
+from scipy import ndimage as ndi
+from skimage.morphology import reconstruction
+
+# make local modules discoverable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+import imagePipeline.preprocess_funcs.morphology as _morph
+
+
+def make_frames(n_frames, size, dtype, seed=0):
+    """A function to make blob-like frames on a smooth background
+    
+    Parameters:
+    -----------------------------
+        : n_frames (int): number of frames
+        : size (int): frame height and width
+        : dtype (str): frame dtype
+        : seed (int): random seed
+        
+    Returns:
+    -----------------------------
+        : frames (np.array): (n_frames, size, size) stack
+    """
+    rng = np.random.default_rng(seed)
+    frames = rng.random((n_frames, size, size))
+    frames = ndi.gaussian_filter(frames, sigma=(0, 4, 4))
+    yy, xx = np.mgrid[0:size, 0:size] / size
+    frames = frames + 0.5 * (yy + xx)[None]
+    frames = (frames - frames.min()) / (frames.max() - frames.min())
+    
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        return (frames * np.iinfo(dtype).max).astype(dtype)
+    return frames.astype(dtype)
+
+
+def get_seeds(frames, box_size=1, h=0.2):
+    """A function to return the seeds of the `dilate` and `dilate_s` ops
+    
+    Parameters:
+    -----------------------------
+        : frames (np.array): (n_frames, Y, X) stack
+        : box_size (int): `dilation_box_size`
+        : h (float): `static_dilation_h`, as a fraction of the dtype range
+        
+    Returns:
+    -----------------------------
+        : seeds (dict): op name -> seed stack
+    """
+    dilate = np.copy(frames)
+    dilate[:, box_size:-box_size, box_size:-box_size] = frames.min()
+    
+    scale = np.iinfo(frames.dtype).max if np.issubdtype(frames.dtype, np.integer) else 1.0
+    dilate_s = frames - h * scale
+    return {'dilate': dilate, 'dilate_s': dilate_s}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--frames", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--dtypes", nargs="+", default=["uint16", "float32"])
+    args, unknown = parser.parse_known_args()
+    
+    for dtype in args.dtypes:
+        # compile once before timing
+        small = make_frames(1, 16, dtype)
+        for seeds in get_seeds(small).values():
+            _morph.reconstruct_dilation(seeds, small)
+        
+        frames = make_frames(args.frames, args.size, dtype)
+        
+        for op, seeds in get_seeds(frames).items():
+            start = time.time()
+            baseline = np.stack([reconstruction(s, f, method='dilation') 
+                                 for s, f in zip(seeds, frames)])
+            t_skimage = time.time() - start
+            
+            start = time.time()
+            fast = _morph.reconstruct_dilation(seeds, frames)
+            t_fast = time.time() - start
+            
+            start = time.time()
+            fast_threaded = _morph.reconstruct_dilation(seeds, frames, n_threads=args.threads)
+            t_threaded = time.time() - start
+            
+            match = np.array_equal(baseline, fast) and np.array_equal(baseline, fast_threaded)
+            print(f"{dtype:>8} {op:>9} | skimage: {t_skimage:.3f}s "
+                  f"| fast: {t_fast:.3f}s ({t_skimage / t_fast:.1f}x) "
+                  f"| fast {args.threads} threads: {t_threaded:.3f}s ({t_skimage / t_threaded:.1f}x) "
+                  f"| match: {match}")
+            
+            if not match:
+                sys.exit(f"outputs differ for {dtype} {op}")
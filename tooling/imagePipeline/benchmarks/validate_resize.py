@@ -0,0 +1,130 @@
+"""
+Validates the block-mean resize fast path (`resize_method` 'block_mean')
+against the anti-aliased `transform.resize` results ('interpolate'), for
+`stitch` with integer `quilt_resize_factor` and for the `resize` op with
+integer `tile_resize_factor`, on synthetic stacks. For each case it prints
+the time and peak allocation of both methods and the error of the fast path
+relative to the intensity range, and exits with an error if the PSNR is
+below --min-psnr.
+
+EXAMPLE run from: tooling/
+
+python imagePipeline/benchmarks/validate_resize.py --factors 2 4 --size 512
+"""
+
+import argparse
+import sys
+import os
+import time
+import tracemalloc
+import numpy as np
+
+# make local modules discoverable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+import imagePipeline.data_io.loaders as _read
+import imagePipeline.benchmarks.bench_ops as _bench
+
+
+def measure(func):
+    """A function to run a function once, with its wall time and peak
+    allocation
+
+    Returns:
+    -----------------------------
+        : result: the return value
+        : seconds (float): wall time
+        : peak_mb (float): peak bytes allocated, in MB
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 1024 ** 2
+
+
+def get_errors(fast, reference):
+    """A function to compare the fast path to the reference
+
+    Parameters:
+    -----------------------------
+        : fast (np.array): block-mean results
+        : reference (np.array): `transform.resize` results
+
+    Returns:
+    -----------------------------
+        : errors (dict): max and mean absolute error, as a fraction of the
+        reference intensity range, and the PSNR in dB
+    """
+    fast = fast.astype(np.float64)
+    reference = reference.astype(np.float64)
+    value_range = max(reference.max() - reference.min(), 1e-12)
+
+    diff = np.abs(fast - reference) / value_range
+    mse = np.mean(diff ** 2)
+    psnr = 10 * np.log10(1 / mse) if mse > 0 else np.inf
+    return {'max_abs': diff.max(), 'mean_abs': diff.mean(), 'psnr': psnr}
+
+
+def run_case(params, stack, name, func):
+    """A function to run one case with both resize methods
+
+    Parameters:
+    -----------------------------
+        : params (dict): the parameter file, with the case's factors set
+        : stack (np.array): (1, T, C, tiles, Y, X) stack
+        : name (str): case name
+        : func (callable): transformer -> result
+
+    Returns:
+    -----------------------------
+        : psnr (float)
+    """
+    results = {}
+    for method in ('interpolate', 'block_mean'):
+        case_params = dict(params, resize_method=method)
+        transformer = _bench.make_transformer(case_params, stack, procs=1)
+        results[method] = measure(lambda: func(transformer))
+
+    reference, ref_s, ref_mb = results['interpolate']
+    fast, fast_s, fast_mb = results['block_mean']
+    errors = get_errors(fast, reference)
+
+    print(f"{name:<28} interpolate {ref_s * 1e3:>9.1f}ms {ref_mb:>8.1f}MB | "
+          f"block_mean {fast_s * 1e3:>9.1f}ms {fast_mb:>8.1f}MB | "
+          f"max {errors['max_abs']:.4f} mean {errors['mean_abs']:.5f} psnr {errors['psnr']:.1f}dB")
+    return errors['psnr']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--params", default=_bench.DEFAULT_PARAMS)
+    parser.add_argument("--factors", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--timepoints", type=int, default=2)
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--tiles", type=int, default=4)
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--min-psnr", type=float, default=30.0)
+    args, unknown = parser.parse_known_args()
+
+    params = _read.load_params(args.params)
+    params['output_dtype'] = args.dtype
+    stack = _bench.make_stack(args.timepoints, args.channels, args.tiles,
+                              args.size, args.dtype)
+    frame = stack[0, 0, 0, 0]
+
+    psnrs = []
+    for rf in args.factors:
+        case = dict(params, quilt_resize_factor=rf, stitch_overlap=0.0, stitch_register=False)
+        psnrs.append(run_case(case, stack, f"stitch rf={rf}",
+                              lambda t: t.stitch(stack)))
+
+        case = dict(params, tile_resize_factor=rf)
+        psnrs.append(run_case(case, stack, f"resize op rf={rf}",
+                              lambda t: t._resize(frame)))
+
+    failed = [p for p in psnrs if p < args.min_psnr]
+    if failed:
+        sys.exit(f"{len(failed)} cases below {args.min_psnr}dB PSNR")
@@ -5,6 +5,7 @@ wrapper around czi loading to coerse into standard structure
 import os
 import sys
 import json
+import hashlib
 from easydict import EasyDict
 from datetime import datetime
 import numpy as np
@@ -14,6 +15,12 @@ from xml.etree import ElementTree
 import xmltodict
 from pandas.io.json._normalize import nested_to_record   
 
+import imagePipeline.utils.op_cache as _cache
+
+
+# bump when the selected metadata changes, to invalidate sidecars
+METADATA_CACHE_VERSION = 2
+
 
 ############################################################
 # FUNCTIONS
@@ -76,7 +83,8 @@ class cziLoader():
             paths.append(os.path.abspath(full_path))
             
         if len(paths) > 1:
-            msg = f"Current pipeline optimized for single image input. Found {len(paths)}."
+            msg = (f"Current pipeline optimized for single image input. Found {len(paths)}. "
+                   "Use run_schedule.py to process every file and scene.")
             warnings.warn(msg)
             
         return paths
@@ -85,9 +93,33 @@ class cziLoader():
     #############################################
     # metadata operations 
     #############################################
+    def _subtree_to_value(self, element):
+        """A function to convert a single element the way `xmltodict` 
+        does: its text if it is a plain leaf, otherwise a flattened 
+        "key=value" string of the subtree.
+        
+        Parameters:
+        ----------------------------- 
+           : element (Element): the xml element
+            
+        Returns:
+        -----------------------------
+            : value (str or None)
+        """
+        if len(element) == 0 and not element.attrib:
+            return element.text
+        
+        xml_str = ElementTree.tostring(element, encoding='unicode')
+        value = xmltodict.parse(xml_str)[element.tag]
+        if value is None or isinstance(value, str):
+            return value
+        return ".....".join([f"{l}={p}" for l,p in nested_to_record(dict(value)).items()])
+    
+    
     def select_metadata(self, metadata):
-        """A function to parse the czi metadata. Note - 
-        this is a gross way to do this.
+        """A function to parse the czi metadata. Only the elements used 
+        are looked up by path, and only small subtrees (e.g. one channel 
+        setting) are converted to dicts.
         
         Parameters:
         ----------------------------- 
@@ -99,48 +131,108 @@ class cziLoader():
         """
         
         select_metadata = {}
-        xml_str = ElementTree.tostring(metadata, encoding='unicode')
-        root_dict = xmltodict.parse(xml_str)
-        
-        meta_dict = root_dict['ImageDocument']['Metadata']
+        meta = metadata if metadata.tag == 'Metadata' else metadata.find('Metadata')
         
         # get application information
-        select_metadata['ImagePixelSize'] = meta_dict['ImageScaling']['ImagePixelSize']
-        select_metadata['Application_Name'] = meta_dict['Information']['Application']['Name']
-        select_metadata['Application_Version'] = meta_dict['Information']['Application']['Version']
-        select_metadata['Application_Build'] = meta_dict['Information']['Application']['BuildId']
+        select_metadata['ImagePixelSize'] = meta.findtext('ImageScaling/ImagePixelSize')
+        select_metadata['Application_Name'] = meta.findtext('Information/Application/Name')
+        select_metadata['Application_Version'] = meta.findtext('Information/Application/Version')
+        select_metadata['Application_Build'] = meta.findtext('Information/Application/BuildId')
         
         # get scaling details
-        for k, v in meta_dict['Scaling']['AutoScaling'].items():
-            new_key = f"Scaling_{k}"
-            select_metadata[new_key] = v
+        for k in meta.findall('Scaling/AutoScaling/*'):
+            new_key = f"Scaling_{k.tag}"
+            select_metadata[new_key] = self._subtree_to_value(k)
             
-        for k in meta_dict['Scaling']['Items']['Distance']:
-            new_key = f"Scaling_Dimension_{k['@Id']}"
-            new_value = f"{k['Value']}{k['DefaultUnitFormat']}"
+        for k in meta.findall('Scaling/Items/Distance'):
+            new_key = f"Scaling_Dimension_{k.get('Id')}"
+            new_value = f"{k.findtext('Value')}{k.findtext('DefaultUnitFormat')}"
             select_metadata[new_key] = new_value
               
         # get channel acquisition details
-        for k,v in meta_dict['Information']['Image'].items():
-            if isinstance(v, str):
-                select_metadata[k] = v
+        for k in meta.findall('Information/Image/*'):
+            if len(k) == 0 and not k.attrib and k.text is not None:
+                select_metadata[k.tag] = k.text
                 
-            if k == 'Dimensions':
-                chan = v['Channels']['Channel']
-                for c in chan:
-                    channel_name = c['@Name']
-                    for i, j in c.items():
-                        new_key = channel_name + "_" + i
-                        if '@' in i:
-                            continue
-                        if isinstance(j, str):
-                            select_metadata[new_key] = j
-                        elif j is not None:
-                            new_j = ".....".join([f"{l}={p}" for l,p in nested_to_record(dict(j)).items()])
-                            select_metadata[new_key] = new_j
+        for c in meta.findall('Information/Image/Dimensions/Channels/Channel'):
+            channel_name = c.get('Name')
+            for i in c:
+                new_key = channel_name + "_" + i.tag
+                j = self._subtree_to_value(i)
+                if j is not None:
+                    select_metadata[new_key] = j
         return select_metadata
     
     
+    def _get_metadata_cache_path(self, path):
+        """A function to return the metadata sidecar for an input file. 
+        Sidecars live in `metadata_cache_directory`, by default a hidden 
+        directory in the output directory, and are keyed by the file 
+        identity (path, size, mtime).
+        
+        Parameters:
+        ----------------------------- 
+            : path (str): input file
+                
+        Returns:
+        -----------------------------
+            : cache_path (str): or None, when there is nowhere to cache
+        """
+        directory = self.params.get('metadata_cache_directory')
+        if directory is None and self.params.get('output_directory'):
+            directory = os.path.join(self.params['output_directory'], '.metadata_cache')
+        if not directory:
+            return None
+        
+        identity = _cache.file_identity(path)
+        identity['version'] = METADATA_CACHE_VERSION
+        spec = json.dumps(identity, sort_keys=True)
+        key = hashlib.sha256(spec.encode()).hexdigest()[:16]
+        
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(os.path.abspath(directory), f"{stem}_{key}.json")
+    
+    
+    def _load_cached_metadata(self, path):
+        """A function to read a metadata sidecar, if there is one
+        
+        Returns:
+        -----------------------------
+            : spec (dict): or None
+        """
+        cache_path = self._get_metadata_cache_path(path)
+        if cache_path is None or not os.path.exists(cache_path):
+            return None
+        
+        try:
+            with open(cache_path) as f:
+                spec = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        
+        for key in ('file_shape', 'image_shape'):
+            spec[key] = tuple(spec[key])
+        return spec
+    
+    
+    def _save_cached_metadata(self, path, spec):
+        """A function to write a metadata sidecar. Failures are not 
+        fatal, the metadata is then parsed again on the next run.
+        """
+        cache_path = self._get_metadata_cache_path(path)
+        if cache_path is None:
+            return
+        
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(spec, f, default=str)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            warnings.warn(f"could not cache metadata: {e}")
+    
+    
     def _get_spec(self, czi):
         """A function to report all metadata for a loaded file.
         
@@ -155,6 +247,7 @@ class cziLoader():
         _names = czi.get_channel_names()
         spec = {
             'file_shape' : czi.shape,
+            'n_scenes': len(czi.scenes),
             'image_shape' : czi.shape[-2:],
             'n_tiles': czi.shape[3],
             'n_timepoints': czi.shape[1],
@@ -171,16 +264,48 @@ class cziLoader():
     #############################################
     # item selection
     #############################################
-    def get_item(self, index):
+    def get_metadata(self, index, czi=None):
+        """A function to return the metadata for a single file, from its 
+        sidecar when the file has not changed since it was written
+        
+        Parameters:
+        ----------------------------- 
+            : index (int): zero indexed position of the file in self.paths
+            : czi (CziReader): optional, an open reader for the file
+                
+        Returns:
+        -----------------------------
+            : metadata (dict): metadata for the images
+        """
+        path = self.input_paths[index]
+        
+        metadata = self._load_cached_metadata(path)
+        if metadata is None:
+            if czi is None:
+                czi = CziReader(path)
+            metadata = self._get_spec(czi)
+            self._save_cached_metadata(path, metadata)
+            
+        metadata['czi_path'] = path
+        return metadata
+    
+    
+    def get_item(self, index, lazy=False, scene=None):
         """A function to return the image and metadata for a single file
         
         Parameters:
         ----------------------------- 
             : index (int): zero indexed position of the file in self.paths
+            : lazy (bool): if True, return a lazy view of the image data 
+            chunked by single (Y, X) planes instead of the reader. Planes are 
+            only read from disk when a block of the view is indexed.
+            : scene (int): optional scene to select. The reader (and its 
+            view) only holds its current scene, the first by default.
                 
         Returns:
         -----------------------------
-            : czi (image array): the images
+            : czi (image array): the images (the reader, or a dask array 
+            if `lazy`)
             : metadata (dict): metadata for the images
         """
         path = self.input_paths[index]
@@ -189,7 +314,31 @@ class cziLoader():
         czi = CziReader(path)
         
         # load metadata
-        metadata = self._get_spec(czi)
-        metadata['czi_path'] = path        
+        metadata = self.get_metadata(index, czi=czi)
         
-        return czi, metadata
\ No newline at end of file
+        if scene is not None:
+            czi.set_scene(scene)
+        
+        if lazy:
+            return czi.dask_data, metadata
+        
+        return czi, metadata
+    
+    
+    def iter_scenes(self, index):
+        """A generator of the lazy view of every scene of a file, see 
+        `get_item`. The reader holds one scene at a time, so each view 
+        should be read before the next is requested.
+        
+        Parameters:
+        ----------------------------- 
+            : index (int): zero indexed position of the file in self.paths
+                
+        Yields:
+        -----------------------------
+            : scene (dask.array): (T, C, tiles, Y, X) image of the scene
+        """
+        czi = CziReader(self.input_paths[index])
+        for scene in range(len(czi.scenes)):
+            czi.set_scene(scene)
+            yield czi.dask_data[0]
\ No newline at end of file
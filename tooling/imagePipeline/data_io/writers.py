@@ -4,9 +4,24 @@ import json
 from easydict import EasyDict
 from datetime import datetime
 import numpy as np
-import shutil
+import tifffile
 import aicsimageio
 from aicsimageio.writers import OmeTiffWriter
+from concurrent.futures import ThreadPoolExecutor
+
+import imagePipeline.utils.tensor_ops as _tensor
+
+
+# `output_format` options, see `OutputWriter.write_stream`
+OUTPUT_FORMATS = ('ome-tiff', 'ome-zarr', 'pyramidal-ome-tiff')
+
+# defaults for the chunked formats
+DEFAULT_COMPRESSION = 'zstd'
+DEFAULT_PYRAMID_LEVELS = 4
+DEFAULT_CHUNK_SIZE = 512
+
+# bound on concurrent file writes in `write_tiles`
+DEFAULT_WRITE_THREADS = 8
 
 
 #############################################################
@@ -17,18 +32,20 @@ class OutputWriter():
     """A class to write OME tiff files from numpy arrays and
     final metadata and parameters used """
     
-    def __init__(self, params, metadata):
+    def __init__(self, params, metadata, base_name=None):
         """
         Parameters:
         ----------------------------- 
             : params (dict): dictionary of parameters specified for the run
             : metadata (dict): the czi_metadata
             : output_dir (str): output file directory for all results
+            : base_name (str): optional name for the outputs, defaults to 
+            the input file name
         """
         self.params = params
         self.metadata = metadata
         self.output_dir = self._get_output_path()
-        self.base_name = self._get_basename()
+        self.base_name = base_name or self._get_basename()
     
     
     #############################################
@@ -59,7 +76,8 @@ class OutputWriter():
      
 
     def _get_new_dir(self):
-        """removes and recreates a directory for tile files
+        """creates, if needed, a directory for tile files. Existing files 
+        are kept, and replaced one by one as new tiles are written.
         
         Returns:
         ----------------------------- 
@@ -67,26 +85,80 @@ class OutputWriter():
             tile files 
         """
         new_dir = f"{self.output_dir}{self.base_name}/"
+        os.makedirs(new_dir, exist_ok=True)
+        return new_dir
         
-        if os.path.exists(new_dir):
-            shutil.rmtree(new_dir)
         
-        os.makedirs(new_dir)
+    def _as_output_dtype(self, data):
+        """A function to convert data to the `output_dtype` in the params, 
+        if one is set
         
-        return new_dir
+        Parameters:
+        ----------------------------- 
+            : data (np.array): image array
+            
+        Returns:
+        ----------------------------- 
+            : data (np.array): image array in the output dtype
+        """
+        dtype = self.params.get('output_dtype')
+        if dtype is None:
+            return data
+        return _tensor.as_dtype(data, dtype)
+    
+    
+    def _get_output_format(self):
+        """A function to return the `output_format` in the params
+        
+        Returns:
+        ----------------------------- 
+            : output_format (str): one of OUTPUT_FORMATS
+        """
+        output_format = self.params.get('output_format', 'ome-tiff')
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}, got {output_format}")
+        return output_format
+    
+    
+    def _iter_levels(self, blocks, n_levels):
+        """A function to convert streamed blocks to the output dtype and 
+        compute their pyramid, each level halving Y and X
         
+        Parameters:
+        ----------------------------- 
+            : blocks (iterable of np.array): 6d blocks of consecutive timepoints
+            : n_levels (int): number of levels, including full resolution
+            
+        Yields:
+        ----------------------------- 
+            : t_start (int): the first timepoint of the block
+            : levels (list of np.array): (T, C, Z, Y, X) block at each level
+        """
+        t_start = 0
+        for block in blocks:
+            levels = [self._as_output_dtype(block[0])]
+            for _ in range(1, n_levels):
+                levels.append(_tensor.block_mean(levels[-1], 2))
+            yield t_start, levels
+            t_start += levels[0].shape[0]
+    
         
     #############################################
     # writers
     #############################################
     def write_ome(self, czi_data):
-        """A function to save an OME .tiff 
+        """A function to save an OME .tiff, or the `output_format` in the 
+        params
         
         Parameters:
         ----------------------------- 
             : czi_data (np.array): 6d image array
         """
-        scene = czi_data[0]
+        if self._get_output_format() != 'ome-tiff':
+            self.write_stream([czi_data], czi_data.shape)
+            return
+        
+        scene = self._as_output_dtype(czi_data[0])
         scene = np.moveaxis(scene, 1, 2)
         
         output_file_name = f"OME_{self.base_name}.tiff"
@@ -98,19 +170,224 @@ class OutputWriter():
         print(f"saved: {outpath}")
         
     
+    def write_stream(self, blocks, shape):
+        """A function to save streamed blocks in the `output_format` of the 
+        params:
+        
+            'ome-tiff': a single resolution, uncompressed OME .tiff
+            'ome-zarr': a chunked, compressed, multiscale OME-Zarr store
+            'pyramidal-ome-tiff': a tiled, compressed OME .tiff with 
+            sub-resolutions
+        
+        The chunked formats are configured with `output_compression` 
+        ('zstd', 'zlib' or None), `output_pyramid_levels` (including full 
+        resolution) and `output_chunk_size` (Y and X of a chunk or tile).
+        
+        Parameters:
+        ----------------------------- 
+            : blocks (iterable of np.array): 6d image arrays holding 
+            consecutive timepoints, e.g. `ParallelTransformer.iter_blocks`
+            : shape (tuple): 6d shape of the full image array
+        """
+        output_format = self._get_output_format()
+        if output_format == 'ome-zarr':
+            self.write_zarr_stream(blocks, shape)
+        elif output_format == 'pyramidal-ome-tiff':
+            self.write_pyramid_stream(blocks, shape)
+        else:
+            self.write_ome_stream(blocks, shape)
+    
+    
+    def write_zarr_stream(self, blocks, shape):
+        """A function to save streamed blocks as an OME-Zarr (NGFF 0.4) 
+        store with axes TCZYX (tiles as Z). Each level of the pyramid is 
+        computed from the block as it arrives, and the chunks of a block 
+        are compressed and written by `parallel_procs` threads.
+        
+        Parameters:
+        ----------------------------- 
+            : blocks (iterable of np.array): 6d image arrays holding 
+            consecutive timepoints
+            : shape (tuple): 6d shape of the full image array
+        """
+        import zarr
+        from numcodecs import Blosc, Zlib
+        
+        dtype = np.dtype(self.params.get('output_dtype', 'float64'))
+        compression = self.params.get('output_compression', DEFAULT_COMPRESSION)
+        n_levels = int(self.params.get('output_pyramid_levels', DEFAULT_PYRAMID_LEVELS))
+        chunk = int(self.params.get('output_chunk_size', DEFAULT_CHUNK_SIZE))
+        n_threads = int(self.params.get('parallel_procs', 1))
+        
+        compressor = None
+        if compression == 'zstd':
+            compressor = Blosc(cname='zstd', clevel=5, shuffle=Blosc.BITSHUFFLE)
+        elif compression == 'zlib':
+            compressor = Zlib(level=6)
+        
+        outpath = os.path.abspath(f"{self.output_dir}OME_{self.base_name}.zarr")
+        store = zarr.DirectoryStore(outpath, dimension_separator='/')
+        root = zarr.group(store=store, overwrite=True)
+        
+        n_t, n_c, n_z, n_y, n_x = shape[1:]
+        arrays = []
+        datasets = []
+        for level in range(n_levels):
+            f = 2 ** level
+            level_shape = (n_t, n_c, n_z, n_y // f, n_x // f)
+            arrays.append(root.create_dataset(str(level), 
+                                              shape=level_shape, 
+                                              chunks=(1, 1, 1, chunk, chunk),
+                                              dtype=dtype, 
+                                              compressor=compressor))
+            datasets.append({
+                'path': str(level),
+                'coordinateTransformations': [{'type': 'scale', 
+                                               'scale': [1, 1, 1, f, f]}],
+            })
+        
+        root.attrs['multiscales'] = [{
+            'version': '0.4',
+            'name': self.base_name,
+            'axes': [
+                {'name': 't', 'type': 'time'},
+                {'name': 'c', 'type': 'channel'},
+                {'name': 'z', 'type': 'space'},
+                {'name': 'y', 'type': 'space'},
+                {'name': 'x', 'type': 'space'},
+            ],
+            'datasets': datasets,
+        }]
+        
+        def write_chunks(task):
+            arr, data, t_start, c, z = task
+            arr[t_start:t_start + data.shape[0], c, z] = data[:, c, z]
+        
+        with ThreadPoolExecutor(max(1, n_threads)) as executor:
+            for t_start, levels in self._iter_levels(blocks, n_levels):
+                tasks = [(arr, data, t_start, c, z) 
+                         for arr, data in zip(arrays, levels)
+                         for c in range(n_c) for z in range(n_z)]
+                list(executor.map(write_chunks, tasks))
+        print(f"saved: {outpath}")
+    
+    
+    def write_pyramid_stream(self, blocks, shape):
+        """A function to save streamed blocks as a tiled, compressed OME 
+        .tiff with sub-resolutions, axes TZCYX (tiles as Z). Full resolution 
+        planes are written as they arrive. TIFF stores each resolution after 
+        the full one, so the reduced levels (1/3 of the full size in total) 
+        are spooled to temporary files next to the output until the end.
+        
+        Parameters:
+        ----------------------------- 
+            : blocks (iterable of np.array): 6d image arrays holding 
+            consecutive timepoints
+            : shape (tuple): 6d shape of the full image array
+        """
+        dtype = np.dtype(self.params.get('output_dtype', 'float64'))
+        compression = self.params.get('output_compression', DEFAULT_COMPRESSION)
+        n_levels = int(self.params.get('output_pyramid_levels', DEFAULT_PYRAMID_LEVELS))
+        chunk = int(self.params.get('output_chunk_size', DEFAULT_CHUNK_SIZE))
+        n_threads = int(self.params.get('parallel_procs', 1))
+        tile = (max(16, chunk // 16 * 16),) * 2
+        
+        n_t, n_c, n_z, n_y, n_x = shape[1:]
+        outpath = os.path.abspath(f"{self.output_dir}OME_{self.base_name}.tiff")
+        
+        spools = []
+        for level in range(1, n_levels):
+            f = 2 ** level
+            spools.append(np.lib.format.open_memmap(f"{outpath}.level{level}.npy", mode='w+', 
+                                                    dtype=dtype, 
+                                                    shape=(n_t, n_z, n_c, n_y // f, n_x // f)))
+        
+        def tiles():
+            # tiled pages are written from an iterator of tiles, row-major
+            for t_start, levels in self._iter_levels(blocks, n_levels):
+                # same layout as `write_ome`: TZCYX
+                levels = [np.moveaxis(data, 1, 2) for data in levels]
+                n = levels[0].shape[0]
+                for spool, data in zip(spools, levels[1:]):
+                    spool[t_start:t_start + n] = data
+                for plane in levels[0].reshape(-1, n_y, n_x):
+                    for y in range(0, n_y, tile[0]):
+                        for x in range(0, n_x, tile[1]):
+                            yield plane[y:y + tile[0], x:x + tile[1]]
+        
+        options = {'tile': tile, 'compression': compression, 'maxworkers': max(1, n_threads)}
+        try:
+            with tifffile.TiffWriter(outpath, bigtiff=True, ome=True) as tif:
+                tif.write(tiles(), 
+                          shape=(n_t, n_z, n_c, n_y, n_x), 
+                          dtype=dtype, 
+                          subifds=len(spools),
+                          metadata={'axes': 'TZCYX'},
+                          **options)
+                for spool in spools:
+                    tif.write(spool, subfiletype=1, **options)
+        finally:
+            paths = [spool.filename for spool in spools]
+            spools.clear()
+            for path in paths:
+                os.remove(path)
+        print(f"saved: {outpath}")
+    
+    
+    def write_ome_stream(self, blocks, shape):
+        """A function to save an OME .tiff incrementally, as blocks of 
+        timepoints are produced. Only one block is held in memory.
+        
+        Parameters:
+        ----------------------------- 
+            : blocks (iterable of np.array): 6d image arrays holding 
+            consecutive timepoints, e.g. `ParallelTransformer.iter_blocks`
+            : shape (tuple): 6d shape of the full image array
+        """
+        dtype = np.dtype(self.params.get('output_dtype', 'float64'))
+        
+        # same layout as `write_ome`: tiles are written as Z
+        n_t, n_c, n_z, n_y, n_x = shape[1:]
+        ome_shape = (n_t, n_z, n_c, n_y, n_x)
+        
+        output_file_name = f"OME_{self.base_name}.tiff"
+        outpath = f"{self.output_dir}{output_file_name}"
+        outpath = os.path.abspath(outpath)
+        
+        def planes():
+            for block in blocks:
+                scene = self._as_output_dtype(block[0])
+                scene = np.moveaxis(scene, 1, 2)
+                for plane in scene.reshape(-1, n_y, n_x):
+                    yield plane
+        
+        with tifffile.TiffWriter(outpath, bigtiff=True, ome=True) as tif:
+            tif.write(planes(), 
+                      shape=ome_shape, 
+                      dtype=dtype, 
+                      metadata={'axes': 'TZCYX'})
+        print(f"saved: {outpath}")
+        
+        
     def write_tiles(self, czi_data):
-        """A function to save an OME .tiff for each tile
+        """A function to save an OME .tiff for each tile. Tiles are written 
+        concurrently by up to `output_write_threads` threads, compressed 
+        with `output_compression` ('zstd', 'zlib' or None, all lossless), 
+        each to a temporary file that is renamed into place once complete, 
+        so a file in the tile directory is never partially written.
         
         Parameters:
         ----------------------------- 
             : czi_data (np.array): 6d image array
         """
-        scene = czi_data[0]
+        scene = self._as_output_dtype(czi_data[0])
         scene = np.moveaxis(scene, 2, 0)
         
         new_dir = self._get_new_dir()
+        compression = self.params.get('output_compression')
+        n_threads = int(self.params.get('output_write_threads', DEFAULT_WRITE_THREADS))
         
-        for tile in range(scene.shape[0]):
+        def write_tile(tile):
             tile_row = int(tile / self.params['grid_shape'][1]) + 1
             tile_column = (tile % self.params['grid_shape'][1]) + 1
         
@@ -118,15 +395,25 @@ class OutputWriter():
             outpath = f"{new_dir}/{file_name}"
             outpath = os.path.abspath(outpath)
             
-            print(outpath)
-            
-            # reformat to make OME format more consistent
+            # reformat to make OME format more consistent: TZCYX, Z=1
             save_tile = scene[tile]
             save_tile = np.expand_dims(save_tile, 1)
-                    
-            _writer = OmeTiffWriter(outpath, overwrite_file=True)
-            _writer.save(data=save_tile)
+            
+            tmp_path = f"{outpath}.{os.getpid()}.tmp"
+            try:
+                tifffile.imwrite(tmp_path, save_tile, 
+                                 bigtiff=True, 
+                                 ome=True, 
+                                 compression=compression, 
+                                 metadata={'axes': 'TZCYX'})
+                os.replace(tmp_path, outpath)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
             print(f"saved: {outpath}")
+        
+        with ThreadPoolExecutor(max(1, min(n_threads, scene.shape[0]))) as executor:
+            list(executor.map(write_tile, range(scene.shape[0])))
             
 
     def save_params(self):
@@ -146,6 +433,31 @@ class OutputWriter():
         print(f"Saved: `{outpath}`")
     
     
+    def save_profile(self, profile):
+        """A function to store the per-op profile of the run, see 
+        `ParallelTransformer.get_profile`
+        
+        Parameters:
+        -----------------------------
+            : profile (dict or None): nothing is written if None
+
+        Returns:
+        -----------------------------
+            : NA: prints confirmation
+        """
+        if profile is None:
+            return
+        
+        output_file_name = f"PROFILE_{self.base_name}.json"
+        outpath = f"{self.output_dir}{output_file_name}"
+        outpath = os.path.abspath(outpath)
+
+        with open(outpath, 'w') as f:
+            json.dump(profile, f, indent=1)
+
+        print(f"Saved: `{outpath}`")
+    
+    
     def save_metadata(self):
         """A function to store the select czi metadata
 
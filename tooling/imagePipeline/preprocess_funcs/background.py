@@ -0,0 +1,64 @@
+"""
+background estimation for the `ball` op
+
+`rolling_ball` wraps skimage's rolling ball with the configured radius,
+and adds a fast approximate mode: the image is min-pooled by an integer
+factor f, the rolling ball runs on the small image with an ellipsoid
+kernel (spatial semi-axis r / f, intensity r), and the background is
+upsampled bilinearly and clipped to the image. The cost drops by ~f^4.
+
+Error bound of the approximate mode, relative to the frame. Both
+backgrounds lie between the frame minimum and the frame (skimage's is an
+erosion whose kernel is 0 at the centre, the approximation is clipped),
+so |approx - exact| <= R, the frame range. The approximation only moves
+the minimum by the pooled block and its bilinear upsampling, so the
+error follows the change of the frame over a block: with L the largest
+difference between neighbouring pixels,
+
+    |approx - exact| <= min(R, 2 (f - 1) L)
+
+e.g. for a frame normalised to [0, 1] whose neighbouring pixels differ
+by at most 2% of the range, f = 2 is within 0.04 and f = 4 within 0.12.
+The 2 (f - 1) L term is measured, not proven: it is attained by a
+diagonal ramp (the Manhattan width of a block) and holds with margin on
+cells, noise and step edges for r = 5 to 50 and f = 2 to 8, see
+`tests/test_background.py`. It does not depend on r.
+"""
+
+import numpy as np
+from skimage import restoration, transform
+
+
+def rolling_ball(image, radius, downsample=1):
+    """A function to estimate the background of a frame with a rolling ball
+
+    Parameters:
+    -----------------------------
+        : image (np.array): 2d image
+        : radius (float): the ball radius, in pixels and intensity units
+        : downsample (int): if > 1, the min-pooling factor of the fast
+        approximate mode (see the module docstring for its error bound)
+
+    Returns:
+    -----------------------------
+        : background (np.array): background with the image dtype
+    """
+    f = int(downsample)
+    if f <= 1:
+        return restoration.rolling_ball(image, radius=radius)
+
+    ny, nx = image.shape
+    pad = ((0, -ny % f), (0, -nx % f))
+    padded = np.pad(image, pad, mode='edge')
+    small = padded.reshape(padded.shape[0] // f, f, padded.shape[1] // f, f).min(axis=(1, 3))
+
+    semi_axis = max(1, int(round(radius / f)))
+    kernel = restoration.ellipsoid_kernel((2 * semi_axis + 1, 2 * semi_axis + 1), radius)
+    small_background = restoration.rolling_ball(small.astype(np.float64), kernel=kernel)
+
+    # block centres map back to the centres of the pooled blocks
+    background = transform.resize(small_background, padded.shape, order=1,
+                                  mode='edge', anti_aliasing=False,
+                                  preserve_range=True)[:ny, :nx]
+    background = np.minimum(background, image)
+    return background.astype(image.dtype, copy=False)
@@ -0,0 +1,402 @@
+"""
+fused execution of runs of pointwise operations
+
+A run such as ["log", "gamma", "rescale"] is applied in a single pass over
+the frame: each cache-sized chunk is loaded once and every op is applied
+to it in place, reproducing the skimage semantics of each op (scaling by
+the dtype range, casting back to the input dtype after `log` and `gamma`,
+the float output of `rescale`). Only the output frame is allocated.
+
+Integer images (uint16) take a value's output from a lookup table
+instead: every op of a run is a function of the pixel value alone (the
+statistics of `rescale` and `stretch` are taken exactly from the frame's
+histogram of values), so the stages are applied once to each of the 65536
+possible values, and the frame is mapped with a single gather. When the
+output dtype is given, the final conversion is folded into the table, so
+a uint16 frame with a uint16 output is never expanded to floats.
+"""
+
+import numpy as np
+
+import imagePipeline.utils.tensor_ops as _tensor
+
+
+# ops that may be fused, if their parameters are known
+FUSABLE_OPS = ('log', 'gamma', 'rescale', 'stretch', 'stretch_global', 'rescale_global')
+
+# ops that take statistics of the whole image
+FRAME_STAT_OPS = ('rescale', 'stretch')
+
+# pixels per chunk: the float64 scratch buffer stays in L2 cache
+CHUNK_SIZE = 1 << 15
+
+# stage codes
+_LOG = 0
+_GAMMA = 1
+_LINEAR = 2
+
+# integer dtypes that are mapped through a lookup table of every value
+LUT_DTYPES = (
+    np.dtype(np.uint16),
+)
+
+# smaller frames are processed directly: building the table (one entry per
+# value) costs about as much as processing as many pixels
+LUT_MIN_PIXELS = 1 << 16
+
+SUPPORTED_DTYPES = (
+    np.dtype(np.float64),
+    np.dtype(np.float32),
+    np.dtype(np.uint16),
+)
+
+NEGATIVE_MSG = ("Image Correction methods work correctly only on "
+                "images with non-negative values. Use "
+                "skimage.exposure.rescale_intensity.")
+
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def supports(dtype):
+    """A function to check if a dtype can run through the fused kernels
+
+    Parameters:
+    -----------------------------
+        : dtype (np.dtype): image dtype
+
+    Returns:
+    -----------------------------
+        : supported (bool)
+    """
+    return np.dtype(dtype) in SUPPORTED_DTYPES
+
+
+def _dtype_scale(dtype):
+    """A function to return the non-negative range of a dtype, as used
+    by skimage's `adjust_log` and `adjust_gamma`
+
+    Parameters:
+    -----------------------------
+        : dtype (np.dtype): image dtype
+
+    Returns:
+    -----------------------------
+        : scale (float)
+    """
+    if np.issubdtype(dtype, np.floating):
+        return 1.0
+    return float(np.iinfo(dtype).max)
+
+
+def _float_type(dtype):
+    """A function to return the float dtype skimage's `rescale_intensity`
+    uses for a float output
+
+    Parameters:
+    -----------------------------
+        : dtype (np.dtype): image dtype
+
+    Returns:
+    -----------------------------
+        : float_dtype (np.dtype)
+    """
+    if dtype == np.float32:
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+
+def _apply_stage(buf, stage, scratch32):
+    """A function to apply one stage to a float64 chunk in place
+
+    Parameters:
+    -----------------------------
+        : buf (np.array): float64 chunk
+        : stage (tuple): (code, params, out_dtype)
+        : scratch32 (np.array): float32 buffer of the same size
+    """
+    code, params, out_dtype = stage
+
+    if code == _LOG:
+        scale, gain = params
+        if buf.size and buf.min() < 0:
+            raise ValueError(NEGATIVE_MSG)
+        buf /= scale
+        buf += 1
+        np.log2(buf, out=buf)
+        buf *= scale
+        buf *= gain
+
+    elif code == _GAMMA:
+        scale, gamma, gain = params
+        if buf.size and buf.min() < 0:
+            raise ValueError(NEGATIVE_MSG)
+        buf /= scale
+        np.power(buf, gamma, out=buf)
+        buf *= scale
+        buf *= gain
+
+    else:
+        imin, imax, omin, omax = params
+        np.clip(buf, imin, imax, out=buf)
+        if imin != imax:
+            buf -= imin
+            buf /= (imax - imin)
+            buf *= (omax - omin)
+            buf += omin
+        else:
+            np.clip(buf, omin, omax, out=buf)
+
+    # cast the result back, as skimage does with `.astype(dtype)`
+    if out_dtype == np.float32:
+        np.copyto(scratch32, buf)
+        np.copyto(buf, scratch32)
+    elif out_dtype == np.uint16:
+        # wraps like numpy's float -> uint16 cast
+        np.trunc(buf, out=buf)
+        np.mod(buf, 65536.0, out=buf)
+
+
+def _run_stages(flat, stages, out=None):
+    """A function to apply stages to a flat image, one cache-sized chunk
+    at a time, so no full-frame intermediate is allocated
+
+    Parameters:
+    -----------------------------
+        : flat (np.array): contiguous 1d image
+        : stages (list of tuple): (code, params, out_dtype)
+        : out (np.array): optional output of the final dtype, may be `flat`
+
+    Returns:
+    -----------------------------
+        : out (np.array): the processed 1d image
+    """
+    if out is None:
+        out = np.empty(flat.shape, dtype=stages[-1][2])
+
+    n = min(CHUNK_SIZE, flat.size)
+    buf = np.empty(n, dtype=np.float64)
+    scratch32 = np.empty(n, dtype=np.float32)
+
+    for start in range(0, flat.size, CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE, flat.size)
+        size = stop - start
+        chunk = buf[:size]
+        chunk[:] = flat[start:stop]
+        for stage in stages:
+            _apply_stage(chunk, stage, scratch32[:size])
+        out[start:stop] = chunk
+    return out
+
+
+def _get_min_max(values, counts=None):
+    """A function to return the min and max of an image, or of the values
+    of a histogram
+
+    Parameters:
+    -----------------------------
+        : values (np.array): 1d image, or the value of each histogram bin
+        : counts (np.array): optional, the pixel count of each bin
+
+    Returns:
+    -----------------------------
+        : v_min, v_max (float)
+    """
+    if counts is not None:
+        values = values[counts > 0]
+    return float(values.min()), float(values.max())
+
+
+def _get_percentiles(values, q, counts=None):
+    """A function to return percentiles of an image, or of the values of a
+    histogram, interpolated between the order statistics as `np.percentile`
+    does
+
+    Parameters:
+    -----------------------------
+        : values (np.array): 1d image, or the value of each histogram bin
+        : q (tuple): percentiles
+        : counts (np.array): optional, the pixel count of each bin
+
+    Returns:
+    -----------------------------
+        : percentiles (np.array)
+    """
+    if counts is None:
+        return np.percentile(values, q)
+
+    present = counts > 0
+    order = np.argsort(values[present], kind='stable')
+    sorted_values = values[present][order].astype(np.float64)
+    cumulative = np.cumsum(counts[present][order])
+    n = cumulative[-1]
+
+    # the ranks either side of each percentile, and the weight of the upper
+    index = np.asarray(q, dtype=np.float64) / 100 * (n - 1)
+    low = np.floor(index)
+    weight = index - low
+    ranks = np.stack([low, np.minimum(low + 1, n - 1)])
+    a, b = sorted_values[np.searchsorted(cumulative, ranks, side='right')]
+
+    diff = b - a
+    return np.where(weight >= 0.5, b - diff * (1 - weight), a + diff * weight)
+
+
+def _apply_run(flat, stages, counts=None):
+    """A function to apply a run of pointwise ops to a flat image
+
+    Parameters:
+    -----------------------------
+        : flat (np.array): contiguous 1d image, or every value of the 
+        dtype when `counts` is given
+        : stages (list of tuple): (op_name, value) pairs
+        : counts (np.array): optional, the pixel count of each value of 
+        `flat`, for the statistics of `rescale` and `stretch`
+
+    Returns:
+    -----------------------------
+        : flat (np.array): the processed 1d image
+    """
+    dtype = flat.dtype
+    owned = False
+    pending = []
+
+    for name, value in stages:
+        # the statistics of `rescale` and `stretch` need the intermediate
+        if name in FRAME_STAT_OPS and pending:
+            out = flat if owned and flat.dtype == dtype else None
+            flat = _run_stages(flat, pending, out=out)
+            owned = True
+            pending = []
+
+        if name == 'log':
+            pending.append((_LOG, (_dtype_scale(dtype), value), dtype))
+
+        elif name == 'gamma':
+            if value < 0:
+                raise ValueError("Gamma should be a non-negative real number.")
+            pending.append((_GAMMA, (_dtype_scale(dtype), value, 1.0), dtype))
+
+        elif name == 'rescale':
+            imin, imax = _get_min_max(flat, counts)
+            dtype = _float_type(dtype)
+            pending.append((_LINEAR, (imin, imax, 0.0, 1.0), dtype))
+
+        elif name == 'rescale_global':
+            dtype = _float_type(dtype)
+            pending.append((_LINEAR, (float(value[0]), float(value[1]), 0.0, 1.0), dtype))
+
+        elif name in ('stretch', 'stretch_global'):
+            if name == 'stretch':
+                v_min, v_max = _get_percentiles(flat, (0.2, 99.8), counts)
+            else:
+                v_min, v_max = float(value[0]), float(value[1])
+            if np.issubdtype(dtype, np.floating):
+                o_min = 0.0 if v_min >= 0 else -1.0
+                o_max = 1.0
+            else:
+                o_min, o_max = 0.0, float(np.iinfo(dtype).max)
+            pending.append((_LINEAR, (v_min, v_max, o_min, o_max), dtype))
+
+        else:
+            raise ValueError(f"`{name}` is not a fusable op")
+
+    if pending and flat.size:
+        out = flat if owned and flat.dtype == dtype else None
+        flat = _run_stages(flat, pending, out=out)
+    elif pending:
+        flat = flat.astype(dtype)
+    return flat
+
+
+def _get_counts(flat, n_levels):
+    """A function to count the pixels of each value of a flat integer
+    image, one chunk at a time (`np.bincount` converts its input to intp)
+
+    Parameters:
+    -----------------------------
+        : flat (np.array): contiguous 1d integer image
+        : n_levels (int): number of values of the dtype
+
+    Returns:
+    -----------------------------
+        : counts (np.array): (n_levels,) pixel counts
+    """
+    counts = np.zeros(n_levels, dtype=np.int64)
+    for start in range(0, flat.size, CHUNK_SIZE):
+        counts += np.bincount(flat[start:start + CHUNK_SIZE], minlength=n_levels)
+    return counts
+
+
+def _gather(table, flat):
+    """A function to map a flat integer image through a lookup table, one
+    chunk at a time, so the indices are never expanded to a full-frame
+    intp array
+
+    Parameters:
+    -----------------------------
+        : table (np.array): output value of every input value
+        : flat (np.array): contiguous 1d integer image
+
+    Returns:
+    -----------------------------
+        : out (np.array): the mapped 1d image, in the dtype of the table
+    """
+    out = np.empty(flat.shape, dtype=table.dtype)
+    for start in range(0, flat.size, CHUNK_SIZE):
+        stop = start + CHUNK_SIZE
+        np.take(table, flat[start:stop], out=out[start:stop])
+    return out
+
+
+def uses_lut(image, lut=True):
+    """A function to check if an image is mapped through a lookup table
+
+    Parameters:
+    -----------------------------
+        : image (np.array): image
+        : lut (bool): if False, never
+
+    Returns:
+    -----------------------------
+        : uses_lut (bool)
+    """
+    return lut and image.dtype in LUT_DTYPES and image.size >= LUT_MIN_PIXELS
+
+
+def run_pointwise(image, stages, lut=True, out_dtype=None):
+    """A function to apply a run of pointwise ops in a single pass
+
+    Parameters:
+    -----------------------------
+        : image (np.array): image, with a dtype for which `supports` is True
+        : stages (list of tuple): (op_name, value) pairs, where value is the
+        log gain or gamma, the fixed (low, high) input range of the global
+        ops, and is ignored for `rescale` and `stretch`
+        : lut (bool): if True, map large integer images through a lookup 
+        table of every value (see `uses_lut`)
+        : out_dtype (str or np.dtype): optional, convert the result with 
+        `tensor_ops.as_dtype`
+
+    Returns:
+    -----------------------------
+        : image (np.array): image post processing
+    """
+    shape = image.shape
+    flat = np.ascontiguousarray(image).ravel()
+
+    if uses_lut(flat, lut):
+        levels = np.arange(np.iinfo(flat.dtype).max + 1, dtype=flat.dtype)
+        counts = None
+        if any(name in FRAME_STAT_OPS for name, _ in stages):
+            counts = _get_counts(flat, levels.size)
+        table = _apply_run(levels, stages, counts=counts)
+        if out_dtype is not None:
+            table = _tensor.as_dtype(table, out_dtype)
+        return _gather(table, flat).reshape(shape)
+
+    flat = _apply_run(flat, stages)
+    if out_dtype is not None:
+        flat = _tensor.as_dtype(flat, out_dtype)
+    return flat.reshape(shape)
@@ -0,0 +1,190 @@
+"""
+local histogram equalization for the `local_eq` and `ada_hist` ops
+
+Both ops map each pixel through the cumulative histogram (CDF) of its
+neighbourhood. Instead of a histogram per pixel, the frame is cut into
+tiles of the kernel size, one histogram is counted per tile (a single
+`np.bincount` over every tile of every frame of the stack), and each
+pixel interpolates bilinearly between the CDFs of the four nearest tile
+centres, as CLAHE does. Counting is one pass over the pixels and the
+interpolation is four lookups per pixel, so the cost per pixel does not
+depend on the kernel size (or `local_eq_radius`).
+
+Tiles are at least sqrt(nbins) pixels a side: smaller tiles have fewer
+pixels than bins, and their histograms (one per tile) would take more
+memory than the frame. 
+
+Intensities are binned between the min and max of each frame, so float
+and integer (e.g. uint16) input are handled alike. The output is a float
+in [0, 1].
+
+`ada_hist` clips each tile histogram at `clip_limit` times the tile
+pixel count and spreads the excess evenly over the bins under the limit,
+repeating for the excess this creates (up to CLIP_PASSES times).
+`local_eq` does not clip, and uses tiles of LOCAL_EQ_TILE_SCALE * radius
+pixels: with the interpolation, this best matches a disc of the radius.
+
+Tolerance against the previous implementations, on synthetic 256 x 256
+frames of nuclei-like spots on a smooth background (`make_spots` in
+`tests/test_local_hist.py`), as the mean / 99th percentile absolute
+difference of the [0, 1] outputs:
+
+    ada_hist vs `exposure.equalize_adapthist`     <= 0.01 / 0.045
+    local_eq vs `filters.rank.equalize` (disk)    <= 0.06 / 0.24
+
+for kernel sizes 32-128 and clip limits 0.001-0.03 (ada_hist) and radii
+15-40 (local_eq). On noise the local_eq difference is <= 0.01 / 0.035 for
+radii 15-100. Larger radii on spots are not bounded: the tiles approach
+the size of the frame.
+
+`ada_hist` is the same algorithm and differs by binning and the clip
+redistribution. `local_eq` replaces a sliding disc by interpolated square
+tiles, so differences are largest where the local histogram changes over
+less than a tile, e.g. at the edges of large bright structures.
+"""
+
+import numpy as np
+
+
+# intensity bins of the tile histograms
+DEFAULT_BINS = 256
+
+# passes of clipping and spreading the excess over the remaining bins
+CLIP_PASSES = 8
+
+# tile size of `local_equalize`, in units of the radius
+LOCAL_EQ_TILE_SCALE = 1.25
+
+
+def quantize(image, nbins=DEFAULT_BINS):
+    """A function to bin the intensities of each frame between its min
+    and max
+
+    Parameters:
+    -----------------------------
+        : image (np.array): (..., Y, X) image or stack, any real dtype
+        : nbins (int): number of bins
+
+    Returns:
+    -----------------------------
+        : binned (np.array): (..., Y, X) bin index of each pixel
+    """
+    image = np.asarray(image, dtype=np.float64)
+    lo = image.min(axis=(-2, -1), keepdims=True)
+    hi = image.max(axis=(-2, -1), keepdims=True)
+    scale = nbins / np.maximum(hi - lo, np.finfo(np.float64).tiny)
+
+    binned = ((image - lo) * scale).astype(np.intp)
+    return np.minimum(binned, nbins - 1)
+
+
+def tile_cdfs(binned, kernel_size, nbins=DEFAULT_BINS, clip_limit=0.0):
+    """A function to compute the intensity CDF of every tile
+
+    Parameters:
+    -----------------------------
+        : binned (np.array): (n_frames, Y, X) bin indices, from `quantize`
+        : kernel_size (tuple): (Y, X) tile size
+        : nbins (int): number of bins
+        : clip_limit (float): if > 0, the histogram clip limit as a
+        fraction of the tile pixel count
+
+    Returns:
+    -----------------------------
+        : cdfs (np.array): (n_frames, tiles Y, tiles X, nbins) CDFs in [0, 1]
+    """
+    n_frames, ny, nx = binned.shape
+    ky, kx = kernel_size
+    ty, tx = -(-ny // ky), -(-nx // kx)
+
+    # the flat (frame, tile row, tile column, bin) index of every pixel
+    tile_y = (np.arange(ny) // ky)[:, None]
+    tile_x = (np.arange(nx) // kx)[None, :]
+    frame = np.arange(n_frames)[:, None, None]
+    index = ((frame * ty + tile_y) * tx + tile_x) * nbins + binned
+
+    hist = np.bincount(index.ravel(), minlength=n_frames * ty * tx * nbins)
+    hist = hist.reshape(n_frames, ty, tx, nbins).astype(np.float64)
+    n_pixels = hist.sum(axis=-1, keepdims=True)
+
+    if clip_limit > 0:
+        limit = np.maximum(np.floor(clip_limit * n_pixels), 1)
+        for _ in range(CLIP_PASSES):
+            excess = np.maximum(hist - limit, 0).sum(axis=-1, keepdims=True)
+            if not excess.any():
+                break
+            # spread the excess over the bins still under the limit
+            hist = np.minimum(hist, limit)
+            under = hist < limit
+            n_under = np.maximum(under.sum(axis=-1, keepdims=True), 1)
+            hist += under * (excess / n_under)
+
+    # excess that fits under no bin is dropped, so normalize by the total
+    cdfs = np.cumsum(hist, axis=-1)
+    return cdfs / np.maximum(cdfs[..., -1:], np.finfo(np.float64).tiny)
+
+
+def _get_weights(n, k, n_tiles):
+    """A function to return, along one axis, the two nearest tile
+    centres of each pixel and the weight of the second one """
+    position = (np.arange(n) + 0.5) / k - 0.5
+    low = np.clip(np.floor(position).astype(np.intp), 0, n_tiles - 1)
+    high = np.minimum(low + 1, n_tiles - 1)
+    weight = np.clip(position - low, 0, 1)
+    return low, high, weight
+
+
+def equalize(image, kernel_size, clip_limit=0.0, nbins=DEFAULT_BINS):
+    """A function to equalize each frame by its interpolated tile CDFs
+
+    Parameters:
+    -----------------------------
+        : image (np.array): (..., Y, X) image or stack
+        : kernel_size (int or tuple): tile size, clipped to the frame, and 
+        at least sqrt(nbins)
+        : clip_limit (float): 0 for plain local equalization, > 0 for
+        CLAHE
+        : nbins (int): number of bins
+
+    Returns:
+    -----------------------------
+        : equalized (np.array): (..., Y, X) float64 in [0, 1]
+    """
+    image = np.asarray(image)
+    shape = image.shape
+    frames = image.reshape((-1,) + shape[-2:])
+
+    min_size = int(np.ceil(np.sqrt(nbins)))
+    kernel_size = np.broadcast_to(kernel_size, 2)
+    kernel_size = tuple(int(min(max(k, min_size), s)) for k, s in zip(kernel_size, shape[-2:]))
+
+    binned = quantize(frames, nbins)
+    cdfs = tile_cdfs(binned, kernel_size, nbins, clip_limit)
+    n_frames, ty, tx, _ = cdfs.shape
+
+    y0, y1, wy = _get_weights(shape[-2], kernel_size[0], ty)
+    x0, x1, wx = _get_weights(shape[-1], kernel_size[1], tx)
+    y0, y1, wy = y0[:, None], y1[:, None], wy[:, None]
+    frame = np.arange(n_frames)[:, None, None]
+
+    top = (1 - wx) * cdfs[frame, y0, x0, binned] + wx * cdfs[frame, y0, x1, binned]
+    bottom = (1 - wx) * cdfs[frame, y1, x0, binned] + wx * cdfs[frame, y1, x1, binned]
+    equalized = (1 - wy) * top + wy * bottom
+    return equalized.reshape(shape)
+
+
+def local_equalize(image, radius, nbins=DEFAULT_BINS):
+    """A function to approximate local equalization over a disc
+
+    Parameters:
+    -----------------------------
+        : image (np.array): (..., Y, X) image or stack
+        : radius (float): neighbourhood radius, in pixels
+        : nbins (int): number of bins
+
+    Returns:
+    -----------------------------
+        : equalized (np.array): (..., Y, X) float64 in [0, 1]
+    """
+    kernel_size = max(1, int(round(LOCAL_EQ_TILE_SCALE * radius)))
+    return equalize(image, kernel_size, clip_limit=0.0, nbins=nbins)
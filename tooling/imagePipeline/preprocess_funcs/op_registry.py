@@ -0,0 +1,318 @@
+"""
+declared metadata of the ops of `ParallelTransformer`
+
+Every op is registered once, with what the transformer needs to plan its
+execution, so a new op is added by writing its method (or a function of
+the transformer and the image) and registering it here:
+
+    method         name of the `ParallelTransformer` method that runs it,
+                   or a function (transformer, image) -> image
+    locality       what each output pixel depends on: 'pointwise' (its own
+                   input value), 'neighbourhood' (the pixels within `halo`),
+                   'frame' (statistics of the whole frame, or an output of
+                   another shape), or 'temporal' (its value, less the
+                   tile's temporal background model, fitted by `model`)
+    halo           for 'neighbourhood' ops, the reach in pixels, or a
+                   function of the transformer returning it (None when the
+                   op's params make it non-local)
+    dtypes         the input dtypes the op runs on, None for any; other
+                   inputs are converted to the first one
+    params         the parameters the op reads, to key cached results
+    stack          the op runs on a (frames, Y, X) stack in one call, and
+                   gives each frame the result it gets alone
+    channel_range  the op maps through the channel's intensity range,
+                   fitted across tiles and timepoints
+    out_range      'unit' if the op maps any frame to [0, 1] (integer
+                   frames may keep their dtype's range), 'input' if its
+                   output stays within the range of its input, None if it
+                   may leave both
+    executor       'threads' if the op's kernels release the GIL for most
+                   of their run, else 'processes' (or a function of the
+                   transformer returning one)
+    cost           (seconds per call, seconds per pixel) of one frame on
+                   one core
+
+The scheduler reads these to pick the frames per batch, the runs to fuse,
+the frames to split into strips with halos, and the executor. The costs
+below were fitted by `benchmarks/bench_op_costs.py` on float32 frames of
+128-1024 pixels a side, with the params of `inputs/test.json`; the
+`op_costs` parameter replaces them by the file the benchmark saves on the
+machine that runs the pipeline.
+"""
+
+import json
+import numpy as np
+
+
+LOCALITIES = ('pointwise', 'neighbourhood', 'frame', 'temporal')
+
+# the output ranges an op may declare
+OUT_RANGES = ('unit', 'input', None)
+
+# the executors an op may declare, see `utils/executors.py`
+OP_EXECUTORS = ('threads', 'processes')
+
+# registered ops: name -> spec
+OPS = {}
+
+# the params of the temporal background model, read by every temporal op
+_TEMPORAL_PARAMS = (
+    'temporal_background',
+    'temporal_background_window',
+    'temporal_background_samples',
+)
+
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def register(name, method, locality, halo=0, dtypes=None, params=(), stack=False,
+             channel_range=False, model=None, out_range=None, executor='processes',
+             cost=(0.0, 0.0)):
+    """A function to register an op, see the module docstring for the
+    fields
+
+    Parameters:
+    -----------------------------
+        : name (str): the op name used in `process_channels` pipelines
+        : method (str or callable): the transformer method, or a function
+        (transformer, image) -> image
+
+    Returns:
+    -----------------------------
+        : spec (dict): the registered spec
+    """
+    if locality not in LOCALITIES:
+        raise ValueError(f"locality must be one of {LOCALITIES}, got {locality}")
+    if (locality == 'temporal') != (model is not None):
+        raise ValueError(f"temporal op `{name}` needs a `model` op, and only temporal ops have one")
+    if out_range not in OUT_RANGES:
+        raise ValueError(f"out_range must be one of {OUT_RANGES}, got {out_range}")
+    if not callable(executor) and executor not in OP_EXECUTORS:
+        raise ValueError(f"executor must be one of {OP_EXECUTORS}, got {executor}")
+
+    OPS[name] = {
+        'method': method,
+        'locality': locality,
+        'halo': halo,
+        'dtypes': None if dtypes is None else tuple(np.dtype(d) for d in dtypes),
+        'params': tuple(params),
+        'stack': bool(stack),
+        'channel_range': bool(channel_range),
+        'model': model,
+        'out_range': out_range,
+        'executor': executor,
+        'cost': tuple(float(c) for c in cost),
+    }
+    return OPS[name]
+
+
+def get_spec(name):
+    """A function to return the spec of a registered op
+
+    Parameters:
+    -----------------------------
+        : name (str): op name
+
+    Returns:
+    -----------------------------
+        : spec (dict)
+    """
+    if name not in OPS:
+        raise ValueError(f"unknown op `{name}`, registered ops are {list(OPS)}")
+    return OPS[name]
+
+
+def resolve(value, transformer):
+    """A function to evaluate a field that may depend on the transformer's
+    params
+
+    Parameters:
+    -----------------------------
+        : value: the field, or a function of the transformer
+        : transformer (ParallelTransformer)
+
+    Returns:
+    -----------------------------
+        : value
+    """
+    return value(transformer) if callable(value) else value
+
+
+def get_halo(func_list, transformer):
+    """A function to return the reach of a pipeline: the pixels around
+    each output pixel its result depends on
+
+    Parameters:
+    -----------------------------
+        : func_list (list of str): the pipeline
+        : transformer (ParallelTransformer)
+
+    Returns:
+    -----------------------------
+        : halo (int or None): in pixels, None if an op depends on the
+        whole frame
+    """
+    halo = 0
+    for func in func_list:
+        spec = get_spec(func)
+        if spec['locality'] == 'frame':
+            return None
+        if spec['locality'] == 'neighbourhood':
+            reach = resolve(spec['halo'], transformer)
+            if reach is None:
+                return None
+            halo += int(reach)
+    return halo
+
+
+def get_out_range(func_list):
+    """A function to return the range of a pipeline's output: that of
+    its last op which does not keep the range of its input
+
+    Parameters:
+    -----------------------------
+        : func_list (list of str): the pipeline
+
+    Returns:
+    -----------------------------
+        : out_range (str or None): 'unit', 'input' if every op keeps the
+        range of the pipeline's input, or None
+    """
+    for func in reversed(func_list):
+        out_range = get_spec(func)['out_range']
+        if out_range != 'input':
+            return out_range
+    return 'input'
+
+
+def estimate_cost(func_list, n_pixels, costs=None):
+    """A function to estimate the seconds a pipeline takes on one frame,
+    on one core
+
+    Parameters:
+    -----------------------------
+        : func_list (list of str): the pipeline
+        : n_pixels (int): pixels per frame
+        : costs (dict): optional measured costs, op name -> (seconds per
+        call, seconds per pixel), in place of the registered ones
+
+    Returns:
+    -----------------------------
+        : per_call (float): seconds of fixed overhead per call
+        : per_frame (float): seconds per frame, including the overhead
+    """
+    costs = costs or {}
+    per_call, per_pixel = 0.0, 0.0
+    for func in func_list:
+        call_s, pixel_s = costs.get(func, get_spec(func)['cost'])
+        per_call += call_s
+        per_pixel += pixel_s
+    return per_call, per_call + per_pixel * n_pixels
+
+
+def load_costs(path):
+    """A function to load the costs saved by `benchmarks/bench_op_costs.py`
+
+    Parameters:
+    -----------------------------
+        : path (str): JSON file, op name -> [seconds per call, seconds per
+        pixel], or None
+
+    Returns:
+    -----------------------------
+        : costs (dict): op name -> (seconds per call, seconds per pixel)
+    """
+    if not path:
+        return {}
+    with open(path) as f:
+        return {name: tuple(float(c) for c in cost) for name, cost in json.load(f).items()}
+
+
+def _get_hist_eq_executor(transformer):
+    # skimage's CLAHE loops over tiles in python, and its rank filters hold
+    # the GIL; the interpolated tile CDFs are numpy throughout
+    return 'threads' if transformer.hist_eq_method == 'tiles' else 'processes'
+
+
+def _get_blur_halo(transformer):
+    # the gaussian kernel is truncated at 4 sigma (skimage's default)
+    return int(4.0 * float(np.max(transformer.gaussian_blur_sigma)) + 0.5)
+
+
+def _get_ball_halo(transformer):
+    # the min-pooled approximation interpolates across pooled blocks
+    if int(transformer.rolling_ball_downsample) > 1:
+        return None
+    return int(np.ceil(transformer.rolling_ball_radius))
+
+
+############################################################
+# REGISTERED OPS
+############################################################
+
+register('ball', 'ball', 'neighbourhood', halo=_get_ball_halo,
+         params=('rolling_ball_radius', 'rolling_ball_downsample'),
+         out_range='input', executor='threads', cost=(2.5e-05, 2.1e-07))
+
+# reconstruction by dilation propagates across the whole frame
+register('dilate', 'dilate', 'frame',
+         params=('dilation_box_size',),
+         out_range='input', executor='threads', cost=(0.0, 5.3e-08))
+register('dilate_s', 'dilate_s', 'frame',
+         params=('static_dilation_h',),
+         out_range='input', executor='threads', cost=(0.0, 5.0e-08))
+
+register('eq_hist', 'eq_hist', 'frame',
+         out_range='unit', executor='threads', cost=(5.8e-05, 2.4e-08))
+register('ada_hist', 'adapt_hist', 'frame', stack=True,
+         params=('adaptive_hist_clip', 'adaptive_hist_kernel_size', 'hist_eq_method', 'hist_eq_bins'),
+         out_range='unit', executor=_get_hist_eq_executor, cost=(9.4e-06, 2.3e-08))
+register('local_eq', 'local_eq', 'frame', stack=True,
+         params=('local_eq_radius', 'hist_eq_method', 'hist_eq_bins'),
+         out_range='unit', executor=_get_hist_eq_executor, cost=(2.2e-05, 1.5e-08))
+
+# otsu runs on the frame's own dtype: skimage's multi-otsu counts integer
+# frames per value (ignoring `nbins`), so casting them to float (256 bins)
+# would move the thresholds. Its labels are not intensities, so they have
+# no range
+register('otsu', 'otsu', 'frame',
+         executor='threads', cost=(4.9e-05, 7.2e-09))
+
+# log maps 1 to its gain, so leaves [0, 1] for gains above 1
+register('log', 'log', 'pointwise', stack=True,
+         params=('log_correction_gain',),
+         executor='threads', cost=(4.2e-06, 1.3e-09))
+register('gamma', 'gamma', 'pointwise', stack=True,
+         params=('gamma_correction',),
+         out_range='input', executor='threads', cost=(4.5e-06, 2.0e-09))
+register('blur', 'blur', 'neighbourhood', halo=_get_blur_halo, stack=True,
+         params=('gaussian_blur_sigma',),
+         out_range='input', executor='threads', cost=(0.0, 6.5e-09))
+
+# resize changes the frame shape
+register('resize', '_resize', 'frame', stack=True,
+         params=('tile_resize_factor', 'resize_method'),
+         out_range='input', executor='threads', cost=(9.4e-06, 4.5e-09))
+
+register('rescale', '_rescale', 'frame', stack=True,
+         out_range='unit', executor='threads', cost=(5.4e-06, 1.0e-09))
+register('stretch', 'stretch', 'frame',
+         out_range='unit', executor='threads', cost=(1.9e-05, 4.4e-09))
+register('stretch_global', 'stretch_global', 'pointwise', stack=True, channel_range=True,
+         params=('global_stats_samples',),
+         out_range='unit', executor='threads', cost=(4.6e-06, 9.5e-10))
+register('rescale_global', 'rescale_global', 'pointwise', stack=True, channel_range=True,
+         params=('global_stats_samples',),
+         out_range='unit', executor='threads', cost=(4.4e-06, 9.5e-10))
+
+register('ball_t', 'temporal_subtract', 'temporal', model='ball', stack=True,
+         params=('rolling_ball_radius', 'rolling_ball_downsample') + _TEMPORAL_PARAMS,
+         executor='threads', cost=(1.8e-07, 1.5e-10))
+register('dilate_t', 'temporal_subtract', 'temporal', model='dilate', stack=True,
+         params=('dilation_box_size',) + _TEMPORAL_PARAMS,
+         executor='threads', cost=(2.0e-07, 1.4e-10))
+register('dilate_s_t', 'temporal_subtract', 'temporal', model='dilate_s', stack=True,
+         params=('static_dilation_h',) + _TEMPORAL_PARAMS,
+         executor='threads', cost=(1.7e-07, 1.4e-10))
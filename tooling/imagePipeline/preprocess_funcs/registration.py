@@ -0,0 +1,397 @@
+"""
+registered, overlap-aware stitching of a tile grid
+
+Tiles are laid out on the grid (row-major, as `skimage.util.montage`)
+with a nominal overlap. The offset between each pair of neighbouring
+tiles is refined in two steps: FFT phase correlation of their
+overlapping strips proposes candidate shifts (its highest peaks), and
+each candidate is verified, and refined by hill climbing, with the
+normalized cross-correlation (NCC) of the two tiles on the overlap the
+shift gives them. Phase correlation whitens the spectrum, so its peak
+height is dominated by noise on real frames and its best peak is often
+a few pixels off; the NCC is not. The pairwise offsets are solved for global tile positions by weighted
+least squares (the first tile is fixed), and each frame is fused by
+feathering: every tile is weighted by its distance to its own border,
+so seams blend linearly across the overlap.
+
+Positions are estimated once, on a reference frame, and reused for every
+timepoint and channel.
+"""
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+# phase correlation peaks verified per pair of tiles
+N_CANDIDATES = 8
+
+# pairs whose best overlap NCC is below this are kept at their nominal offset
+MIN_NCC = 0.5
+
+# fewest overlapping pixels an NCC is computed on
+MIN_OVERLAP_PX = 64
+
+# weight of the nominal offset, relative to a perfect correlation
+NOMINAL_WEIGHT = 1e-3
+
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def get_overlap(tile_shape, overlap):
+    """A function to return the nominal overlap of neighbouring tiles
+
+    Parameters:
+    -----------------------------
+        : tile_shape (tuple): (Y, X) tile shape
+        : overlap (float): overlap as a fraction of the tile size
+
+    Returns:
+    -----------------------------
+        : overlap_px (tuple): (Y, X) overlap in pixels
+    """
+    return tuple(int(round(s * overlap)) for s in tile_shape)
+
+
+def get_canvas_shape(grid_shape, tile_shape, overlap):
+    """A function to return the shape of the stitched frame
+
+    Parameters:
+    -----------------------------
+        : grid_shape (tuple): (rows, columns) of tiles
+        : tile_shape (tuple): (Y, X) tile shape
+        : overlap (float): overlap as a fraction of the tile size
+
+    Returns:
+    -----------------------------
+        : canvas_shape (tuple): (Y, X)
+    """
+    ov = get_overlap(tile_shape, overlap)
+    return tuple(g * (s - o) + o for g, s, o in zip(grid_shape, tile_shape, ov))
+
+
+def nominal_positions(grid_shape, tile_shape, overlap):
+    """A function to return the (Y, X) origin of each tile on the grid
+
+    Parameters:
+    -----------------------------
+        : grid_shape (tuple): (rows, columns) of tiles
+        : tile_shape (tuple): (Y, X) tile shape
+        : overlap (float): overlap as a fraction of the tile size
+
+    Returns:
+    -----------------------------
+        : positions (np.array): (n_tiles, 2) integer positions
+    """
+    ov = get_overlap(tile_shape, overlap)
+    step = np.array([s - o for s, o in zip(tile_shape, ov)])
+    rows, cols = np.divmod(np.arange(grid_shape[0] * grid_shape[1]), grid_shape[1])
+    return np.stack([rows, cols], axis=1) * step
+
+
+def phase_correlation(a, b, max_shift, n_peaks=1):
+    """A function to propose translations of `b` relative to `a` with FFT
+    phase correlation. The strips are tapered with a Hanning window along
+    their long axis only: a window across the narrow axis of an overlap
+    strip weights its centre columns and pulls the peak towards no shift.
+
+    Parameters:
+    -----------------------------
+        : a (np.array): 2d reference image
+        : b (np.array): 2d moving image, same shape as `a`
+        : max_shift (tuple): (Y, X) largest shift to search
+        : n_peaks (int): number of peaks to return
+
+    Returns:
+    -----------------------------
+        : shifts (np.array): (n_peaks, 2) integer (dy, dx), highest peak 
+        first, such that b[y, x] ~ a[y + dy, x + dx]
+        : peaks (np.array): (n_peaks,) heights of the normalized 
+        correlation peaks, in [0, 1]
+    """
+    long_axis = int(np.argmax(a.shape))
+    window = np.hanning(a.shape[long_axis])
+    window = window[:, None] if long_axis == 0 else window[None, :]
+    fa = np.fft.rfft2((a - a.mean()) * window)
+    fb = np.fft.rfft2((b - b.mean()) * window)
+
+    cross = fa * np.conj(fb)
+    cross /= np.maximum(np.abs(cross), 1e-12)
+    corr = np.fft.irfft2(cross, s=a.shape)
+
+    # only search shifts up to `max_shift`, wrapped around the origin
+    dy = np.fft.fftfreq(a.shape[0], 1 / a.shape[0])
+    dx = np.fft.fftfreq(a.shape[1], 1 / a.shape[1])
+    allowed = (np.abs(dy)[:, None] <= max_shift[0]) & (np.abs(dx)[None, :] <= max_shift[1])
+    corr = np.where(allowed, corr, -np.inf)
+
+    n_peaks = min(int(n_peaks), int(allowed.sum()))
+    order = np.argsort(corr, axis=None)[::-1][:n_peaks]
+    iy, ix = np.unravel_index(order, corr.shape)
+    shifts = np.stack([dy[iy], dx[ix]], axis=1).astype(int)
+    return shifts, corr[iy, ix]
+
+
+def overlap_ncc(a, b, offset):
+    """A function to return the normalized cross-correlation of two tiles
+    on the region they share when `b` is placed at `offset` from `a`
+
+    Parameters:
+    -----------------------------
+        : a (np.array): 2d tile
+        : b (np.array): 2d tile, same shape as `a`
+        : offset (tuple): (dy, dx) position of `b` minus position of `a`
+
+    Returns:
+    -----------------------------
+        : ncc (float): in [-1, 1], -1 if the overlap has fewer than 
+        MIN_OVERLAP_PX pixels or no variance
+    """
+    dy, dx = (int(o) for o in offset)
+    ny, nx = a.shape
+    ya, yb = max(dy, 0), max(-dy, 0)
+    xa, xb = max(dx, 0), max(-dx, 0)
+    h, w = ny - abs(dy), nx - abs(dx)
+    if h <= 0 or w <= 0 or h * w < MIN_OVERLAP_PX:
+        return -1.0
+
+    va = a[ya:ya + h, xa:xa + w].astype(np.float64)
+    vb = b[yb:yb + h, xb:xb + w].astype(np.float64)
+    va -= va.mean()
+    vb -= vb.mean()
+    norm = np.sqrt((va * va).sum() * (vb * vb).sum())
+    if norm == 0:
+        return -1.0
+    return float((va * vb).sum() / norm)
+
+
+def refine_offset(a, b, nominal, candidates, max_shift):
+    """A function to pick the shift of `b` from its nominal offset with
+    the best overlap NCC, hill climbing from each candidate to its best
+    neighbouring shift until none is better
+
+    Parameters:
+    -----------------------------
+        : a (np.array): 2d tile
+        : b (np.array): 2d neighbouring tile
+        : nominal (np.array): (dy, dx) nominal offset of `b` from `a`
+        : candidates (np.array): (n, 2) shifts to start from
+        : max_shift (tuple): (Y, X) largest shift to search
+
+    Returns:
+    -----------------------------
+        : shift (np.array): (dy, dx) best shift
+        : ncc (float): its overlap NCC
+    """
+    scores = {}
+
+    def score(shift):
+        if shift not in scores:
+            inside = abs(shift[0]) <= max_shift[0] and abs(shift[1]) <= max_shift[1]
+            scores[shift] = overlap_ncc(a, b, np.asarray(nominal) + shift) if inside else -np.inf
+        return scores[shift]
+
+    steps = [(sy, sx) for sy in (-1, 0, 1) for sx in (-1, 0, 1) if sy or sx]
+    best = (0, 0)
+    for shift in [tuple(int(v) for v in c) for c in candidates] + [(0, 0)]:
+        while True:
+            step = max(((shift[0] + sy, shift[1] + sx) for sy, sx in steps), key=score)
+            if score(step) <= score(shift):
+                break
+            shift = step
+        if score(shift) > score(best):
+            best = shift
+    return np.array(best, dtype=int), float(score(best))
+
+
+def pairwise_offsets(tiles, grid_shape, overlap, max_shift=None):
+    """A function to measure the offset between each pair of
+    neighbouring tiles on their nominal overlap
+
+    Parameters:
+    -----------------------------
+        : tiles (np.array): (n_tiles, Y, X) reference frame
+        : grid_shape (tuple): (rows, columns) of tiles
+        : overlap (float): overlap as a fraction of the tile size
+        : max_shift (tuple): (Y, X) largest correction to the nominal
+        offset, defaults to half the overlap
+
+    Returns:
+    -----------------------------
+        : pairs (list of tuple): (i, j, offset, weight), where offset is
+        the measured position of tile j minus the position of tile i
+    """
+    tile_shape = tiles.shape[-2:]
+    ov = get_overlap(tile_shape, overlap)
+    if max_shift is None:
+        max_shift = (ov[0] // 2, ov[1] // 2)
+    nominal = nominal_positions(grid_shape, tile_shape, overlap)
+
+    pairs = []
+    for i in range(len(tiles)):
+        row, col = divmod(i, grid_shape[1])
+
+        # (neighbour, axis) for the tile to the right and the tile below
+        neighbours = []
+        if col + 1 < grid_shape[1]:
+            neighbours.append((i + 1, 1))
+        if row + 1 < grid_shape[0]:
+            neighbours.append((i + grid_shape[1], 0))
+
+        for j, axis in neighbours:
+            offset = nominal[j] - nominal[i]
+            if ov[axis] < 2:
+                pairs.append((i, j, offset, 1.0))
+                continue
+
+            if axis == 1:
+                a = tiles[i][:, -ov[1]:]
+                b = tiles[j][:, :ov[1]]
+            else:
+                a = tiles[i][-ov[0]:, :]
+                b = tiles[j][:ov[0], :]
+
+            candidates, _ = phase_correlation(a.astype(np.float64),
+                                              b.astype(np.float64),
+                                              max_shift, n_peaks=N_CANDIDATES)
+            shift, ncc = refine_offset(tiles[i], tiles[j], offset, candidates, max_shift)
+            if ncc < MIN_NCC:
+                pairs.append((i, j, offset, NOMINAL_WEIGHT))
+            else:
+                pairs.append((i, j, offset + shift, ncc))
+    return pairs
+
+
+def solve_positions(pairs, n_tiles):
+    """A function to solve pairwise offsets for global tile positions by
+    weighted least squares, with the first tile fixed at the origin
+
+    Parameters:
+    -----------------------------
+        : pairs (list of tuple): (i, j, offset, weight) from `pairwise_offsets`
+        : n_tiles (int): number of tiles
+
+    Returns:
+    -----------------------------
+        : positions (np.array): (n_tiles, 2) integer positions
+    """
+    A = np.zeros((len(pairs) + 1, n_tiles))
+    b = np.zeros((len(pairs) + 1, 2))
+
+    for k, (i, j, offset, weight) in enumerate(pairs):
+        w = np.sqrt(weight)
+        A[k, i] = -w
+        A[k, j] = w
+        b[k] = w * np.asarray(offset)
+
+    # anchor the first tile
+    A[-1, 0] = 1.0
+
+    positions, *_ = np.linalg.lstsq(A, b, rcond=None)
+    return np.round(positions).astype(int)
+
+
+def register_tiles(tiles, grid_shape, overlap, max_shift=None):
+    """A function to estimate the tile positions of a reference frame
+
+    Parameters:
+    -----------------------------
+        : tiles (np.array): (n_tiles, Y, X) reference frame
+        : grid_shape (tuple): (rows, columns) of tiles
+        : overlap (float): overlap as a fraction of the tile size
+        : max_shift (tuple): see `pairwise_offsets`
+
+    Returns:
+    -----------------------------
+        : positions (np.array): (n_tiles, 2) integer positions
+    """
+    pairs = pairwise_offsets(tiles, grid_shape, overlap, max_shift=max_shift)
+    return solve_positions(pairs, len(tiles))
+
+
+def feather_weights(tile_shape):
+    """A function to return the blending weight of each pixel of a tile,
+    which increases linearly with the distance to the tile border
+
+    Parameters:
+    -----------------------------
+        : tile_shape (tuple): (Y, X) tile shape
+
+    Returns:
+    -----------------------------
+        : weights (np.array): (Y, X) float64 weights, > 0
+    """
+    ramps = []
+    for n in tile_shape:
+        d = np.arange(n)
+        ramps.append(np.minimum(d, n - 1 - d) + 1.0)
+    return np.outer(ramps[0], ramps[1])
+
+
+def fuse_frame(tiles, positions, canvas_shape, weights=None):
+    """A function to fuse the tiles of a frame onto a canvas, blending
+    overlaps. Tiles (or parts of tiles) outside the canvas are cropped.
+
+    Parameters:
+    -----------------------------
+        : tiles (np.array): (n_tiles, Y, X) frame
+        : positions (np.array): (n_tiles, 2) tile origins on the canvas
+        : canvas_shape (tuple): (Y, X) output shape
+        : weights (np.array): optional (Y, X) weights from `feather_weights`
+
+    Returns:
+    -----------------------------
+        : fused (np.array): (Y, X) float64 frame
+    """
+    tile_shape = tiles.shape[-2:]
+    if weights is None:
+        weights = feather_weights(tile_shape)
+
+    total = np.zeros(canvas_shape, dtype=np.float64)
+    norm = np.zeros(canvas_shape, dtype=np.float64)
+
+    for tile, (y, x) in zip(tiles, positions):
+        y0, x0 = max(y, 0), max(x, 0)
+        y1 = min(y + tile_shape[0], canvas_shape[0])
+        x1 = min(x + tile_shape[1], canvas_shape[1])
+        if y1 <= y0 or x1 <= x0:
+            continue
+
+        src = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+        w = weights[src]
+        total[y0:y1, x0:x1] += w * tile[src]
+        norm[y0:y1, x0:x1] += w
+
+    np.divide(total, norm, out=total, where=norm > 0)
+    return total
+
+
+def fuse_frames(frames, positions, canvas_shape, n_threads=1):
+    """A function to fuse a stack of frames with the same tile positions,
+    spreading the frames over threads
+
+    Parameters:
+    -----------------------------
+        : frames (np.array): (n_frames, n_tiles, Y, X) stack
+        : positions (np.array): (n_tiles, 2) tile origins on the canvas
+        : canvas_shape (tuple): (Y, X) output shape
+        : n_threads (int): threads to spread the frames over
+
+    Returns:
+    -----------------------------
+        : fused (np.array): (n_frames, Y, X) float64 stack
+    """
+    weights = feather_weights(frames.shape[-2:])
+    fused = np.zeros((len(frames),) + tuple(canvas_shape), dtype=np.float64)
+
+    def _fuse(k):
+        fused[k] = fuse_frame(frames[k], positions, canvas_shape, weights=weights)
+
+    if n_threads > 1 and len(frames) > 1:
+        with ThreadPoolExecutor(int(n_threads)) as executor:
+            list(executor.map(_fuse, range(len(frames))))
+    else:
+        for k in range(len(frames)):
+            _fuse(k)
+    return fused
@@ -1,19 +1,100 @@
+import os
 import sys
+import copy
+import shutil
 import numpy as np
-import multiprocessing as mp
-from numba import jit
+from contextlib import nullcontext
 from functools import partial
+from numba import jit
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib
 import skimage
 from skimage import io
 from skimage.color import rgb2gray
-from skimage.morphology import reconstruction
 from skimage import (
     color, feature, filters, measure, morphology, segmentation, exposure, restoration, util, transform
 )
 
+import imagePipeline.utils.executors as _exec
+import imagePipeline.preprocess_funcs.fused as _fused
+import imagePipeline.preprocess_funcs.op_registry as _registry
+import imagePipeline.preprocess_funcs.morphology as _morph
+import imagePipeline.preprocess_funcs.background as _background
+import imagePipeline.preprocess_funcs.registration as _reg
+import imagePipeline.preprocess_funcs.local_hist as _hist
+import imagePipeline.utils.tensor_ops as _tensor
+import imagePipeline.utils.op_cache as _cache
+import imagePipeline.utils.checkpoint as _checkpoint
+import imagePipeline.utils.profiler as _profiler
+import imagePipeline.utils.intensity_stats as _stats
+
+
+# optional parameters and their defaults, so older parameter files still run
+DEFAULT_PARAMS = {
+    'fuse_pointwise': True,
+    'pointwise_lut': True,
+    'output_dtype': 'float64',
+    'rolling_ball_downsample': 1,
+    'temporal_background': 'median',
+    'temporal_background_window': 0,
+    'temporal_background_samples': 16,
+    'stitch_overlap': 0.0,
+    'stitch_register': False,
+    'stitch_reference_channel': None,
+    'stitch_reference_timepoint': 0,
+    'op_cache_directory': None,
+    'op_cache_max_gb': 20,
+    'checkpoint': False,
+    'profile_ops': False,
+    'resize_method': 'interpolate',
+    'tile_order': 'row-major',
+    'hist_eq_method': 'skimage',
+    'hist_eq_bins': 256,
+    'global_stats_samples': 16,
+    'intensity_ranges': None,
+    'stack_batch_frames': 'auto',
+    'executor': 'auto',
+    'op_costs': None,
+}
+
+# 'interpolate' (the default) always uses the anti-aliased `transform.resize`.
+# 'block_mean' is an opt-in fast path that averages factor x factor blocks 
+# for integer resize factors: it is not the same filter, and outputs differ 
+# (by up to ~0.15 of the intensity range on sharp edges, see 
+# `benchmarks/validate_resize.py`)
+RESIZE_METHODS = ('block_mean', 'interpolate')
+
+# 'skimage' (the default) uses the skimage functions for `local_eq` and 
+# `ada_hist`. 'tiles' is an opt-in fast path that equalizes by interpolated 
+# tile CDFs. Its outputs differ, as the mean / 99th percentile absolute 
+# difference of the [0, 1] range: `local_eq` by up to 0.06 / 0.24 on spots 
+# on a smooth background (radii 15-40) and 0.01 / 0.035 on noise (radii 
+# 15-100), `ada_hist` by up to 0.01 / 0.045 (kernel sizes 32-128, clip 
+# limits 0.001-0.03). See `preprocess_funcs/local_hist.py` and 
+# `tests/test_local_hist.py`
+HIST_EQ_METHODS = ('tiles', 'skimage')
+
+# the percentiles `stretch` and `stretch_global` map to the output range
+STRETCH_PERCENTILES = (0.2, 99.8)
+
+# with `stack_batch_frames` 'auto', frames are batched until the fixed cost
+# of each call is at most this fraction of the batch's estimated cost
+BATCH_OVERHEAD_FRACTION = 0.1
+MAX_STACK_BATCH = 64
+
+# seconds to hand a batch of frames to each executor, measured with an 
+# empty pipeline
+TASK_SECONDS = {
+    'serial': 3.5e-06,
+    'threads': 7.0e-06,
+    'processes': 2.3e-05,
+}
+
+# with fewer frames than workers, frames estimated to take longer than this
+# are split into strips, with enough rows of halo to give the same result
+STRIP_MIN_SECONDS = 0.02
+STRIP_MIN_ROWS = 64
 
 
 class ParallelTransformer():
@@ -45,7 +126,43 @@ class ParallelTransformer():
         'static_dilation_h',
         'tile_resize_factor',
         'parallel_procs',
-        'stitch_processing'
+        'stitch_processing',
+        'fuse_pointwise',
+        'pointwise_lut',
+        'output_dtype',
+        'rolling_ball_downsample',
+        'temporal_background',
+        'temporal_background_window',
+        'temporal_background_samples',
+        'frame_background',
+        'stitch_overlap',
+        'stitch_register',
+        'stitch_reference_channel',
+        'stitch_reference_timepoint',
+        'tile_positions',
+        'op_cache_directory',
+        'op_cache_max_gb',
+        'op_cache',
+        'checkpoint',
+        'profile_ops',
+        'op_profiler',
+        'op_profile',
+        'output_format',
+        'output_compression',
+        'output_pyramid_levels',
+        'output_chunk_size',
+        'output_write_threads',
+        'metadata_cache_directory',
+        'resize_method',
+        'tile_order',
+        'hist_eq_method',
+        'hist_eq_bins',
+        'global_stats_samples',
+        'intensity_ranges',
+        'frame_intensity_range',
+        'stack_batch_frames',
+        'executor',
+        'op_costs',
     ]
     
     def __init__(self, params, metadata):
@@ -58,26 +175,35 @@ class ParallelTransformer():
         self.params = params
         self.metadata = metadata
         self.channels = self._get_channel_indices()
+        self.frame_background = None
+        self.frame_intensity_range = None
+        self.tile_positions = None
+        
+        for key, value in DEFAULT_PARAMS.items():
+            setattr(self, key, value)
         
         # make each an attribute, so re-tweakable
         for key in self.params:
                 setattr(self, key, self.params[key])
+        
+        # channel name -> (low, high), given or fitted
+        self.intensity_ranges = dict(self.intensity_ranges or {})
+        
+        # op name -> (seconds per call, seconds per pixel), measured here
+        self.op_costs = _registry.load_costs(self.op_costs)
+        
+        self.op_cache = None
+        if self.op_cache_directory:
+            max_bytes = float(self.op_cache_max_gb) * 1024**3
+            self.op_cache = _cache.OpCache(self.op_cache_directory, max_bytes)
+        
+        self.op_profiler = None
+        self.op_profile = _profiler.ProfileReport()
+        if self.profile_ops:
+            self.op_profiler = _profiler.OpProfiler()
                                   
-        self.ops = {
-            'ball' : self.ball,
-            'dilate' : self.dilate,
-            'dilate_s' : self.dilate_s,
-            'eq_hist' : self.eq_hist,
-            'ada_hist' : self.adapt_hist,
-            'log' : self.log,
-            'blur' : self.blur,
-            'gamma' : self.gamma,
-            'otsu' : self.otsu,
-            'local_eq' : self.local_eq,
-            'resize' : self._resize,
-            'rescale': self._rescale,
-            'stretch': self.stretch
-        }
+        self.ops = self._get_ops()
+        self._check_output_dtype()
 
     #############################################
     # preprocessing operations
@@ -95,9 +221,18 @@ class ParallelTransformer():
         """
         clip = self.adaptive_hist_clip
         k = self.adaptive_hist_kernel_size
-        image = exposure.equalize_adapthist(image, 
-                                            clip_limit=clip,
-                                            kernel_size=k)
+        
+        if self._get_hist_eq_method() == 'tiles':
+            if k is None:
+                # skimage's default, 1/8 of the image
+                k = (image.shape[-2] // 8, image.shape[-1] // 8)
+            return _hist.equalize(image, k, clip_limit=clip, 
+                                  nbins=self.hist_eq_bins)
+        
+        equalize = lambda frame: exposure.equalize_adapthist(frame, 
+                                                             clip_limit=clip,
+                                                             kernel_size=k)
+        image = _tensor.apply_per_frame(equalize, image)
         return image
 
 
@@ -127,9 +262,20 @@ class ParallelTransformer():
         -----------------------------
             : image (np.array): image 
         """
+        if self._get_hist_eq_method() == 'tiles':
+            return _hist.local_equalize(image, self.local_eq_radius, 
+                                        nbins=self.hist_eq_bins)
+        
         selem = morphology.disk(self.local_eq_radius)
-        image = filters.rank.equalize(image, selem=selem)
+        equalize = lambda frame: filters.rank.equalize(frame, selem)
+        image = _tensor.apply_per_frame(equalize, image)
         return image
+    
+    
+    def _get_hist_eq_method(self):
+        if self.hist_eq_method not in HIST_EQ_METHODS:
+            raise ValueError(f"hist_eq_method must be one of {HIST_EQ_METHODS}, got {self.hist_eq_method}")
+        return self.hist_eq_method
 
 
     def otsu(self, image):
@@ -160,6 +306,9 @@ class ParallelTransformer():
             : image (np.array): image post processing
         """
         s = self.gaussian_blur_sigma
+        if image.ndim > 2:
+            # no blurring across the frames of a stack
+            s = (0,) * (image.ndim - 2) + tuple(np.broadcast_to(s, 2))
         image = filters.gaussian(image, sigma=s, 
                                  mode='reflect')
         return image
@@ -192,9 +341,52 @@ class ParallelTransformer():
         -----------------------------
             : image (np.array): image post processing
         """
-        v_min, v_max = np.percentile(image, (0.2, 99.8))
+        v_min, v_max = np.percentile(image, STRETCH_PERCENTILES)
+        image = exposure.rescale_intensity(image, in_range=(v_min, v_max))
+        return image
+    
+    
+    def stretch_global(self, image):
+        """ A function to stretch contrast between the percentiles of the 
+        whole channel (see `_fit_intensity_range`), so every frame gets the 
+        same mapping
+
+        Parameters:
+        -----------------------------
+            : image (np.array): image 
+
+        Returns:
+        -----------------------------
+            : image (np.array): image post processing
+        """
+        v_min, v_max = self._get_frame_intensity_range()
         image = exposure.rescale_intensity(image, in_range=(v_min, v_max))
         return image
+    
+    
+    def rescale_global(self, image):
+        """A function to rescale pixel intensities between 0 and 1 from the 
+        min and max of the whole channel (see `_fit_intensity_range`)
+                
+        Parameters:
+        -----------------------------
+            : image (np.array): image 
+
+        Returns:
+        -----------------------------
+            : image (np.array): image post processing
+        """
+        v_min, v_max = self._get_frame_intensity_range()
+        image = exposure.rescale_intensity(image, in_range=(v_min, v_max), 
+                                           out_range=(0, 1))
+        return image
+    
+    
+    def _get_frame_intensity_range(self):
+        if self.frame_intensity_range is None:
+            raise ValueError("global intensity ops need a fitted range: they are only "
+                             "supported in `process_channels`, after any temporal op")
+        return self.frame_intensity_range
 
 
     def log(self, image):
@@ -229,7 +421,7 @@ class ParallelTransformer():
             h = np.median(image)
 
         seed = image - h
-        dilated = reconstruction(seed, image, method='dilation')
+        dilated = _morph.reconstruct_dilation(seed, image)
         image = image - dilated
         return image
 
@@ -249,13 +441,15 @@ class ParallelTransformer():
         box_size = self.dilation_box_size
         seed = np.copy(image)
         seed[box_size:-box_size, box_size:-box_size] = image.min()
-        dilated = reconstruction(seed, image, method='dilation')
+        dilated = _morph.reconstruct_dilation(seed, image)
         image = image - dilated
         return image
 
 
     def ball(self, image):
-        """A function to subtract the backgroun
+        """A function to subtract the backgroun. If `rolling_ball_downsample` 
+        is > 1, the background is approximated on a min-pooled image (see 
+        `preprocess_funcs/background.py` for the error bound)
 
         Parameters:
         -----------------------------
@@ -266,11 +460,34 @@ class ParallelTransformer():
             : image (np.array): image post processing
         """
         radius = self.rolling_ball_radius
-        background = restoration.rolling_ball(image)
+        background = _background.rolling_ball(image, radius, 
+                                              downsample=self.rolling_ball_downsample)
         image = image - background
         return image
     
     
+    def temporal_subtract(self, image):
+        """A function to subtract the tile's temporal background model 
+        (see `_fit_temporal_background`), in place of recomputing the 
+        background of every frame
+
+        Parameters:
+        -----------------------------
+            : image (np.array): image 
+
+        Returns:
+        -----------------------------
+            : image (np.array): image post processing
+        """
+        if self.frame_background is None:
+            raise ValueError("temporal background ops need a fitted model: "
+                             "they are only supported in `process_channels`")
+        
+        float_type = np.float32 if image.dtype == np.float32 else np.float64
+        image = image - self.frame_background.astype(float_type)
+        return image
+    
+    
     def _resize(self, image):
         """a function to resize the input
         
@@ -284,11 +501,40 @@ class ParallelTransformer():
         """
         rf = self.tile_resize_factor
         
-        output_shape = (image.shape[0] // rf, image.shape[1] // rf)
-        image = transform.resize(image, output_shape)
+        factor = self._get_block_factor(rf)
+        if factor is not None:
+            # same intensity range as `transform.resize`
+            image = util.img_as_float(image)
+            if factor > 1:
+                image = _tensor.block_mean(image, factor)
+            return image
+        
+        output_shape = (image.shape[-2] // rf, image.shape[-1] // rf)
+        resize = lambda frame: transform.resize(frame, output_shape)
+        image = _tensor.apply_per_frame(resize, image)
         return image
     
     
+    def _get_block_factor(self, rf):
+        """A function to return a resize factor as an int when resizing 
+        can use the block-mean fast path
+        
+        Parameters:
+        -----------------------------
+            : rf (int or float): resize factor
+            
+        Returns:
+        -----------------------------
+            : factor (int): or None, to use `transform.resize`
+        """
+        if self.resize_method not in RESIZE_METHODS:
+            raise ValueError(f"resize_method must be one of {RESIZE_METHODS}, got {self.resize_method}")
+        
+        if self.resize_method == 'block_mean' and float(rf).is_integer() and rf >= 1:
+            return int(rf)
+        return None
+    
+    
     def _rescale(self, image):
         """A function to rescale pizel intensities between 0 and 1
                 
@@ -300,6 +546,9 @@ class ParallelTransformer():
         -----------------------------
             : image (np.array): image post processing
         """
+        if image.ndim > 2:
+            # each frame by its own min and max
+            return _tensor.rescale_frames(image)
         image = exposure.rescale_intensity(image, out_range=(0, 1))
         return image
         
@@ -360,40 +609,769 @@ class ParallelTransformer():
             
         new_shape[0] = len(self.channels)
         return tuple(new_shape)
+    
+    
+    def open_pool(self):
+        """A function to start the persistent workers of the `executor`: 
+        shared memory worker processes, threads, or neither ('serial'). Use 
+        as a context manager and pass to `process_tiles` and `process_stitched` 
+        to reuse the same workers for a whole run.
+        
+        Returns:
+        -----------------------------
+            : pool (ExecutorPool): the workers
+        """
+        pipelines = list(self.process_channels.values()) + [self.stitch_processing]
+        executors = {self._get_executor(func_list) for func_list in pipelines}
+        return _exec.ExecutorPool(self, self.parallel_procs, executors)
+    
+    
+    def _get_executor(self, func_list):
+        """A function to return the executor to run a pipeline on. With 
+        `executor` 'auto', a single worker runs serially, and otherwise 
+        pipelines of ops that release the GIL (see `op_registry`) run on 
+        threads, and the others on processes.
+        
+        Parameters:
+        -----------------------------
+            : func_list (list of str): the pipeline
+
+        Returns:
+        -----------------------------
+            : executor (str): 'processes', 'threads' or 'serial'
+        """
+        if self.executor not in _exec.EXECUTORS:
+            raise ValueError(f"executor must be one of {_exec.EXECUTORS}, got {self.executor}")
+        
+        if self.executor != 'auto':
+            return self.executor
+        if int(self.parallel_procs) <= 1:
+            return 'serial'
+        executors = [_registry.resolve(_registry.get_spec(func)['executor'], self) 
+                     for func in func_list]
+        if all(executor == 'threads' for executor in executors):
+            return 'threads'
+        return 'processes'
+    
+    
+    def _check_output_dtype(self):
+        """A function to check that every pipeline can be written in an 
+        integer `output_dtype`: integer outputs are rescaled from [0, 1] 
+        (see `tensor_ops.as_dtype`), so each channel's pipeline must end 
+        in [0, 1]. `stitch_processing` runs on frames restored to [0, 1], 
+        so it may also keep the range of its input.
+        """
+        if not np.issubdtype(np.dtype(self.output_dtype), np.integer):
+            return
+        
+        pipelines = [(name, func_list, ('unit',)) 
+                     for name, func_list in self.process_channels.items()]
+        pipelines.append(('stitch_processing', self.stitch_processing, ('unit', 'input')))
+        for name, func_list, out_ranges in pipelines:
+            if _registry.get_out_range(func_list) not in out_ranges:
+                raise ValueError(f"output_dtype {self.output_dtype} needs `{name}` to end "
+                                 f"in [0, 1], got {func_list}: end it with an op "
+                                 f"such as 'rescale' or 'stretch', or use a float output_dtype")
+    
+    
+    def _get_ops(self):
+        """A function to bind every registered op (see `op_registry`) to 
+        the transformer
+        
+        Returns:
+        -----------------------------
+            : ops (dict): op name to callable, image -> image
+        """
+        ops = {}
+        for name, spec in _registry.OPS.items():
+            method = spec['method']
+            if isinstance(method, str):
+                ops[name] = getattr(self, method)
+            else:
+                ops[name] = partial(method, self)
+        return ops
+    
+    
+    def _clone(self):
+        """A function to return a copy of the transformer for a worker 
+        thread, with its own per-frame state, ops bound to the copy, and 
+        its own op profiler (which does not track allocations, see 
+        `utils/profiler.py`)
         
+        Returns:
+        -----------------------------
+            : clone (ParallelTransformer)
+        """
+        clone = copy.copy(self)
+        clone.ops = clone._get_ops()
+        clone.frame_background = None
+        clone.frame_intensity_range = None
+        if self.op_profiler is not None:
+            clone.op_profiler = _profiler.OpProfiler(track_memory=False)
+        return clone
+    
+    
+    def _use_pool(self, pool):
+        """A function to return a context for the given pool, or for a 
+        pool that is opened and torn down for a single call
         
+        Parameters:
+        -----------------------------
+            : pool (ExecutorPool or None): a running pool
+
+        Returns:
+        -----------------------------
+            : context: yields the pool to use
+        """
+        if pool is None:
+            return self.open_pool()
+        return nullcontext(pool)
+    
+    
+    def _get_time_batch(self, n_tiles):
+        """A function to return the number of timepoints to read per block,
+        chosen so that each block has at least one frame per worker
+        
+        Parameters:
+        -----------------------------
+            : n_tiles (int): the number of tiles per timepoint
+
+        Returns:
+        -----------------------------
+            : t_batch (int): timepoints per block
+        """
+        procs = int(self.parallel_procs)
+        t_batch = max(1, -(-procs // max(1, n_tiles)))
+        return t_batch
+    
+    
+    def _map_frames(self, pool, label, frames, func_list, out_shape, **kwargs):
+        """A function to dispatch frames to the pipeline's executor, and 
+        record the dispatch in the profile if `profile_ops` is set
+        
+        Parameters:
+        -----------------------------
+            : pool (ExecutorPool): a running pool
+            : label (str): the channel (or stage) to record the stats under
+            : frames, func_list, out_shape, kwargs: see `ExecutorPool.map_frames`
+
+        Returns:
+        -----------------------------
+            : processed (np.array): see `ExecutorPool.map_frames`
+        """
+        executor = self._get_executor(func_list)
+        n_strips = self._get_strip_count(func_list, frames.shape, executor)
+        if n_strips > 1:
+            processed = self._map_strips(pool, frames, func_list, n_strips, 
+                                         executor, **kwargs)
+        else:
+            batch_size = self._get_stack_batch(func_list, frames.shape[-2:], executor)
+            processed = pool.map_frames(frames, func_list, out_shape, executor=executor,
+                                        batch_size=batch_size, **kwargs)
+        if self.profile_ops:
+            self.op_profile.add(label, pool.last_stats)
+        return processed
+    
+    
+    def _get_strip_count(self, func_list, shape, executor):
+        """A function to return the number of strips to split each frame 
+        into, so that a stack of fewer frames than workers keeps every 
+        worker busy. Only pipelines of pointwise and neighbourhood ops (see 
+        `op_registry`) are split, and only when a frame is estimated to 
+        take longer than STRIP_MIN_SECONDS.
+        
+        Parameters:
+        -----------------------------
+            : func_list (list of str): the pipeline
+            : shape (tuple): (frames, Y, X) shape of the stack
+            : executor (str): the executor the pipeline runs on
+
+        Returns:
+        -----------------------------
+            : n_strips (int): 1 to process whole frames
+        """
+        n_frames, ny, nx = shape
+        workers = int(self.parallel_procs)
+        if executor == 'serial' or n_frames >= workers:
+            return 1
+        
+        halo = _registry.get_halo(func_list, self)
+        if halo is None:
+            return 1
+        _, per_frame = _registry.estimate_cost(func_list, ny * nx, self.op_costs)
+        if per_frame < STRIP_MIN_SECONDS:
+            return 1
+        
+        # halos are at most as tall as the strip they surround
+        n_strips = -(-workers // n_frames)
+        return max(1, min(n_strips, ny // max(2 * halo, STRIP_MIN_ROWS)))
+    
+    
+    def _map_strips(self, pool, frames, func_list, n_strips, executor, out=None, 
+                    backgrounds=None, **kwargs):
+        """A function to process each frame as row strips padded with the 
+        pipeline's halo, which give the rows they cover the result of the 
+        whole frame
+        
+        Parameters:
+        -----------------------------
+            : pool (ExecutorPool): a running pool
+            : frames (np.array): (n, Y, X) frames
+            : func_list (list of str): a shape-preserving pipeline
+            : n_strips (int): strips per frame
+            : executor (str): the executor to run on
+            : out (np.array): optional (n, Y, X) output array
+            : backgrounds (np.array): optional per-frame temporal background 
+            models, split with the frames
+            : kwargs: see `ExecutorPool.map_frames`
+
+        Returns:
+        -----------------------------
+            : processed (np.array): (n, Y, X) processed frames (`out`, if given)
+        """
+        n, ny, nx = frames.shape
+        halo = _registry.get_halo(func_list, self)
+        height, strips = _tensor.get_strips(ny, n_strips, halo)
+        
+        windows = np.concatenate([frames[:, w0:w0 + height] for w0, _, _ in strips])
+        if backgrounds is not None:
+            backgrounds = np.concatenate([backgrounds[:, w0:w0 + height] for w0, _, _ in strips])
+        
+        batch_size = self._get_stack_batch(func_list, (height, nx), executor)
+        processed = pool.map_frames(windows, func_list, (height, nx), executor=executor, 
+                                    batch_size=batch_size, backgrounds=backgrounds, 
+                                    **kwargs)
+        
+        if out is None:
+            out = np.empty((n, ny, nx), dtype=processed.dtype)
+        for i, (w0, start, stop) in enumerate(strips):
+            out[:, start:stop] = processed[i * n:(i + 1) * n, start - w0:stop - w0]
+        return out
+    
+    
+    def _get_stack_batch(self, func_list, frame_shape, executor):
+        """A function to return the number of frames to send to a worker 
+        at once, when a step of the pipeline runs on whole stacks (see 
+        `op_registry`), otherwise single frames. With `stack_batch_frames` 
+        'auto', batches grow until the fixed costs of the stacked steps 
+        and of the task are at most BATCH_OVERHEAD_FRACTION of the batch's 
+        estimated cost.
+        
+        Parameters:
+        -----------------------------
+            : func_list (list of str): the pipeline
+            : frame_shape (tuple): (Y, X) shape of a frame
+            : executor (str): the executor the pipeline runs on
+
+        Returns:
+        -----------------------------
+            : batch_size (int): frames per task
+        """
+        stacked = []
+        for group in self._get_plan(func_list):
+            if self._supports_stack(group):
+                stacked += list(group) if isinstance(group, tuple) else [group]
+        if not stacked:
+            return 1
+        if self.stack_batch_frames != 'auto':
+            return max(1, int(self.stack_batch_frames))
+        
+        per_call, _ = _registry.estimate_cost(stacked, 0, self.op_costs)
+        _, per_frame = _registry.estimate_cost(func_list, np.prod(frame_shape), self.op_costs)
+        overhead = per_call + TASK_SECONDS[executor]
+        batch_size = overhead / (BATCH_OVERHEAD_FRACTION * max(per_frame, 1e-9))
+        return int(np.clip(np.ceil(batch_size), 1, MAX_STACK_BATCH))
+    
+    
+    def _supports_stack(self, group):
+        """A function to check if a step of the plan runs on whole stacks. 
+        Fused runs do, unless an op takes statistics of the frame.
+        
+        Parameters:
+        -----------------------------
+            : group (str or tuple of str): an op, or a run of ops to fuse
+
+        Returns:
+        -----------------------------
+            : supported (bool)
+        """
+        if isinstance(group, tuple):
+            return not any(_registry.get_spec(func)['locality'] == 'frame' for func in group)
+        return _registry.get_spec(group)['stack']
+    
+    
+    def get_profile(self):
+        """A function to return the per-op and per-channel profile of the 
+        run, if `profile_ops` is set
+        
+        Returns:
+        -----------------------------
+            : profile (dict or None)
+        """
+        if not self.profile_ops:
+            return None
+        return self.op_profile.to_dict()
+        
+        
+    
+    def _get_checkpoint_dir(self):
+        """A function to return the run's checkpoint directory, next to 
+        its outputs
+        
+        Returns:
+        -----------------------------
+            : path (str)
+        """
+        name = os.path.splitext(os.path.basename(self.metadata['czi_path']))[0]
+        if 'work_unit' in self.metadata:
+            name = self.metadata['work_unit']['unit_id']
+        out_dir = os.path.abspath(self.params['output_directory'])
+        return os.path.join(out_dir, f".checkpoint_{name}")
+    
+    
+    def open_checkpoint(self):
+        """A function to open the run's checkpoint, if `checkpoint` is set. 
+        Blocks saved by an earlier run with the same input and params are 
+        reused, anything else is discarded.
+        
+        Returns:
+        -----------------------------
+            : checkpoint (Checkpoint or None)
+        """
+        if not self.checkpoint:
+            return None
+        
+        ops = [func for func_list in self.process_channels.values() for func in func_list]
+        fingerprint = {
+            'source': _cache.file_identity(self.metadata['czi_path']),
+            'work_unit': self.metadata.get('work_unit'),
+            'process_channels': self.process_channels,
+            'op_params': self._get_op_params(ops),
+            'output_dtype': self.output_dtype,
+            'resize_tiles': self.resize_tiles,
+            'intensity_ranges': self.params.get('intensity_ranges'),
+        }
+        return _checkpoint.Checkpoint(self._get_checkpoint_dir(), fingerprint)
+    
+    
+    def clear_checkpoint(self):
+        """A function to delete the run's checkpoint, once its outputs are 
+        written """
+        path = self._get_checkpoint_dir()
+        if self.checkpoint and os.path.exists(path):
+            shutil.rmtree(path)
+    
     
     #############################################
     # flow control: parallelizing operations
     #############################################
-    def _process_image(self, image, func_list):
+    def _process_image(self, image, func_list, out_dtype=None):
         """A master function to wrap individual processes 
         
         Parameters:
             : image (np.array): image 
             : func_list (list of callable): the channel's pipelin 
+            : out_dtype (str): optional, the dtype the result is converted 
+            to next, so a final fused run can convert it in the same pass
 
         Returns:
         -----------------------------
             : image (np.array): image 
         """
-        for func in func_list:
-            image = self.ops[func](image)
+        plan = self._get_plan(func_list)
+        for i, group in enumerate(plan):
+            step_dtype = out_dtype if i == len(plan) - 1 else None
+            if self.op_profiler is None:
+                image = self._run_step(image, group, step_dtype)
+                continue
+            
+            name = "+".join(group) if isinstance(group, tuple) else group
+            with self.op_profiler.measure(name):
+                image = self._run_step(image, group, step_dtype)
         return image
     
+    
+    def _run_step(self, image, group, out_dtype=None):
+        """A function to run one step of the plan, frame by frame for a 
+        stack when the step does not support stacks. Inputs of a dtype the 
+        op does not declare are converted to the first one it does.
+        
+        Parameters:
+            : image (np.array): (Y, X) image or (frames, Y, X) stack
+            : group (str or tuple of str): an op, or a run of ops to fuse
+            : out_dtype (str): optional, passed to fused runs
+
+        Returns:
+        -----------------------------
+            : image (np.array): image 
+        """
+        if image.ndim > 2 and not self._supports_stack(group):
+            return np.stack([self._run_step(frame, group, out_dtype) for frame in image])
+        
+        if isinstance(group, tuple):
+            return self._run_fused(image, group, out_dtype)
+        
+        dtypes = _registry.get_spec(group)['dtypes']
+        if dtypes is not None and image.dtype not in dtypes:
+            image = image.astype(dtypes[0])
+        return self.ops[group](image)
+    
+    
+    def _get_plan(self, func_list):
+        """A function to group consecutive pointwise ops into fused runs
+        
+        Parameters:
+            : func_list (list of str): the channel's pipeline
+
+        Returns:
+        -----------------------------
+            : plan (list): op names, and tuples of op names to be fused 
+        """
+        if not self.fuse_pointwise:
+            return list(func_list)
+        
+        plan = []
+        for func in func_list:
+            if func not in _fused.FUSABLE_OPS:
+                plan.append(func)
+            elif plan and isinstance(plan[-1], tuple):
+                plan[-1] = plan[-1] + (func,)
+            else:
+                plan.append((func,))
+        return plan
+    
+    
+    def _run_fused(self, image, run, out_dtype=None):
+        """A function to run pointwise ops as a single fused pass, 
+        falling back to the individual ops for unsupported dtypes. Large 
+        uint16 images are mapped through a lookup table when 
+        `pointwise_lut` is set.
+        
+        Parameters:
+            : image (np.array): image 
+            : run (tuple of str): consecutive pointwise ops
+            : out_dtype (str): optional, the dtype to convert the result to
+
+        Returns:
+        -----------------------------
+            : image (np.array): image 
+        """
+        if not _fused.supports(image.dtype):
+            for func in run:
+                image = self.ops[func](image)
+            return image
+        
+        values = {
+            'log': self.log_correction_gain,
+            'gamma': self.gamma_correction,
+        }
+        if any(_registry.get_spec(func)['channel_range'] for func in run):
+            values['stretch_global'] = self._get_frame_intensity_range()
+            values['rescale_global'] = self._get_frame_intensity_range()
+        stages = [(func, values.get(func)) for func in run]
+        return _fused.run_pointwise(image, stages, lut=self.pointwise_lut, 
+                                    out_dtype=out_dtype)
+    
+    
+    def _process_frame(self, image, func_list, from_output=False, cast=True, 
+                       background=None, intensity_range=None):
+        """A function to process a frame, or a stack of frames, and convert 
+        it to the output dtype
+        
+        Parameters:
+            : image (np.array): (Y, X) frame or (frames, Y, X) stack
+            : func_list (list of str): the pipeline
+            : from_output (bool): the frame is already in the output dtype 
+            (e.g. a stitched frame). Integer frames are restored to [0, 1] 
+            floats first, so the ops see the same values as with float output.
+            : cast (bool): if False, return the result in its own dtype
+            : background (np.array): the temporal background model of the
+            frame (or of each frame of the stack)
+            : intensity_range (tuple): the channel's (low, high) range, for 
+            the global intensity ops
+
+        Returns:
+        -----------------------------
+            : image (np.array): image in the output dtype
+        """
+        if from_output and np.issubdtype(image.dtype, np.integer):
+            image = util.img_as_float(image)
+        
+        self.frame_background = background
+        self.frame_intensity_range = intensity_range
+        try:
+            out_dtype = self.output_dtype if cast else None
+            image = self._process_image(image, func_list, out_dtype)
+        finally:
+            self.frame_background = None
+            self.frame_intensity_range = None
+            
+        if not cast:
+            return image
+        return _tensor.as_dtype(image, self.output_dtype)
+        
+    
+    def _get_frame_shape(self, image_shape, func_list):
+        """A function to return the shape of a frame after a pipeline
+        
+        Parameters:
+            : image_shape (tuple): (Y, X) input shape
+            : func_list (list of str): the pipeline
+
+        Returns:
+        -----------------------------
+            : shape (tuple): (Y, X) output shape
+        """
+        shape = tuple(image_shape)
+        for func in func_list:
+            if func == 'resize':
+                rf = self.tile_resize_factor
+                shape = (shape[0] // rf, shape[1] // rf)
+        return shape
+    
+    
+    def _fit_temporal_background(self, scene, c, pool, checkpoint=None):
+        """A function to estimate a background model per tile and time 
+        window for a channel whose pipeline has a temporal op (`ball_t`, 
+        `dilate_t` or `dilate_s_t`). Up to `temporal_background_samples` 
+        frames of each window are run through the ops before the temporal 
+        op, reduced to a temporal `median` or `min` per tile, and the 
+        background of that image is estimated once with the matching 
+        per-frame op.
+        
+        Parameters:
+        -----------------------------
+            : scene (np.array or dask.array): (C, T, tiles, Y, X) input
+            : c (int): channel index in the input
+            : pool (ExecutorPool): a running pool
+            : checkpoint (Checkpoint): optional checkpoint of the run
+
+        Returns:
+        -----------------------------
+            : temporal (dict or None): 'window' (int) and 'models' 
+            (n_windows, tiles, Y, X) float32 array, or None if the 
+            pipeline has no temporal op or the channel is checkpointed
+        """
+        name = self._get_channel_name(c)
+        if checkpoint is not None and checkpoint.is_done(name, range(scene.shape[1])):
+            return None
+        
+        func_list = self.process_channels[name]
+        temporal = [(j, f) for j, f in enumerate(func_list) 
+                    if _registry.get_spec(f)['locality'] == 'temporal']
+        if not temporal:
+            return None
+        if len(temporal) > 1:
+            raise ValueError(f"only one temporal op per pipeline is supported, got {func_list}")
+        
+        if self.temporal_background not in ('median', 'min'):
+            raise ValueError(f"temporal_background must be 'median' or 'min', got {self.temporal_background}")
+        
+        j, op = temporal[0]
+        prefix = func_list[:j]
+        estimator = self.ops[_registry.get_spec(op)['model']]
+        
+        n_timepoints = scene.shape[1]
+        n_tiles = scene.shape[2]
+        window = int(self.temporal_background_window) or n_timepoints
+        n_samples = int(self.temporal_background_samples)
+        frame_shape = self._get_frame_shape(scene.shape[-2:], prefix)
+        
+        models = []
+        for w_start in range(0, n_timepoints, window):
+            w_stop = min(w_start + window, n_timepoints)
+            t_idx = np.linspace(w_start, w_stop - 1, min(n_samples, w_stop - w_start))
+            t_idx = np.unique(np.round(t_idx).astype(int))
+            
+            block = np.asarray(scene[c][t_idx])
+            frames = block.reshape((-1,) + block.shape[-2:])
+            prefixed = self._map_frames(pool, f"{name} (temporal fit)", frames, prefix, 
+                                        frame_shape, cast=False)
+            prefixed = prefixed.reshape((len(t_idx), n_tiles) + frame_shape)
+            
+            if self.temporal_background == 'median':
+                stat = np.median(prefixed, axis=0)
+            else:
+                stat = np.min(prefixed, axis=0)
+            del prefixed
+            
+            # the background is what the per-frame op subtracts
+            model = np.stack([tile - estimator(tile) for tile in stat])
+            models.append(model.astype(np.float32))
+        
+        return {'window': window, 'models': np.stack(models)}
+    
+    
+    def _get_global_op(self, name):
+        """A function to return the global intensity op of a channel's 
+        pipeline (`stretch_global` or `rescale_global`)
+        
+        Parameters:
+        -----------------------------
+            : name (str): channel name
+
+        Returns:
+        -----------------------------
+            : glob (tuple or None): (position, op) in the pipeline, or None
+        """
+        func_list = self.process_channels[name]
+        glob = [(j, f) for j, f in enumerate(func_list) if _registry.get_spec(f)['channel_range']]
+        if not glob:
+            return None
+        if len(glob) > 1:
+            raise ValueError(f"only one global intensity op per pipeline is supported, got {func_list}")
+        return glob[0]
+    
+    
+    def _update_intensity_histogram(self, hist, scene, c, pool, temporal=None):
+        """A function to count the values a channel's global intensity op 
+        sees into a histogram: up to `global_stats_samples` timepoints (0 
+        for all), spread over the scene, are run through the ops before 
+        the global op, one block at a time
+        
+        Parameters:
+        -----------------------------
+            : hist (StreamingHistogram): the histogram to update
+            : scene (np.array or dask.array): (C, T, tiles, Y, X) input
+            : c (int): channel index in the input
+            : pool (ExecutorPool): a running pool
+            : temporal (dict): the channel's temporal background model, 
+            from `_fit_temporal_background`
+        """
+        name = self._get_channel_name(c)
+        j, _ = self._get_global_op(name)
+        prefix = self.process_channels[name][:j]
+        
+        n_timepoints = scene.shape[1]
+        n_samples = int(self.global_stats_samples) or n_timepoints
+        t_idx = np.linspace(0, n_timepoints - 1, min(n_samples, n_timepoints))
+        t_idx = np.unique(np.round(t_idx).astype(int))
+        
+        frame_shape = self._get_frame_shape(scene.shape[-2:], prefix)
+        t_batch = self._get_time_batch(scene.shape[2])
+        
+        for i in range(0, len(t_idx), t_batch):
+            t_block = t_idx[i:i + t_batch]
+            block = np.asarray(scene[c][t_block])
+            frames = block.reshape((-1,) + block.shape[-2:])
+            
+            backgrounds = None
+            if temporal is not None:
+                backgrounds = temporal['models'][t_block // temporal['window']]
+                backgrounds = backgrounds.reshape((-1,) + backgrounds.shape[-2:])
+            
+            prefixed = self._map_frames(pool, f"{name} (intensity fit)", frames, prefix, 
+                                        frame_shape, cast=False, backgrounds=backgrounds)
+            hist.update(prefixed)
+    
+    
+    def _get_intensity_range(self, name, hist):
+        """A function to read a channel's intensity range from its 
+        histogram: the `STRETCH_PERCENTILES` for `stretch_global`, the min 
+        and max for `rescale_global`
+        
+        Returns:
+        -----------------------------
+            : intensity_range (tuple): (low, high) floats
+        """
+        _, op = self._get_global_op(name)
+        if op == 'stretch_global':
+            v_min, v_max = hist.quantile(np.array(STRETCH_PERCENTILES) / 100)
+        else:
+            v_min, v_max = hist.min, hist.max
+        return (float(v_min), float(v_max))
+    
+    
+    def _fit_intensity_range(self, scene, c, pool, temporal=None, checkpoint=None):
+        """A function to fit the intensity range of a channel whose pipeline 
+        has a global intensity op (`stretch_global` or `rescale_global`), 
+        from a single streaming histogram of sampled timepoints (see 
+        `_update_intensity_histogram`). The range is stored in 
+        `intensity_ranges`, unless the parameter file sets one for the 
+        channel there (as the scheduler does for every unit of a file, see 
+        `fit_intensity_ranges`).
+        
+        Parameters:
+        -----------------------------
+            : scene (np.array or dask.array): (C, T, tiles, Y, X) input
+            : c (int): channel index in the input
+            : pool (ExecutorPool): a running pool
+            : temporal (dict): the channel's temporal background model, 
+            from `_fit_temporal_background`
+            : checkpoint (Checkpoint): optional checkpoint of the run
+        """
+        name = self._get_channel_name(c)
+        given = self.params.get('intensity_ranges') or {}
+        if name in given:
+            self.intensity_ranges[name] = tuple(given[name])
+            return
+        if checkpoint is not None and checkpoint.is_done(name, range(scene.shape[1])):
+            return
+        if self._get_global_op(name) is None:
+            return
+        
+        hist = _stats.StreamingHistogram()
+        self._update_intensity_histogram(hist, scene, c, pool, temporal)
+        self.intensity_ranges[name] = self._get_intensity_range(name, hist)
+        print(f"{name} intensity range: {self.intensity_ranges[name]}")
+    
+    
+    def fit_intensity_ranges(self, scenes, pool=None):
+        """A function to fit the intensity range of every channel with a 
+        global intensity op over all scenes and timepoints of a file, so 
+        that runs over parts of the file (e.g. the scheduler's work units) 
+        share one range per channel. Ranges set in the parameter file are 
+        kept.
+        
+        Parameters:
+        -----------------------------
+            : scenes (iterable): the (T, C, tiles, Y, X) image of each scene, 
+            ideally lazy, e.g. a (scenes, T, C, tiles, Y, X) array or 
+            `cziLoader.iter_scenes`
+            : pool (ExecutorPool): optional running pool from `open_pool`
+
+        Returns:
+        -----------------------------
+            : intensity_ranges (dict): channel name -> [low, high]
+        """
+        given = self.params.get('intensity_ranges') or {}
+        names = {c: self._get_channel_name(c) for c in self.channels}
+        fit = [c for c, name in names.items() 
+               if name not in given and self._get_global_op(name) is not None]
+        
+        ranges = {name: list(given[name]) for name in names.values() if name in given}
+        if not fit:
+            return ranges
         
-    def process_tiles(self, czi_data):
+        hists = {c: _stats.StreamingHistogram() for c in fit}
+        with self._use_pool(pool) as pool:
+            for scene in scenes:
+                scene = np.moveaxis(scene, 1, 0)
+                for c in fit:
+                    temporal = self._fit_temporal_background(scene, c, pool)
+                    self._update_intensity_histogram(hists[c], scene, c, pool, temporal)
+        
+        for c in fit:
+            ranges[names[c]] = list(self._get_intensity_range(names[c], hists[c]))
+        return ranges
+    
+    
+    def process_tiles(self, czi_data, pool=None):
         """A function to process a czi czi_array 
         
         NOTES:
         -----------------------------
             (1) it is assumed that each czi with be a single scene file
             (2) it is assumed that all time points may be processed independently        
+            (3) the input is read one block of timepoints at a time, so a lazy
+            (dask) view only loads a block into memory when it is processed
         
         Parameters:
         -----------------------------
-            : czi_data (np.array): image: NOTE: this function does not
+            : czi_data (np.array or dask.array): image: NOTE: this function does not
             take in a aicsimageio.readers.czi_reader.CziReader object.
+            : pool (ExecutorPool): optional running pool from `open_pool`. 
+            If None, a pool is started and torn down for this call.
 
         Returns:
         -----------------------------
@@ -406,27 +1384,24 @@ class ParallelTransformer():
         scene = np.moveaxis(scene, 1, 0)
         
         new_shape = self._get_new_size(scene)
-        processed_data = np.zeros(new_shape)
-        
-        for i, c in enumerate(self.channels): 
-            channel_shape = scene[c].shape
-            T = scene[c].reshape(channel_shape[0] * channel_shape[1], 
-                                 channel_shape[2], 
-                                 channel_shape[3])
-            T = list(T)
-            
-            channel_name = self._get_channel_name(c)
-            print(f"processing: {channel_name}")
-                                
-            pool = mp.Pool(int(self.parallel_procs))
-            func_list = self.process_channels[channel_name]
-            new_T = pool.map(partial(self._process_image, func_list=func_list), T)
-            
-            new_T = np.asarray(new_T).reshape(channel_shape[0], 
-                                              channel_shape[1], 
-                                              new_shape[-2], 
-                                              new_shape[-1])
-            processed_data[i] = new_T
+        processed_data = np.zeros(new_shape, dtype=self.output_dtype)
+        
+        n_timepoints = scene.shape[1]
+        t_batch = self._get_time_batch(scene.shape[2])
+        
+        checkpoint = self.open_checkpoint()
+        
+        with self._use_pool(pool) as pool:
+            for i, c in enumerate(self.channels): 
+                print(f"processing: {self._get_channel_name(c)}")
+                temporal = self._fit_temporal_background(scene, c, pool, checkpoint)
+                self._fit_intensity_range(scene, c, pool, temporal, checkpoint)
+                
+                for t_start in range(0, n_timepoints, t_batch):
+                    t_stop = min(t_start + t_batch, n_timepoints)
+                    self._get_block(scene, c, t_start, t_stop, new_shape, pool, 
+                                    temporal, checkpoint, 
+                                    out=processed_data[i, t_start:t_stop])
 
         # reshape the processed data and reset the scene
         processed_data = np.moveaxis(processed_data, 0, 1)
@@ -434,11 +1409,342 @@ class ParallelTransformer():
         return processed_data
     
     
+    def _get_block(self, scene, c, t_start, t_stop, new_shape, pool, temporal, 
+                   checkpoint, out=None):
+        """A function to return a processed block of timepoints of one channel, 
+        from the checkpoint if it holds the whole block, otherwise by processing 
+        it and saving it to the checkpoint
+        
+        Parameters:
+        -----------------------------
+            : scene, c, t_start, t_stop, new_shape, pool, temporal, out: see 
+            `_process_block`
+            : checkpoint (Checkpoint or None): the run's checkpoint
+
+        Returns:
+        -----------------------------
+            : processed (np.array): (time, tiles, Y, X) processed block
+        """
+        if checkpoint is None:
+            return self._process_block(scene, c, t_start, t_stop, new_shape, 
+                                       pool, temporal=temporal, out=out)
+        
+        name = self._get_channel_name(c)
+        timepoints = range(t_start, t_stop)
+        if checkpoint.is_done(name, timepoints):
+            block = checkpoint.load(name, timepoints)
+            if out is None:
+                return block
+            out[...] = block
+            return out
+        
+        block = self._process_block(scene, c, t_start, t_stop, new_shape, 
+                                    pool, temporal=temporal, out=out)
+        checkpoint.save(name, t_start, block)
+        return block
+    
+    
+    def _process_block(self, scene, c, t_start, t_stop, new_shape, pool, temporal=None, 
+                       out=None):
+        """A function to process a block of timepoints of one channel
+        
+        Parameters:
+        -----------------------------
+            : scene (np.array or dask.array): (C, T, tiles, Y, X) input
+            : c (int): channel index in the input
+            : t_start, t_stop (int): the timepoint range
+            : new_shape (tuple): shape of the processed (channel first) scene
+            : pool (ExecutorPool): a running pool
+            : temporal (dict): the channel's temporal background model, 
+            from `_fit_temporal_background`
+            : out (np.array): optional C-contiguous (time, tiles, Y, X) array 
+            of the output dtype to write the block to. Thread and serial 
+            executors write the frames to it in place.
+
+        Returns:
+        -----------------------------
+            : processed (np.array): (time, tiles, Y, X) processed block (`out`, 
+            if given). NOTE: otherwise it may be a view of the pool's output 
+            buffer, valid until the next call
+        """
+        name = self._get_channel_name(c)
+        func_list = self.process_channels[name]
+        intensity_range = self.intensity_ranges.get(name)
+        
+        backgrounds = None
+        if temporal is not None:
+            w_idx = np.arange(t_start, t_stop) // temporal['window']
+            backgrounds = temporal['models'][w_idx]
+            backgrounds = backgrounds.reshape((-1,) + backgrounds.shape[-2:])
+        
+        frames_out = None
+        if out is not None:
+            if not out.flags.c_contiguous:
+                raise ValueError("`out` must be C-contiguous")
+            frames_out = out.reshape((-1,) + out.shape[-2:])
+        
+        if self.op_cache is not None:
+            new_T = self._process_block_cached(scene, c, t_start, t_stop, func_list, 
+                                               pool, backgrounds)
+            if frames_out is not None:
+                frames_out[...] = new_T
+                new_T = frames_out
+        else:
+            # only this block of planes is materialized
+            block = np.asarray(scene[c, t_start:t_stop])
+            T = block.reshape((-1,) + block.shape[-2:])
+            new_T = self._map_frames(pool, name, T, func_list, 
+                                     new_shape[-2:], out_dtype=self.output_dtype, 
+                                     backgrounds=backgrounds, 
+                                     intensity_range=intensity_range, 
+                                     out=frames_out)
+        
+        return new_T.reshape(t_stop - t_start, 
+                             scene.shape[2], 
+                             new_shape[-2], 
+                             new_shape[-1])
+    
+    
+    def _get_op_params(self, func_list):
+        """A function to return the parameters a pipeline reads
+        
+        Parameters:
+        -----------------------------
+            : func_list (list of str): the pipeline
+
+        Returns:
+        -----------------------------
+            : op_params (dict): parameter name to value
+        """
+        op_params = {}
+        for func in func_list:
+            for key in _registry.get_spec(func)['params']:
+                op_params[key] = getattr(self, key)
+        return op_params
+    
+    
+    def _process_block_cached(self, scene, c, t_start, t_stop, func_list, pool, 
+                              backgrounds=None):
+        """A function to process a block of timepoints of one channel through 
+        the op cache: the block resumes from the longest cached prefix of the 
+        pipeline, and the result of each later step of the plan is cached.
+        
+        Parameters:
+        -----------------------------
+            : scene (np.array or dask.array): (C, T, tiles, Y, X) input
+            : c (int): channel index in the input
+            : t_start, t_stop (int): the timepoint range
+            : func_list (list of str): the pipeline
+            : pool (ExecutorPool): a running pool
+            : backgrounds (np.array): per-frame temporal background models
+
+        Returns:
+        -----------------------------
+            : processed (np.array): (time * tiles, Y, X) frames in the 
+            output dtype
+        """
+        # a work unit's input is one scene from an offset in time: entries
+        # are keyed by the scene, and chunks named by the absolute timepoint
+        unit = self.metadata.get('work_unit') or {}
+        t_offset = int(unit.get('t_start', 0))
+        source = dict(_cache.file_identity(self.metadata['czi_path']), 
+                      scene=int(unit.get('scene', 0)))
+        name = self._get_channel_name(c)
+        timepoints = range(t_offset + t_start, t_offset + t_stop)
+        intensity_range = self.intensity_ranges.get(name)
+        
+        # the temporal model is fitted on the timepoints of the input
+        time_range = (t_offset, t_offset + scene.shape[1])
+        
+        # cache points: the end of each step of the plan
+        steps = []
+        n_ops = 0
+        for group in self._get_plan(func_list):
+            ops = list(group) if isinstance(group, tuple) else [group]
+            n_ops += len(ops)
+            prefix = func_list[:n_ops]
+            op_params = self._get_op_params(prefix)
+            if any(_registry.get_spec(func)['channel_range'] for func in prefix):
+                op_params['intensity_range'] = intensity_range
+            if any(_registry.get_spec(func)['locality'] == 'temporal' for func in prefix):
+                op_params['time_range'] = time_range
+            key = self.op_cache.get_key(source, name, prefix, op_params)
+            steps.append((ops, key))
+        
+        start = 0
+        for i in range(len(steps) - 1, -1, -1):
+            if self.op_cache.has(steps[i][1], timepoints):
+                start = i + 1
+                break
+        
+        if start > 0:
+            T = np.stack(self.op_cache.load(steps[start - 1][1], timepoints))
+        else:
+            T = np.asarray(scene[c, t_start:t_stop])
+        T = T.reshape((-1,) + T.shape[-2:])
+        
+        for ops, key in steps[start:]:
+            frame_shape = self._get_frame_shape(T.shape[-2:], ops)
+            T = self._map_frames(pool, name, T, ops, frame_shape, out_dtype=np.float64, 
+                                 backgrounds=backgrounds, cast=False, 
+                                 keep_dtype=True, intensity_range=intensity_range)
+            self.op_cache.store(key, t_offset + t_start, 
+                                T.reshape((t_stop - t_start, -1) + frame_shape))
+        
+        return _tensor.as_dtype(T, self.output_dtype)
+    
+    
+    def iter_blocks(self, czi_data, pool=None, stitch=False):
+        """A generator of processed blocks of timepoints, for streaming 
+        a run to disk. Each block is shaped like a slice of the output of 
+        `process_tiles` (or of `process_stitched` if `stitch`), so peak 
+        memory is a small multiple of one timepoint. 
+        
+        Parameters:
+        -----------------------------
+            : czi_data (np.array or dask.array): image
+            : pool (ExecutorPool): optional running pool from `open_pool`
+            : stitch (bool): if True, stitch and run `stitch_processing`
+            on each block
+
+        Yields:
+        -----------------------------
+            : block (np.array): 6d processed block for consecutive timepoints
+        """
+        scene = czi_data[0]
+        scene = np.moveaxis(scene, 1, 0)
+        
+        new_shape = self._get_new_size(scene)
+        n_timepoints = scene.shape[1]
+        t_batch = self._get_time_batch(scene.shape[2])
+        
+        checkpoint = self.open_checkpoint()
+        
+        with self._use_pool(pool) as pool:
+            temporal = [self._fit_temporal_background(scene, c, pool, checkpoint) 
+                        for c in self.channels]
+            for i, c in enumerate(self.channels):
+                self._fit_intensity_range(scene, c, pool, temporal[i], checkpoint)
+            
+            for t_start in range(0, n_timepoints, t_batch):
+                t_stop = min(t_start + t_batch, n_timepoints)
+                print(f"processing: timepoints {t_start}-{t_stop - 1}")
+                
+                block_shape = (new_shape[0], t_stop - t_start) + new_shape[2:]
+                block = np.zeros(block_shape, dtype=self.output_dtype)
+                for i, c in enumerate(self.channels):
+                    self._get_block(scene, c, t_start, t_stop, new_shape, pool, 
+                                    temporal[i], checkpoint, out=block[i])
+                
+                block = np.expand_dims(np.moveaxis(block, 0, 1), 0)
+                if stitch:
+                    block = self.stitch(block)
+                    block = self.process_stitched(block, pool=pool)
+                yield block
+    
+    
+    def get_output_shape(self, czi_data, stitch=False):
+        """A function to return the shape of the full processed output
+        
+        Parameters:
+        -----------------------------
+            : czi_data (np.array or dask.array): image
+            : stitch (bool): if True, the shape after stitching
+
+        Returns:
+        -----------------------------
+            : shape (tuple): 6d output shape
+        """
+        scene = np.moveaxis(czi_data[0], 1, 0)
+        new_shape = self._get_new_size(scene)
+        
+        # (scene, time, channel, tiles, Y, X)
+        shape = (1, new_shape[1], new_shape[0]) + tuple(new_shape[2:])
+        if stitch:
+            shape = (1,) + self._get_stitched_size(shape[1:])
+        return shape
+    
+    
     #############################################
     # stitchting and global processing
     #############################################
+    def _get_stitched_size(self, scene_shape):
+        """A function to return the shape of a scene after stitching
+        
+        Parameters:
+        -----------------------------
+            : scene_shape (tuple): (time, channel, tiles, Y, X)
+            
+        Returns:
+        -----------------------------
+            : new_shape (tuple): (time, channel, 1, Y, X) stitched shape
+        """
+        grid_shape = tuple(self.params['grid_shape'])
+        rf = self.quilt_resize_factor
+        canvas_shape = _reg.get_canvas_shape(grid_shape, scene_shape[3:], 
+                                             self.stitch_overlap)
+        
+        new_shape = (scene_shape[0], # time
+                     scene_shape[1], # channel
+                     1,              # tiles (stub dim)
+                     (canvas_shape[0] // rf), # new image y
+                     (canvas_shape[1] // rf)) # new image x
+        return new_shape
+    
+    
+    def _get_tile_positions(self, scene):
+        """A function to return the position of each tile on the stitched 
+        frame. With `stitch_register`, the positions are estimated once on 
+        the reference timepoint and channel, then cached for all timepoints 
+        and channels (reset `tile_positions` to None to re-estimate).
+        
+        Parameters:
+        -----------------------------
+            : scene (np.array): (time, channel, tiles, Y, X) processed tiles
+            
+        Returns:
+        -----------------------------
+            : positions (np.array): (tiles, 2) tile origins
+        """
+        if self.tile_positions is not None:
+            return self.tile_positions
+        
+        grid_shape = tuple(self.params['grid_shape'])
+        tile_shape = scene.shape[-2:]
+        
+        # grid cell of each tile, and the tile in each (row-major) cell
+        cells = _tensor.get_tile_cells(grid_shape, self.tile_order)[:scene.shape[2]]
+        
+        if not self.stitch_register:
+            positions = _reg.nominal_positions(grid_shape, tile_shape, 
+                                               self.stitch_overlap)
+            self.tile_positions = positions[cells]
+            return self.tile_positions
+        
+        c = 0
+        if self.stitch_reference_channel is not None:
+            names = [self._get_channel_name(idx) for idx in self.channels]
+            c = names.index(self.stitch_reference_channel)
+        t = min(int(self.stitch_reference_timepoint), scene.shape[0] - 1)
+        
+        tiles = np.asarray(scene[t, c], dtype=np.float64)[np.argsort(cells)]
+        positions = _reg.register_tiles(tiles, grid_shape, self.stitch_overlap)
+        self.tile_positions = positions[cells]
+        print(f"registered tile positions: {self.tile_positions.tolist()}")
+        return self.tile_positions
+    
+    
     def stitch(self, czi_data):
-        """A function to stich together mutliple tiles
+        """A function to stich together mutliple tiles. If `stitch_overlap` 
+        or `stitch_register` is set, tiles are placed at their (registered) 
+        positions and overlaps are blended, see `preprocess_funcs/registration.py`
+        
+        Tiles are placed in `tile_order` ('row-major' or 'snake'), the 
+        order they were acquired in.
+        
+        For integer `quilt_resize_factor` (and `resize_method` 'block_mean'), 
+        every tile of the (time, channel) stack is reduced by block mean 
+        before the montage, so the full resolution montage is never built.
         
         NOTE: this impacts the metadata.
         
@@ -456,34 +1762,79 @@ class ParallelTransformer():
         
         scene = czi_data[0] # first channel is a stub for mutliple scenes
         
-        new_shape = (scene.shape[0], # time
-                     scene.shape[1], # channel
-                     1,              # tiles (stub dim)
-                     ((scene.shape[3] * grid_shape[0]) // rf), # new image y
-                     ((scene.shape[4] * grid_shape[1]) // rf)) # new image x
+        new_shape = self._get_stitched_size(scene.shape)
         
-        stitched_data = np.zeros((new_shape))
+        stitched_data = np.zeros(new_shape, dtype=self.output_dtype)
+        factor = self._get_block_factor(rf)
         
-        for t in range(scene.shape[0]):
+        if self.stitch_overlap or self.stitch_register:
+            positions = self._get_tile_positions(scene)
+            canvas_shape = _reg.get_canvas_shape(grid_shape, scene.shape[-2:], 
+                                                 self.stitch_overlap)
+            
+            # fuse a block of timepoints at a time, one frame per thread, 
+            # so only a block of full resolution canvases is held
+            t_batch = max(1, int(self.parallel_procs))
             for c in range(scene.shape[1]):
-                tiles = scene[t, c, :, :, :]
-                stitched = util.montage(tiles, grid_shape=grid_shape)  
-                
-                output_shape = (stitched.shape[0] // rf, stitched.shape[1] // rf)
-                stitched = transform.resize(stitched, output_shape)
-
-                stitched_data[t, c, 0, :, :] = stitched
+                for t_start in range(0, scene.shape[0], t_batch):
+                    t_stop = min(t_start + t_batch, scene.shape[0])
+                    fused = _reg.fuse_frames(np.asarray(scene[t_start:t_stop, c]), positions, 
+                                             canvas_shape, n_threads=self.parallel_procs)
+                    
+                    if factor is not None:
+                        stitched = _tensor.block_mean(fused, factor)
+                        stitched_data[t_start:t_stop, c, 0, :, :] = _tensor.as_dtype(stitched, self.output_dtype)
+                        del fused
+                        continue
+                    
+                    for t in range(t_start, t_stop):
+                        stitched = transform.resize(fused[t - t_start], new_shape[-2:])
+                        stitched_data[t, c, 0, :, :] = _tensor.as_dtype(stitched, self.output_dtype)
+                    del fused
+        
+        else:
+            tile_shape = scene.shape[-2:]
+            if factor is not None and factor > 1 and not (tile_shape[0] % factor or tile_shape[1] % factor):
+                if scene.dtype != np.dtype(self.output_dtype):
+                    # same intensity range as `transform.resize`
+                    scene = util.img_as_float(scene)
+                scene = _tensor.block_mean(scene, factor)
+                factor = 1
+            
+            if factor is None:
+                # anti-aliased resize of each montage, a timepoint at a time
+                for t in range(scene.shape[0]):
+                    montaged = _tensor.montage(scene[t], grid_shape, self.tile_order)
+                    for c in range(scene.shape[1]):
+                        stitched = transform.resize(montaged[c], new_shape[-2:])
+                        stitched_data[t, c, 0, :, :] = _tensor.as_dtype(stitched, self.output_dtype)
+            
+            elif factor == 1 and scene.dtype == stitched_data.dtype:
+                _tensor.montage(scene, grid_shape, self.tile_order, 
+                                out=stitched_data[:, :, 0])
+            
+            else:
+                stitched = _tensor.montage(scene, grid_shape, self.tile_order)
+                if stitched.dtype != stitched_data.dtype:
+                    # same intensity range as `transform.resize`
+                    stitched = util.img_as_float(stitched)
+                if factor > 1:
+                    stitched = _tensor.block_mean(stitched, factor)
+                stitched_data[:, :, 0] = _tensor.as_dtype(stitched, self.output_dtype)
         
         stitched_data = np.expand_dims(stitched_data, 0)
         return stitched_data
     
     
-    def process_stitched(self, czi_data):
+    def process_stitched(self, czi_data, pool=None):
         """A function to process a czi czi_array 
         
         Parameters:
         -----------------------------
             : czi_data (np.array): a stitched czi image: 
+            : pool (ExecutorPool): optional running pool from `open_pool`. 
+            If None, a pool is started and torn down for this call.
+            
         Returns:
         -----------------------------
             : processed_data (np.array): a preprocessed image
@@ -493,29 +1844,17 @@ class ParallelTransformer():
         scene = np.moveaxis(scene, 1, 0)
         scene = np.squeeze(scene, 2)
     
-        processed_data = np.zeros(scene.shape)
+        processed_data = np.zeros(scene.shape, dtype=self.output_dtype)
+        func_list = self.stitch_processing
         
-        for c in range(scene.shape[0]):
-            
-            T = list(scene[c])
-            func_list = self.stitch_processing
-            pool = mp.Pool(int(self.parallel_procs))
-            new_T = pool.map(partial(self._process_image, func_list=func_list), T)
-            new_T = np.asarray(new_T)
-            processed_data[c] = new_T
+        with self._use_pool(pool) as pool:
+            for c in range(scene.shape[0]):
+                label = f"stitched {self._get_channel_name(self.channels[c])}"
+                self._map_frames(pool, label, scene[c], func_list, 
+                                 scene.shape[-2:], out_dtype=self.output_dtype, 
+                                 from_output=True, out=processed_data[c])
             
         processed_data = np.moveaxis(processed_data, 0, 1)
         processed_data = np.expand_dims(processed_data, 0)
         processed_data = np.expand_dims(processed_data, 3)
         return processed_data
-    
-            
-        
-        
-    
-    
-        
-        
-
-    
-    
@@ -0,0 +1,201 @@
+"""
+Runs every file and scene of a parameter file as independent work units
+of (file, scene, timepoint range), locally or as a SLURM array job. Each
+unit streams its block through load -> process -> (optional stitch) ->
+write, like run_stream.py, and exports OME_<unit>.tiff with its own
+PARAMETERS_/METADATA_ files.
+
+The units are listed in MANIFEST_<params name>.json in the output
+directory, with the intensity range of each channel with a global
+intensity op, fitted once per file when planning so that all units of a
+file share it. Finished units are recorded there, so resubmitting the same
+command only runs the units that did not finish. Use --replan after
+changing the input files or --time-chunk.
+
+It is expected that all specific parameters are specified in
+the .json parameter file being run.
+
+EXAMPLE job run from: home/cstansbu
+
+# one array task per pending unit (submitted from the login node)
+python git_repositories/cell_tracking/imagePipeline/run_schedule.py --params git_repositories/cell_tracking/imagePipeline/inputs/test.json --slurm --time-chunk 50 --stitch
+
+# 4 units at a time on the current node
+python git_repositories/cell_tracking/imagePipeline/run_schedule.py --params git_repositories/cell_tracking/imagePipeline/inputs/test.json --workers 4
+"""
+
+import argparse
+import sys
+import os
+import time
+import subprocess
+from time import gmtime, strftime
+
+# make local modules discoverable
+sys.path.append("/home/cstansbu/git_repositories/cell_tracking/")
+import imagePipeline.data_io.loaders as _read
+import imagePipeline.data_io.writers as _write
+import imagePipeline.preprocess_funcs.transform as _prep
+import imagePipeline.utils.scheduler as _sched
+
+
+def resolve_path(path):
+    """A function to resolve the input path
+
+    Parameters:
+    -----------------------------
+        : path (str): path to the config file to use
+
+    Returns:
+    -----------------------------
+        : path (str): full system path to the parameter file
+    """
+    return os.path.abspath(path)
+
+
+def fit_intensity_ranges(params, units):
+    """A function to fit the intensity ranges of each file once, over all
+    its scenes and timepoints, and store them in the file's units
+
+    Parameters:
+    -----------------------------
+        : params (dict): user configs
+        : units (list of dict): from `expand_units`, updated in place
+    """
+    loader = _read.cziLoader(params)
+    for file_index in sorted({unit['file_index'] for unit in units}):
+        metadata = loader.get_metadata(index=file_index)
+        transformer = _prep.ParallelTransformer(params, metadata)
+        ranges = transformer.fit_intensity_ranges(loader.iter_scenes(file_index))
+        for unit in units:
+            if unit['file_index'] == file_index:
+                unit['intensity_ranges'] = ranges
+
+
+def run_unit(params, unit, stitch=False):
+    """A function to process and write a single work unit
+
+    Parameters:
+    -----------------------------
+        : params (dict): user configs
+        : unit (dict): the work unit, from the manifest
+        : stitch (bool): if True, stitch and run `stitch_processing`
+    """
+    # the unit's ranges were fitted over its whole file
+    if unit.get('intensity_ranges'):
+        params = type(params)(params)
+        params['intensity_ranges'] = unit['intensity_ranges']
+
+    loader = _read.cziLoader(params)
+    czi_data, metadata = loader.get_item(index=unit['file_index'], lazy=True, 
+                                         scene=unit['scene'])
+    czi_data = czi_data[:, unit['t_start']:unit['t_stop']]
+    metadata['work_unit'] = unit
+
+    transformer = _prep.ParallelTransformer(params, metadata)
+    writer = _write.OutputWriter(params, metadata, base_name=unit['unit_id'])
+    writer.save_params()
+    writer.save_metadata()
+
+    with transformer.open_pool() as pool:
+        shape = transformer.get_output_shape(czi_data, stitch=stitch)
+        blocks = transformer.iter_blocks(czi_data, pool=pool, stitch=stitch)
+        writer.write_stream(blocks, shape)
+    writer.save_profile(transformer.get_profile())
+    transformer.clear_checkpoint()
+
+
+if __name__ == '__main__':
+    _datetime = strftime("%Y-%m-%d %H:%M:%S", gmtime())
+    print(f"script submitted: {_datetime}")
+    full_start = time.time()
+
+    """
+    ARGUMENTS
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--params")
+    parser.add_argument("--stitch", action="store_true")
+    parser.add_argument("--time-chunk", type=int, default=0,
+                        help="timepoints per unit, 0 for whole scenes")
+    parser.add_argument("--replan", action="store_true",
+                        help="rebuild the manifest")
+    parser.add_argument("--task-id", type=int,
+                        default=os.environ.get('SLURM_ARRAY_TASK_ID'),
+                        help="run a single unit of the manifest")
+    parser.add_argument("--slurm", action="store_true",
+                        help="submit pending units as a SLURM array job")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="with --slurm, print the sbatch command only")
+    parser.add_argument("--max-concurrent", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="units to run at once locally")
+    args, unknown = parser.parse_known_args()
+    PARAM_PATH = resolve_path(args.params)
+    params = _read.load_params(params_path=PARAM_PATH)
+
+    name = os.path.splitext(os.path.basename(PARAM_PATH))[0]
+    manifest = _sched.Manifest(params['output_directory'], name)
+    task_args = ["--stitch"] if args.stitch else []
+
+    """
+    SINGLE UNIT (array task)
+    """
+    if args.task_id is not None:
+        units = manifest.load()
+        unit = units[int(args.task_id)]
+
+        if manifest.is_done(unit):
+            print(f"skipping finished unit: {unit['unit_id']}")
+            sys.exit(0)
+
+        print(f"processing unit: {unit['unit_id']}")
+        start = time.time()
+        run_unit(params, unit, stitch=args.stitch)
+        time_elapsed = (time.time() - start) / 60
+        manifest.mark_done(unit, {'minutes': time_elapsed})
+        print(f"unit processing + writing time: {time_elapsed:.4f}mins")
+        sys.exit(0)
+
+    """
+    PLANNING
+    """
+    if args.replan or not manifest.exists():
+        loader = _read.cziLoader(params)
+        units = _sched.expand_units(loader, time_chunk=args.time_chunk)
+        fit_intensity_ranges(params, units)
+        manifest.save(units, PARAM_PATH)
+    else:
+        manifest.load()
+
+    pending = manifest.pending()
+    print(f"units: {len(manifest.units)} pending: {len(pending)}")
+    if not pending:
+        sys.exit(0)
+
+    """
+    SUBMISSION
+    """
+    script_path = os.path.abspath(__file__)
+
+    if args.slurm:
+        command = _sched.get_sbatch_command(script_path, PARAM_PATH, pending,
+                                            extra_args=task_args,
+                                            max_concurrent=args.max_concurrent,
+                                            job_name=name)
+        print(" ".join(command))
+        if not args.dry_run:
+            subprocess.run(command, check=True)
+    else:
+        failed = _sched.run_local(script_path, PARAM_PATH, pending,
+                                  extra_args=task_args,
+                                  n_workers=args.workers)
+        if failed:
+            print(f"failed units: {failed}")
+            sys.exit(1)
+
+    _datetime = strftime("%Y-%m-%d %H:%M:%S", gmtime())
+    print(f"script finished: {_datetime}")
+
+    time_elapsed = (time.time() - full_start) / 60
+    print(f"TOTAL TIME: {time_elapsed:.4f}mins")
@@ -0,0 +1,93 @@
+"""
+Streams tiles through load -> process -> (optional stitch) -> write, one 
+block of timepoints at a time, and exports a single OME .tiff (or the `output_format` of the params). Peak memory 
+is a small multiple of one timepoint, not of the whole file.
+
+Without --stitch the output matches run_tiles.py (Z=n_tiles slices), with 
+--stitch it matches run_tiles_stitch_fuse.py (Z=1, all tiles merged).
+
+It is expected that all specific parameters are specified in
+the .json parameter file being run.
+
+EXAMPLE job run from: home/cstansbu
+
+sbatch --job-name=TEST job_tools/script_runner.sh git_repositories/cell_tracking/imagePipeline/run_stream.py --params git_repositories/cell_tracking/imagePipeline/inputs/test.json --stitch
+"""
+
+import argparse
+import sys
+import os
+import time
+from time import gmtime, strftime
+import json
+from easydict import EasyDict
+
+# make local modules discoverable
+sys.path.append("/home/cstansbu/git_repositories/cell_tracking/")
+import imagePipeline.data_io.loaders as _read
+import imagePipeline.data_io.writers as _write
+import imagePipeline.preprocess_funcs.transform as _prep
+    
+    
+def resolve_path(path):
+    """A function to resolve the input path 
+
+    Parameters:
+    -----------------------------
+        : path (str): path to the config file to use
+        
+    Returns:
+    -----------------------------
+        : path (str): full system path to the parameter file
+    """
+    return os.path.abspath(path)
+    
+
+if __name__ == '__main__':
+    _datetime = strftime("%Y-%m-%d %H:%M:%S", gmtime())
+    print(f"script submitted: {_datetime}")
+    full_start = time.time()
+    
+    """
+    ARGUMENTS
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--params")
+    parser.add_argument("--stitch", action="store_true")
+    args, unknown = parser.parse_known_args()
+    PARAM_PATH = resolve_path(args.params)
+    params = _read.load_params(params_path=PARAM_PATH)
+    
+    """
+    FILE LOADING
+    """
+    start = time.time()
+    loader = _read.cziLoader(params)  
+    czi_data, metadata = loader.get_item(index=0, lazy=True)
+    time_elapsed = (time.time() - start) / 60
+    print(f"scene loading time: {time_elapsed:.4f}mins")
+    
+    """
+    STREAMING: PROCESSING + OUTPUT WRITING
+    """
+    start = time.time()
+    transformer = _prep.ParallelTransformer(params, metadata)
+    writer = _write.OutputWriter(params, metadata)
+    writer.save_params()
+    writer.save_metadata()
+    
+    with transformer.open_pool() as pool:
+        shape = transformer.get_output_shape(czi_data, stitch=args.stitch)
+        blocks = transformer.iter_blocks(czi_data, pool=pool, stitch=args.stitch)
+        writer.write_stream(blocks, shape)
+    writer.save_profile(transformer.get_profile())
+    transformer.clear_checkpoint()
+        
+    time_elapsed = (time.time() - start) / 60
+    print(f"scene processing + writing time: {time_elapsed:.4f}mins")
+    
+    _datetime = strftime("%Y-%m-%d %H:%M:%S", gmtime())
+    print(f"script finished: {_datetime}")
+    
+    time_elapsed = (time.time() - full_start) / 60
+    print(f"TOTAL TIME: {time_elapsed:.4f}mins")
@@ -57,7 +57,7 @@ if __name__ == '__main__':
     """
     start = time.time()
     loader = _read.cziLoader(params)  
-    czi, metadata = loader.get_item(index=0)
+    czi_data, metadata = loader.get_item(index=0, lazy=True)
     time_elapsed = (time.time() - start) / 60
     print(f"scene loading time: {time_elapsed:.4f}mins")
     
@@ -66,8 +66,8 @@ if __name__ == '__main__':
     """
     start = time.time()
     transformer = _prep.ParallelTransformer(params, metadata)
-    processed_czi = transformer.process_tiles(czi_data=czi.data)
-    del czi
+    processed_czi = transformer.process_tiles(czi_data=czi_data)
+    del czi_data
     time_elapsed = (time.time() - start) / 60
     print(f"scene processing time: {time_elapsed:.4f}mins")
     
@@ -79,7 +79,9 @@ if __name__ == '__main__':
     writer = _write.OutputWriter(params, metadata)
     writer.save_params()
     writer.save_metadata()
+    writer.save_profile(transformer.get_profile())
     writer.write_ome(processed_czi)
+    transformer.clear_checkpoint()
     time_elapsed = (time.time() - start) / 60
     print(f"scene writing time: {time_elapsed:.4f}mins")
     
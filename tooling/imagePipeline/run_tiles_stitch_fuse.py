@@ -58,7 +58,7 @@ if __name__ == '__main__':
     """
     start = time.time()
     loader = _read.cziLoader(params)  
-    czi, metadata = loader.get_item(index=0)
+    czi_data, metadata = loader.get_item(index=0, lazy=True)
     time_elapsed = (time.time() - start) / 60
     print(f"scene loading time: {time_elapsed:.4f}mins")
     
@@ -67,26 +67,29 @@ if __name__ == '__main__':
     """
     start = time.time()
     transformer = _prep.ParallelTransformer(params, metadata)
-    processed_czi = transformer.process_tiles(czi_data=czi.data)
-    del czi
-    time_elapsed = (time.time() - start) / 60
-    print(f"scene processing time: {time_elapsed:.4f}mins")
-    
-    
-    """
-    STITCHING + PROCESSING
-    """
-    start = time.time()
-    stitched = transformer.stitch(processed_czi)
-    
-    del processed_czi
-    time_elapsed = (time.time() - start) / 60
-    print(f"scene stitching time: {time_elapsed:.4f}mins")
     
-    start = time.time()
-    stitched = transformer.process_stitched(stitched)
-    time_elapsed = (time.time() - start) / 60
-    print(f"scene processing 2 time: {time_elapsed:.4f}mins")
+    # one worker pool for both processing stages
+    with transformer.open_pool() as pool:
+        processed_czi = transformer.process_tiles(czi_data=czi_data, pool=pool)
+        del czi_data
+        time_elapsed = (time.time() - start) / 60
+        print(f"scene processing time: {time_elapsed:.4f}mins")
+        
+        
+        """
+        STITCHING + PROCESSING
+        """
+        start = time.time()
+        stitched = transformer.stitch(processed_czi)
+        
+        del processed_czi
+        time_elapsed = (time.time() - start) / 60
+        print(f"scene stitching time: {time_elapsed:.4f}mins")
+        
+        start = time.time()
+        stitched = transformer.process_stitched(stitched, pool=pool)
+        time_elapsed = (time.time() - start) / 60
+        print(f"scene processing 2 time: {time_elapsed:.4f}mins")
     
    
     """
@@ -96,7 +99,9 @@ if __name__ == '__main__':
     writer = _write.OutputWriter(params, metadata)
     writer.save_params()
     writer.save_metadata()
+    writer.save_profile(transformer.get_profile())
     writer.write_ome(stitched)
+    transformer.clear_checkpoint()
     time_elapsed = (time.time() - start) / 60
     print(f"scene writing time: {time_elapsed:.4f}mins")
     
@@ -0,0 +1,55 @@
+"""
+shared fixtures: transformers built from `inputs/test.json` on small
+synthetic CZI-shaped stacks, with outputs and caches under a temporary
+directory
+"""
+
+import os
+import sys
+import json
+import numpy as np
+import pytest
+from easydict import EasyDict
+
+# make local modules discoverable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+import imagePipeline.preprocess_funcs.transform as _prep
+
+
+PARAMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../inputs/test.json")
+CHANNELS = ('At520', 'At425', 'mCher')
+
+
+def make_data(T=3, C=3, M=4, Y=64, X=80, seed=0, scenes=1):
+    """A function to make a synthetic (scenes, T, C, tiles, Y, X) uint16 stack"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 4000, size=(scenes, T, C, M, Y, X)).astype(np.uint16)
+
+
+@pytest.fixture
+def czi_path(tmp_path):
+    """a stand-in input file, so file identities can be taken"""
+    path = tmp_path / "synthetic.czi"
+    path.write_bytes(b"synthetic")
+    return str(path)
+
+
+@pytest.fixture
+def make_transformer(tmp_path, czi_path):
+    """a factory of transformers: (procs=2, image_shape=(64, 80), **params)"""
+    def make(procs=2, image_shape=(64, 80), metadata=None, **params):
+        with open(PARAMS_PATH) as f:
+            config = EasyDict(json.load(f))
+        config['parallel_procs'] = procs
+        config['grid_shape'] = [2, 2]
+        config['output_directory'] = str(tmp_path / "out")
+        config.update(params)
+
+        meta = {
+            'channel_map': dict(zip(CHANNELS, range(len(CHANNELS)))),
+            'image_shape': tuple(image_shape),
+            'czi_path': czi_path,
+        }
+        meta.update(metadata or {})
+        return _prep.ParallelTransformer(config, meta)
+    return make
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from skimage import restoration
+
+import imagePipeline.preprocess_funcs.background as _background
+
+
+def normalised_frame(kind, shape=(128, 128), seed=0):
+    """a frame rescaled to [0, 1]"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    if kind == 'ramp':
+        image = (yy + xx).astype(np.float64)
+    elif kind == 'edges':
+        image = ((yy // 16 + xx // 16) % 2).astype(np.float64)
+    else:
+        image = 0.3 + 0.2 * np.sin(yy / 30) * np.cos(xx / 25)
+        for cy, cx in rng.uniform(0, 1, size=(20, 2)) * shape:
+            sigma = rng.uniform(3, 8)
+            image += rng.uniform(0.2, 0.6) * np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * sigma ** 2))
+        if kind == 'noisy cells':
+            image += rng.normal(0, 0.03, size=shape)
+    return (image - image.min()) / (image.max() - image.min())
+
+
+def test_exact_mode_is_skimage():
+    image = normalised_frame('cells')
+    expected = restoration.rolling_ball(image, radius=10)
+    assert np.array_equal(_background.rolling_ball(image, 10), expected)
+
+
+@pytest.mark.parametrize("kind", ['cells', 'noisy cells', 'edges', 'ramp'])
+@pytest.mark.parametrize("radius, downsample", [(10, 2), (10, 4), (25, 4), (25, 8)])
+def test_approximate_mode_error_bound(kind, radius, downsample):
+    image = normalised_frame(kind)
+    exact = restoration.rolling_ball(image, radius=radius)
+    approx = _background.rolling_ball(image, radius, downsample=downsample)
+
+    step = max(np.abs(np.diff(image, axis=0)).max(), np.abs(np.diff(image, axis=1)).max())
+    bound = min(1.0, 2 * (downsample - 1) * step)
+    assert approx.dtype == image.dtype
+    assert np.abs(approx - exact).max() <= bound + 1e-12
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+
+import imagePipeline.utils.checkpoint as _checkpoint
+from conftest import make_data
+
+
+def test_save_load_and_resume(tmp_path):
+    directory = str(tmp_path / "ckpt")
+    block = np.arange(2 * 4 * 5 * 6, dtype=np.float32).reshape(2, 4, 5, 6)
+    checkpoint = _checkpoint.Checkpoint(directory, {'params': 1})
+    checkpoint.save('At520', 3, block)
+
+    resumed = _checkpoint.Checkpoint(directory, {'params': 1})
+    assert resumed.is_done('At520', [3, 4])
+    assert not resumed.is_done('At520', [4, 5])
+    assert not resumed.is_done('mCher', [3])
+    assert np.array_equal(resumed.load('At520', [3, 4]), block)
+
+
+def test_a_different_fingerprint_starts_over(tmp_path):
+    directory = str(tmp_path / "ckpt")
+    _checkpoint.Checkpoint(directory, {'params': 1}).save('At520', 0, np.zeros((1, 1, 2, 2)))
+
+    checkpoint = _checkpoint.Checkpoint(directory, {'params': 2})
+    assert not checkpoint.is_done('At520', [0])
+    assert os.listdir(directory) == ['journal.jsonl']
+
+
+def test_a_killed_run_keeps_its_finished_chunks(tmp_path):
+    directory = str(tmp_path / "ckpt")
+    checkpoint = _checkpoint.Checkpoint(directory, {'params': 1})
+    checkpoint.save('At520', 0, np.zeros((2, 1, 2, 2)))
+
+    # killed while writing the next chunk and its journal line
+    os.remove(os.path.join(directory, "At520_t000001.npy"))
+    with open(checkpoint.journal_path, 'a') as f:
+        f.write('{"channel": "At5')
+
+    resumed = _checkpoint.Checkpoint(directory, {'params': 1})
+    assert resumed.completed == {('At520', 0)}
+
+
+def test_process_tiles_resumes_from_saved_blocks(make_transformer):
+    data = make_data(T=3)
+    expected = make_transformer().process_tiles(data)
+
+    first = make_transformer(checkpoint=True)
+    assert np.array_equal(first.process_tiles(data), expected)
+
+    # a saved block is loaded, not recomputed
+    checkpoint = first.open_checkpoint()
+    chunk = os.path.join(checkpoint.directory, "At425_t000001.npy")
+    np.save(chunk, np.zeros_like(np.load(chunk)))
+    resumed = make_transformer(checkpoint=True).process_tiles(data)
+    assert not resumed[0, 1, 1].any()
+    assert np.array_equal(np.delete(resumed, 1, axis=1), np.delete(expected, 1, axis=1))
+
+    # other params are another run
+    rerun = make_transformer(checkpoint=True, gamma_correction=1.0).process_tiles(data)
+    assert rerun[0, 1, 1].any()
+
+    first.clear_checkpoint()
+    assert not os.path.exists(checkpoint.directory)
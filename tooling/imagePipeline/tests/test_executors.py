@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import imagePipeline.utils.executors as _exec
+from conftest import make_data
+
+
+@pytest.mark.parametrize("executor", ['serial', 'threads', 'processes', 'auto'])
+def test_executors_match_serial(make_transformer, executor):
+    data = make_data(T=3)
+    expected = make_transformer(executor='serial').process_tiles(data)
+
+    transformer = make_transformer(executor=executor)
+    with transformer.open_pool() as pool:
+        processed = transformer.process_tiles(data, pool=pool)
+        stitched = transformer.process_stitched(transformer.stitch(processed), pool=pool)
+    assert np.array_equal(processed, expected)
+
+    reference = make_transformer(executor='serial')
+    assert np.array_equal(stitched, reference.process_stitched(reference.stitch(expected)))
+
+
+def test_auto_picks_an_executor_per_pipeline(make_transformer):
+    transformer = make_transformer(executor='auto')
+    assert transformer._get_executor(['log', 'gamma', 'rescale']) == 'threads'
+    # skimage's rank filters hold the GIL, the tile CDFs do not
+    skimage = make_transformer(executor='auto', hist_eq_method='skimage')
+    assert skimage._get_executor(['log', 'local_eq']) == 'processes'
+    tiles = make_transformer(executor='auto', hist_eq_method='tiles')
+    assert tiles._get_executor(['log', 'local_eq']) == 'threads'
+    assert make_transformer(procs=1, executor='auto')._get_executor(['log']) == 'serial'
+
+    with pytest.raises(ValueError):
+        make_transformer(executor='gpu')._get_executor(['log'])
+
+
+def test_threads_keep_per_frame_state_apart(make_transformer):
+    transformer = make_transformer()
+    frames = make_data(T=2)[0, :, 1].reshape(-1, 64, 80).astype(np.float64)
+    backgrounds = frames[::-1] / 2
+    func_list = ['log', 'rescale']
+    expected = np.stack([transformer._process_frame(f, func_list, background=b)
+                         for f, b in zip(frames, backgrounds)])
+
+    with _exec.ThreadFramePool(transformer, 4) as pool:
+        out = np.empty_like(expected)
+        processed = pool.map_frames(frames, func_list, (64, 80), backgrounds=backgrounds,
+                                    out=out)
+        assert processed is out
+        stats = pool.last_stats
+    assert np.array_equal(processed, expected)
+    assert stats['n_frames'] == len(frames) and stats['n_procs'] == 4
+
+
+def test_unknown_executor_is_an_error(make_transformer):
+    with _exec.ExecutorPool(make_transformer(), 2, executors=()) as pool:
+        with pytest.raises(ValueError):
+            pool.map_frames(np.zeros((1, 4, 4)), ['log'], (4, 4), executor='gpu')
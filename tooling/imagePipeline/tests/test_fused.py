@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+import imagePipeline.preprocess_funcs.fused as _fused
+from conftest import make_data
+
+
+RUNS = [('log', 'gamma', 'rescale'), ('gamma', 'stretch'),
+        ('rescale', 'log'), ('stretch', 'gamma', 'log')]
+
+
+def make_frame(dtype, shape=(64, 80), seed=0):
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 4000, size=shape)
+    if np.issubdtype(np.dtype(dtype), np.floating):
+        return (frame / 4000).astype(dtype)
+    return frame.astype(dtype)
+
+
+def run_ops(transformer, image, run):
+    for func in run:
+        image = transformer.ops[func](image)
+    return image
+
+
+def get_stages(transformer, run):
+    values = {'log': transformer.log_correction_gain, 'gamma': transformer.gamma_correction}
+    return [(func, values.get(func)) for func in run]
+
+
+@pytest.mark.parametrize("run", RUNS)
+@pytest.mark.parametrize("dtype", ['float64', 'float32', 'uint16'])
+def test_fused_run_matches_the_ops(make_transformer, dtype, run):
+    transformer = make_transformer()
+    frame = make_frame(dtype)
+    expected = run_ops(transformer, frame, run)
+    fused = _fused.run_pointwise(frame, get_stages(transformer, run), lut=False)
+
+    assert fused.dtype == expected.dtype
+    if dtype == 'float32':
+        # the fused kernels compute each op in float64 and round it to float32
+        assert np.allclose(fused, expected, rtol=0, atol=1e-6)
+    else:
+        assert np.array_equal(fused, expected)
+
+
+def test_fused_pipelines_match_unfused(make_transformer):
+    data = make_data(T=2)
+    fused = make_transformer(fuse_pointwise=True).process_tiles(data)
+    unfused = make_transformer(fuse_pointwise=False).process_tiles(data)
+    assert np.array_equal(fused, unfused)
+
+
+def test_negative_input_is_an_error(make_transformer):
+    frame = make_frame('float64') - 0.5
+    with pytest.raises(ValueError):
+        _fused.run_pointwise(frame, [('log', 1.0)])
+
+
+@pytest.mark.parametrize("run", RUNS + [('stretch_global',), ('log', 'rescale_global')])
+def test_lookup_table_matches_direct(make_transformer, run):
+    transformer = make_transformer()
+    frame = make_frame('uint16', shape=(256, 300))
+    assert _fused.uses_lut(frame) and not _fused.uses_lut(frame[:64])
+
+    values = {'log': transformer.log_correction_gain, 'gamma': transformer.gamma_correction,
+              'stretch_global': (200.0, 3500.0), 'rescale_global': (0.0, 20000.0)}
+    stages = [(func, values.get(func)) for func in run]
+    table = _fused.run_pointwise(frame, stages, lut=True)
+    direct = _fused.run_pointwise(frame, stages, lut=False)
+    assert table.dtype == direct.dtype
+    assert np.array_equal(table, direct)
+
+
+@pytest.mark.parametrize("out_dtype", ['uint16', 'uint8', 'float32'])
+def test_lookup_table_folds_the_output_dtype(make_transformer, out_dtype):
+    transformer = make_transformer()
+    frame = make_frame('uint16', shape=(256, 300))
+    stages = get_stages(transformer, ('log', 'rescale'))
+
+    folded = _fused.run_pointwise(frame, stages, lut=True, out_dtype=out_dtype)
+    expected = _fused.run_pointwise(frame, stages, lut=False, out_dtype=out_dtype)
+    assert folded.dtype == np.dtype(out_dtype)
+    assert np.array_equal(folded, expected)
+
+
+def test_pipelines_match_without_lookup_tables(make_transformer):
+    data = make_data(T=1, Y=256, X=256)
+    kwargs = {'image_shape': (256, 256), 'output_dtype': 'uint16'}
+    with_lut = make_transformer(pointwise_lut=True, **kwargs).process_tiles(data)
+    without = make_transformer(pointwise_lut=False, **kwargs).process_tiles(data)
+    assert np.array_equal(with_lut, without)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import imagePipeline.utils.intensity_stats as _stats
+
+
+def test_quantiles_within_one_bin():
+    rng = np.random.default_rng(0)
+    values = rng.gamma(2.0, 300.0, size=200000)
+    hist = _stats.StreamingHistogram(n_bins=1024)
+    for batch in np.array_split(values, 10):
+        hist.update(batch)
+
+    assert hist.n == values.size
+    assert (hist.min, hist.max) == (values.min(), values.max())
+
+    q = [0.001, 0.5, 0.999]
+    tolerance = 2 * (values.max() - values.min()) / hist.n_bins
+    assert np.allclose(hist.quantile(q), np.quantile(values, q), atol=tolerance)
+
+
+def test_growing_range_keeps_counts():
+    hist = _stats.StreamingHistogram(n_bins=64)
+    hist.update(np.linspace(10, 11, 100))
+    # batches below and far above the first range merge the bins
+    hist.update(np.linspace(-50, 0, 100))
+    hist.update(np.linspace(1000, 2000, 100))
+
+    assert hist.n == 300
+    assert hist.quantile(0) == -50 and hist.quantile(1) == 2000
+    # the middle batch holds the median, to one bin width
+    assert abs(hist.quantile(0.5) - 10.5) <= hist.width
+
+
+def test_constant_and_non_finite_values():
+    hist = _stats.StreamingHistogram(n_bins=16)
+    hist.update(np.array([np.nan, np.inf]))
+    with pytest.raises(ValueError):
+        hist.quantile(0.5)
+
+    hist.update(np.full(10, 7.0))
+    assert hist.n == 10
+    assert hist.quantile(0.5) == 7.0
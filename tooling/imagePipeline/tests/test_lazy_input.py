@@ -0,0 +1,52 @@
+import numpy as np
+import dask.array as da
+from dask.callbacks import Callback
+import pytest
+
+from conftest import make_data
+
+
+class PlaneReader():
+    """an array source that, like the CZI reader, is read plane by plane,
+    and fails a computation that reads more than `limit` planes"""
+
+    def __init__(self, data, limit):
+        self.data = data
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.ndim = data.ndim
+        self.limit = limit
+        self.reads = 0
+        self.total = 0
+
+    def __getitem__(self, key):
+        self.reads += 1
+        self.total += 1
+        if self.reads > self.limit:
+            raise MemoryError(f"a computation read more than {self.limit} planes")
+        return self.data[key]
+
+
+@pytest.mark.parametrize("procs", [1, 2, 4])
+def test_input_is_read_one_block_at_a_time(make_transformer, procs):
+    data = make_data(T=3)
+    transformer = make_transformer(procs=procs)
+    n_tiles = data.shape[3]
+
+    # a block is one channel of `t_batch` timepoints
+    t_batch = transformer._get_time_batch(n_tiles)
+    reader = PlaneReader(data, limit=t_batch * n_tiles)
+    lazy = da.from_array(reader, chunks=(1, 1, 1, 1) + data.shape[-2:])
+
+    def reset(dsk):
+        reader.reads = 0
+
+    with Callback(start=reset):
+        processed = transformer.process_tiles(lazy)
+    assert np.array_equal(processed, make_transformer(procs=procs).process_tiles(data))
+    # every plane is read
+    assert reader.total >= data[0].size // np.prod(data.shape[-2:])
+
+    # the whole scene at once is more than a block
+    with Callback(start=reset), pytest.raises(MemoryError):
+        lazy.compute()
@@ -0,0 +1,69 @@
+import os
+from xml.etree import ElementTree
+
+import imagePipeline.data_io.loaders as _read
+
+
+METADATA_XML = """
+<ImageDocument><Metadata>
+  <ImageScaling><ImagePixelSize>0.65,0.65</ImagePixelSize></ImageScaling>
+  <Information>
+    <Application><Name>ZEN</Name><Version>3.4</Version><BuildId>42</BuildId></Application>
+    <Image>
+      <SizeX>80</SizeX>
+      <Dimensions><Channels>
+        <Channel Id="Channel:0" Name="At520">
+          <ExposureTime>100</ExposureTime>
+          <LightSourceSettings><Intensity>5</Intensity><Wavelength>520</Wavelength></LightSourceSettings>
+        </Channel>
+      </Channels></Dimensions>
+    </Image>
+  </Information>
+  <Scaling>
+    <AutoScaling><Type>Measured</Type></AutoScaling>
+    <Items><Distance Id="X"><Value>6.5e-07</Value><DefaultUnitFormat>m</DefaultUnitFormat></Distance></Items>
+  </Scaling>
+</Metadata></ImageDocument>
+"""
+
+
+def make_loader(tmp_path, czi_path):
+    params = {'data_directory': os.path.dirname(czi_path),
+              'files': [os.path.basename(czi_path)],
+              'output_directory': str(tmp_path / "out")}
+    return _read.cziLoader(params)
+
+
+def test_select_metadata_by_path(tmp_path, czi_path):
+    loader = make_loader(tmp_path, czi_path)
+    selected = loader.select_metadata(ElementTree.fromstring(METADATA_XML))
+
+    assert selected['ImagePixelSize'] == '0.65,0.65'
+    assert selected['Application_Build'] == '42'
+    assert selected['Scaling_Type'] == 'Measured'
+    assert selected['Scaling_Dimension_X'] == '6.5e-07m'
+    assert selected['SizeX'] == '80'
+    assert selected['At520_ExposureTime'] == '100'
+    assert selected['At520_LightSourceSettings'] == 'Intensity=5.....Wavelength=520'
+
+
+def test_metadata_sidecar(tmp_path, czi_path, monkeypatch):
+    loader = make_loader(tmp_path, czi_path)
+    calls = []
+
+    def get_spec(czi):
+        calls.append(czi)
+        return {'file_shape': (1, 2, 3, 4, 64, 80), 'image_shape': (64, 80)}
+    monkeypatch.setattr(loader, '_get_spec', get_spec)
+
+    first = loader.get_metadata(0, czi='reader')
+    second = loader.get_metadata(0, czi='reader')
+    assert len(calls) == 1
+    assert first == second and second['image_shape'] == (64, 80)
+    assert second['czi_path'] == czi_path
+
+    # a changed file is parsed again
+    with open(czi_path, 'ab') as f:
+        f.write(b"more")
+    loader.get_metadata(0, czi='reader')
+    assert len(calls) == 2
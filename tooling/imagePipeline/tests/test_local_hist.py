@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from skimage import exposure, filters, morphology
+
+import imagePipeline.preprocess_funcs.local_hist as _hist
+import imagePipeline.preprocess_funcs.transform as _prep
+from conftest import make_data
+
+
+# rank filters warn on 12 bit frames
+pytestmark = pytest.mark.filterwarnings("ignore:Bad rank filter performance")
+
+
+def test_skimage_is_the_default(make_transformer):
+    assert _prep.DEFAULT_PARAMS['hist_eq_method'] == 'skimage'
+    transformer = make_transformer(local_eq_radius=5)
+    frame = make_data(T=1)[0, 0, 0, 0]
+
+    expected = filters.rank.equalize(frame, morphology.disk(5))
+    assert np.array_equal(transformer.local_eq(frame), expected)
+
+    image = frame / frame.max()
+    expected = exposure.equalize_adapthist(image, clip_limit=0.001, kernel_size=1)
+    assert np.array_equal(transformer.adapt_hist(image), expected)
+
+
+def test_tiles_are_opt_in(make_transformer):
+    transformer = make_transformer(local_eq_radius=20, hist_eq_method='tiles')
+    frames = make_data(T=1)[0, 0, 0]
+
+    expected = _hist.local_equalize(frames, 20, nbins=256)
+    assert np.array_equal(transformer.local_eq(frames), expected)
+
+
+def test_tiles_stay_within_the_documented_tolerance(make_transformer):
+    rng = np.random.default_rng(0)
+    frame = (rng.random((128, 128)) * 4000).astype(np.uint16)
+    # rank filters map uint16 frames to [0, max]
+    skimage = make_transformer(local_eq_radius=20).local_eq(frame) / frame.max()
+    tiles = make_transformer(local_eq_radius=20, hist_eq_method='tiles').local_eq(frame)
+
+    diff = np.abs(tiles - skimage)
+    assert diff.mean() <= 0.008 and np.percentile(diff, 99) <= 0.03
+
+
+def make_spots(n=256, seed=0):
+    """A function to make a uint16 frame of nuclei-like spots on a smooth
+    background, with noise"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:n, :n]
+    frame = 500 + 300 * np.sin(yy / 40) * np.cos(xx / 55)
+    for _ in range(n * n // 1500):
+        cy, cx = rng.integers(0, n, 2)
+        r = rng.uniform(4, 9)
+        frame = frame + 2500 * np.exp(-((yy - cy)**2 + (xx - cx)**2) / (2 * r * r))
+    frame = frame + rng.normal(0, 40, frame.shape)
+    return frame.clip(0, 4000).astype(np.uint16)
+
+
+def get_difference(make_transformer, op, frame, **params):
+    """mean and 99th percentile absolute difference of the 'tiles' and 
+    'skimage' outputs"""
+    skimage = getattr(make_transformer(image_shape=frame.shape, **params), op)(frame)
+    tiles = getattr(make_transformer(image_shape=frame.shape, hist_eq_method='tiles', 
+                                     **params), op)(frame)
+    if op == 'local_eq':
+        # rank filters map uint16 frames to [0, max]
+        skimage = skimage / frame.max()
+    diff = np.abs(tiles - skimage)
+    return diff.mean(), np.percentile(diff, 99)
+
+
+# the bounds documented at `transform.HIST_EQ_METHODS`
+@pytest.mark.parametrize("radius", [15, 40])
+def test_tiles_local_eq_tolerance_on_spots(make_transformer, radius):
+    mean, p99 = get_difference(make_transformer, 'local_eq', make_spots(), 
+                               local_eq_radius=radius)
+    assert mean <= 0.06 and p99 <= 0.24
+
+
+@pytest.mark.parametrize("radius", [15, 100])
+def test_tiles_local_eq_tolerance_on_noise(make_transformer, radius):
+    frame = (np.random.default_rng(0).random((256, 256)) * 4000).astype(np.uint16)
+    mean, p99 = get_difference(make_transformer, 'local_eq', frame, local_eq_radius=radius)
+    assert mean <= 0.01 and p99 <= 0.035
+
+
+@pytest.mark.parametrize("kernel_size, clip", [(32, 0.01), (32, 0.03), (128, 0.001)])
+def test_tiles_ada_hist_tolerance(make_transformer, kernel_size, clip):
+    frame = make_spots()
+    mean, p99 = get_difference(make_transformer, 'adapt_hist', frame / frame.max(), 
+                               adaptive_hist_kernel_size=kernel_size, 
+                               adaptive_hist_clip=clip)
+    assert mean <= 0.01 and p99 <= 0.045
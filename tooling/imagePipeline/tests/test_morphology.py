@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from skimage import morphology
+
+import imagePipeline.preprocess_funcs.morphology as _morph
+from conftest import make_data
+
+
+def border_seed(image, box_size=1):
+    """the seed of the `dilate` op"""
+    seed = np.copy(image)
+    seed[box_size:-box_size, box_size:-box_size] = image.min()
+    return seed
+
+
+@pytest.mark.parametrize("dtype", ['uint16', 'float32', 'float64'])
+def test_matches_skimage_reconstruction(dtype):
+    image = make_data(T=1)[0, 0, 0, 0].astype(dtype)
+    # the seeds of `dilate` and `dilate_s`
+    for seed in (border_seed(image), np.maximum(image, 100) - image.dtype.type(100)):
+        expected = morphology.reconstruction(seed, image, method='dilation')
+        reconstructed = _morph.reconstruct_dilation(seed, image)
+        assert reconstructed.dtype == expected.dtype
+        assert np.array_equal(reconstructed, expected)
+
+
+def test_stacks_across_threads_match_frames():
+    stack = make_data(T=1)[0, 0, 0].astype(np.float32)
+    seeds = np.stack([border_seed(frame) for frame in stack])
+
+    expected = np.stack([_morph.reconstruct_dilation(s, m) for s, m in zip(seeds, stack)])
+    assert np.array_equal(_morph.reconstruct_dilation(seeds, stack, n_threads=3), expected)
+
+
+def test_seed_above_mask_is_an_error():
+    mask = np.zeros((8, 8))
+    with pytest.raises(ValueError):
+        _morph.reconstruct_dilation(mask + 1, mask)
+    with pytest.raises(ValueError):
+        _morph.reconstruct_dilation(mask[:4], mask)
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+
+import imagePipeline.utils.op_cache as _cache
+from conftest import make_data
+
+
+def run_unit(make_transformer, data, scene, t_start, t_stop, **params):
+    """process one work unit the way `run_schedule.run_unit` slices it"""
+    unit = {'unit_id': f"s{scene}_t{t_start}", 'scene': scene,
+            't_start': t_start, 't_stop': t_stop}
+    transformer = make_transformer(metadata={'work_unit': unit}, **params)
+    return transformer.process_tiles(data[scene:scene + 1, t_start:t_stop])
+
+
+def test_store_and_load_chunks(tmp_path):
+    cache = _cache.OpCache(str(tmp_path), max_bytes=1 << 30)
+    block = np.arange(2 * 3 * 4 * 5, dtype=np.float32).reshape(2, 3, 4, 5)
+    cache.store("key", 7, block)
+
+    assert cache.has("key", [7, 8])
+    assert not cache.has("key", [6, 7])
+    assert np.array_equal(np.stack(cache.load("key", [7, 8])), block)
+
+
+def test_eviction_keeps_the_size_bound(tmp_path):
+    cache = _cache.OpCache(str(tmp_path), max_bytes=8000)
+    for t in range(4):
+        cache.store("key", t, np.zeros((1, 20, 20)))
+
+    sizes = [os.path.getsize(os.path.join(root, f))
+             for root, _, files in os.walk(str(tmp_path)) for f in files]
+    assert sum(sizes) <= 8000
+    assert not cache.has("key", [0])
+    assert cache.has("key", [3])
+
+
+def test_second_run_reuses_the_cache(make_transformer, tmp_path):
+    data = make_data(T=2)
+    params = {'op_cache_directory': str(tmp_path / "cache")}
+    first = make_transformer(**params).process_tiles(data)
+    second = make_transformer(**params).process_tiles(data)
+    assert np.array_equal(first, second)
+    assert np.array_equal(first, make_transformer().process_tiles(data))
+
+
+def test_scenes_do_not_share_entries(make_transformer, tmp_path):
+    data = make_data(T=2, scenes=2)
+    data[1] = data[1] // 2 + 7
+    params = {'op_cache_directory': str(tmp_path / "cache")}
+
+    run_unit(make_transformer, data, 0, 0, 2, **params)
+    cached = run_unit(make_transformer, data, 1, 0, 2, **params)
+    expected = run_unit(make_transformer, data, 1, 0, 2)
+    assert np.array_equal(cached, expected)
+
+
+def test_time_chunks_are_keyed_by_absolute_timepoint(make_transformer, tmp_path):
+    data = make_data(T=4)
+    params = {'op_cache_directory': str(tmp_path / "cache")}
+
+    run_unit(make_transformer, data, 0, 0, 2, **params)
+    cached = run_unit(make_transformer, data, 0, 2, 4, **params)
+    expected = run_unit(make_transformer, data, 0, 2, 4)
+    assert np.array_equal(cached, expected)
+
+    # the whole scene reuses both units' chunks
+    whole = run_unit(make_transformer, data, 0, 0, 4, **params)
+    assert np.array_equal(whole, make_transformer().process_tiles(data))
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from skimage import filters, util
+
+import imagePipeline.preprocess_funcs.op_registry as _registry
+import imagePipeline.utils.tensor_ops as _tensor
+from conftest import make_data
+
+
+def test_every_op_is_bound(make_transformer):
+    transformer = make_transformer()
+    assert set(transformer.ops) == set(_registry.OPS)
+    for name in _registry.OPS:
+        spec = _registry.get_spec(name)
+        assert spec['locality'] in ('pointwise', 'neighbourhood', 'frame', 'temporal')
+
+
+def test_unknown_op_is_an_error():
+    with pytest.raises(ValueError):
+        _registry.get_spec('not_an_op')
+
+
+def test_declared_out_ranges_hold(make_transformer):
+    transformer = make_transformer(gaussian_blur_sigma=2)
+    frame = np.random.default_rng(0).random((64, 80)) * 0.5 + 0.25
+    for name, spec in _registry.OPS.items():
+        if spec['out_range'] is None:
+            continue
+        processed = transformer._process_frame(frame, [name], cast=False, 
+                                               intensity_range=(0.3, 0.7))
+        # integer results span their dtype's range
+        processed = util.img_as_float(processed)
+        low, high = (0, 1) if spec['out_range'] == 'unit' else (0, frame.max())
+        assert low <= processed.min() and processed.max() <= high + 1e-12, name
+    assert _registry.get_out_range(['rescale', 'dilate', 'gamma']) == 'unit'
+    assert _registry.get_out_range(['rescale', 'log']) is None
+    assert _registry.get_out_range([]) == 'input'
+
+
+def test_otsu_keeps_integer_frames(make_transformer):
+    transformer = make_transformer(process_channels={'At520': ['otsu']})
+    frame = make_data(T=1)[0, 0, 0, 0]
+
+    expected = np.digitize(frame, bins=filters.threshold_multiotsu(frame, classes=2))
+    processed = transformer._process_frame(frame, ['otsu'])
+    assert np.array_equal(processed, expected)
+
+
+def test_strips_cover_every_row():
+    for n_rows, n_strips, halo in [(100, 3, 5), (64, 4, 40), (7, 10, 1)]:
+        height, strips = _tensor.get_strips(n_rows, n_strips, halo)
+        rows = np.concatenate([np.arange(start, stop) for _, start, stop in strips])
+        assert np.array_equal(rows, np.arange(n_rows))
+        for w0, start, stop in strips:
+            # the window holds the strip and its halo, inside the frame
+            assert 0 <= w0 and w0 + height <= n_rows
+            assert w0 <= max(start - halo, 0) and min(stop + halo, n_rows) <= w0 + height
+
+
+def test_strips_match_whole_frames(make_transformer, tmp_path):
+    costs = tmp_path / "costs.json"
+    costs.write_text('{"blur": [0, 1e-5]}')
+    transformer = make_transformer(image_shape=(256, 80), gaussian_blur_sigma=2,
+                                   op_costs=str(costs), executor='threads')
+    frames = np.random.default_rng(0).random((1, 256, 80))
+    func_list = ['blur', 'gamma']
+
+    n_strips = transformer._get_strip_count(func_list, frames.shape, 'threads')
+    assert n_strips == 2
+    # ops of the whole frame are never split
+    assert transformer._get_strip_count(['blur', 'rescale'], frames.shape, 'threads') == 1
+
+    with transformer.open_pool() as pool:
+        processed = transformer._map_strips(pool, frames, func_list, n_strips, 'threads')
+    expected = transformer._process_frame(frames[0], func_list)
+    assert np.array_equal(processed[0], expected)
@@ -0,0 +1,101 @@
+import json
+import os
+import time
+import threading
+import pytest
+
+import imagePipeline.data_io.writers as _write
+import imagePipeline.utils.profiler as _profiler
+from conftest import make_data, CHANNELS
+
+
+OP_FIELDS = {'calls', 'wall_s', 'cpu_s', 'wall_ms_per_call', 'peak_rss_mb', 'peak_alloc_mb'}
+DISPATCH_FIELDS = {'calls', 'frames', 'wall_s', 'worker_busy_s', 'worker_utilisation'}
+
+
+def test_profile_is_saved_next_to_the_parameters(make_transformer, tmp_path):
+    data = make_data(T=2)
+    out = tmp_path / "out"
+    out.mkdir()
+    transformer = make_transformer(profile_ops=True, output_directory=str(out))
+    transformer.process_tiles(data)
+
+    writer = _write.OutputWriter(transformer.params, transformer.metadata)
+    writer.save_params()
+    writer.save_profile(transformer.get_profile())
+    assert sorted(os.listdir(out)) == ['PARAMETERS_synthetic.json', 'PROFILE_synthetic.json']
+
+    with open(out / "PROFILE_synthetic.json") as f:
+        profile = json.load(f)
+    assert set(profile) == {'channels', 'parent_peak_rss_mb'}
+    assert set(profile['channels']) == set(CHANNELS)
+    for channel in profile['channels'].values():
+        assert set(channel['dispatch']) == DISPATCH_FIELDS
+        # every frame of every timepoint is dispatched
+        assert channel['dispatch']['frames'] == data.shape[1] * data.shape[3]
+        assert 0 < channel['dispatch']['worker_utilisation'] <= 1
+        for stats in channel['ops'].values():
+            assert set(stats) == OP_FIELDS
+            assert stats['calls'] > 0 and stats['wall_s'] >= 0
+
+
+def test_no_profile_without_profile_ops(make_transformer, tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    transformer = make_transformer(output_directory=str(out))
+    transformer.process_tiles(make_data(T=1))
+    assert transformer.get_profile() is None
+
+    _write.OutputWriter(transformer.params, transformer.metadata).save_profile(None)
+    assert os.listdir(out) == []
+
+
+def test_cpu_time_is_the_calling_thread():
+    stop = threading.Event()
+    def spin():
+        while not stop.is_set():
+            pass
+
+    spinner = threading.Thread(target=spin)
+    spinner.start()
+    try:
+        profiler = _profiler.OpProfiler()
+        with profiler.measure('sleep'):
+            time.sleep(0.2)
+    finally:
+        stop.set()
+        spinner.join()
+
+    s = profiler.pop()['sleep']
+    assert s['calls'] == 1
+    assert s['cpu_s'] < 0.05 <= s['wall_s']
+
+
+def test_merge_keeps_unavailable_peaks():
+    tracked = {'op': {'calls': 1, 'wall_s': 1.0, 'cpu_s': 1.0,
+                      'peak_rss_bytes': 10, 'peak_alloc_bytes': 5}}
+    untracked = {'op': dict(tracked['op'], peak_alloc_bytes=None)}
+    assert _profiler.merge_op_stats([tracked, tracked])['op']['peak_alloc_bytes'] == 5
+    assert _profiler.merge_op_stats([tracked, untracked])['op']['peak_alloc_bytes'] is None
+    assert _profiler.merge_op_stats([untracked, tracked])['op']['peak_alloc_bytes'] is None
+
+    report = _profiler.ProfileReport()
+    for ops in (tracked, untracked):
+        report.add('At520', {'ops': ops, 'n_frames': 1, 'wall_s': 1.0, 'busy_s': 1.0, 'n_procs': 1})
+    s = report.to_dict()['channels']['At520']['ops']['op']
+    assert s['calls'] == 2 and s['peak_alloc_mb'] is None
+
+
+@pytest.mark.parametrize("executor", ['serial', 'processes', 'threads'])
+def test_allocation_peaks_only_without_threads(make_transformer, executor):
+    transformer = make_transformer(executor=executor, profile_ops=True)
+    transformer.process_tiles(make_data(T=2))
+    profile = transformer.get_profile()
+
+    ops = [s for channel in profile['channels'].values() for s in channel['ops'].values()]
+    assert ops
+    for s in ops:
+        if executor == 'threads':
+            assert s['peak_alloc_mb'] is None
+        else:
+            assert s['peak_alloc_mb'] >= 0
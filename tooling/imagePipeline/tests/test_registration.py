@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import imagePipeline.preprocess_funcs.registration as _reg
+import imagePipeline.preprocess_funcs.transform as _prep
+from conftest import make_data
+
+
+TILE_SHAPE = (256, 242)
+OVERLAP = 36 / 242  # 36 px between columns, a nominal offset of (0, 206)
+
+
+def blobs(shape, seed=0, n=60, radius=6):
+    """a field of gaussian nuclei"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    image = np.zeros(shape)
+    for cy, cx in rng.uniform(0, 1, size=(n, 2)) * shape:
+        image += np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * radius ** 2))
+    return image
+
+
+def cut_tiles(canvas, positions, noise=0.02, seed=1):
+    rng = np.random.default_rng(seed)
+    tiles = [canvas[y:y + TILE_SHAPE[0], x:x + TILE_SHAPE[1]] for y, x in positions]
+    return np.stack(tiles) + rng.normal(0, noise, size=(len(tiles),) + TILE_SHAPE)
+
+
+@pytest.mark.parametrize("shift", [(0, 0), (-3, 2), (2, -4), (-6, -7), (1, 8)])
+def test_known_shift_on_a_narrow_overlap(shift):
+    canvas = blobs((300, 520))
+    origin = np.array([10, 10])
+    positions = [origin, origin + (0, 206) + np.array(shift)]
+    tiles = cut_tiles(canvas, positions)
+
+    (i, j, offset, weight), = _reg.pairwise_offsets(tiles, (1, 2), OVERLAP)
+    assert tuple(offset) == (shift[0], 206 + shift[1])
+    assert weight >= _reg.MIN_NCC
+
+
+def test_unrelated_tiles_keep_the_nominal_offset():
+    tiles = np.stack([blobs(TILE_SHAPE, seed=0), blobs(TILE_SHAPE, seed=1)])
+    tiles += np.random.default_rng(0).normal(0, 0.3, size=tiles.shape)
+
+    (i, j, offset, weight), = _reg.pairwise_offsets(tiles, (1, 2), OVERLAP)
+    assert tuple(offset) == (0, 206)
+    assert weight == _reg.NOMINAL_WEIGHT
+
+
+def test_register_and_fuse_a_grid():
+    canvas = blobs((560, 520), n=200)
+    nominal = _reg.nominal_positions((2, 2), TILE_SHAPE, OVERLAP)
+    true = nominal + [[0, 0], [2, -3], [-4, 1], [3, 5]] + 10
+    tiles = cut_tiles(canvas, true, noise=0.0)
+
+    positions = _reg.register_tiles(tiles, (2, 2), OVERLAP)
+    assert np.array_equal(positions, true - true[0])
+
+    # registered tiles of a noise-free canvas fuse back to it
+    shape = tuple((positions + TILE_SHAPE).max(axis=0))
+    fused = _reg.fuse_frame(tiles, positions, shape)
+    inner = canvas[10:10 + shape[0], 10:10 + shape[1]]
+    covered = np.zeros(shape, bool)
+    for y, x in positions:
+        covered[y:y + TILE_SHAPE[0], x:x + TILE_SHAPE[1]] = True
+    assert np.allclose(fused[covered], inner[covered])
+
+
+def test_stitch_fuses_a_block_at_a_time(make_transformer):
+    data = make_data(T=5, Y=32, X=40)
+    transformer = make_transformer(procs=2, image_shape=(32, 40), stitch_overlap=0.25,
+                                   output_dtype='float64')
+    stitched = transformer.stitch(data)
+
+    positions = transformer.tile_positions
+    canvas_shape = _reg.get_canvas_shape((2, 2), (32, 40), 0.25)
+    for c in range(data.shape[2]):
+        fused = _reg.fuse_frames(data[0, :, c], positions, canvas_shape)
+        assert np.array_equal(stitched[0, :, c, 0], fused)
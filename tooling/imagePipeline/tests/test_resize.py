@@ -0,0 +1,34 @@
+import numpy as np
+from skimage import transform, util
+
+import imagePipeline.preprocess_funcs.transform as _prep
+import imagePipeline.utils.tensor_ops as _tensor
+from conftest import make_data
+
+
+def test_interpolate_is_the_default(make_transformer):
+    assert _prep.DEFAULT_PARAMS['resize_method'] == 'interpolate'
+    transformer = make_transformer(tile_resize_factor=2)
+    assert transformer.resize_method == 'interpolate'
+
+    frame = make_data(T=1)[0, 0, 0, 0]
+    expected = transform.resize(frame, (32, 40))
+    assert np.array_equal(transformer._resize(frame), expected)
+
+
+def test_block_mean_is_opt_in(make_transformer):
+    transformer = make_transformer(tile_resize_factor=2, resize_method='block_mean')
+    frames = make_data(T=1)[0, 0, 0]
+    expected = _tensor.block_mean(util.img_as_float(frames), 2)
+    assert np.array_equal(transformer._resize(frames), expected)
+
+
+def test_default_stitch_resizes_the_montage(make_transformer):
+    data = make_data(T=2, Y=32, X=40)
+    transformer = make_transformer(image_shape=(32, 40), quilt_resize_factor=2,
+                                   output_dtype='float64')
+    stitched = transformer.stitch(data)
+
+    montaged = _tensor.montage(data[0, 1], (2, 2))
+    expected = transform.resize(montaged[2], (32, 40))
+    assert np.array_equal(stitched[0, 1, 2, 0], expected)
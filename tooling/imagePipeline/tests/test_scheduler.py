@@ -0,0 +1,155 @@
+import os
+import json
+from xml.etree import ElementTree
+import numpy as np
+import dask.array as da
+import pytest
+import tifffile
+from easydict import EasyDict
+
+import imagePipeline.data_io.loaders as _read
+import imagePipeline.run_schedule as _run
+import imagePipeline.utils.scheduler as _sched
+from conftest import make_data, CHANNELS, PARAMS_PATH
+
+
+GLOBAL_CHANNELS = {
+    'At520': ['log', 'stretch_global'],
+    'At425': ['rescale_global'],
+    'mCher': ['dilate', 'rescale'],
+}
+
+
+class SceneReader():
+    """stands in for aicsimageio's `CziReader`, which, like it, only holds
+    its current scene: `shape` and `dask_data` have a leading axis of 1"""
+    files = {}
+
+    def __init__(self, path):
+        self.data = self.files[os.path.basename(path)]
+        self.scenes = tuple(f"Scene:{s}" for s in range(self.data.shape[0]))
+        self.current_scene_index = 0
+        self.metadata = ElementTree.fromstring("<ImageDocument><Metadata/></ImageDocument>")
+
+    @property
+    def shape(self):
+        return (1,) + self.data.shape[1:]
+
+    @property
+    def dask_data(self):
+        s = self.current_scene_index
+        return da.from_array(self.data[s:s + 1], chunks=(1, 1, 1, 1) + self.data.shape[-2:])
+
+    def set_scene(self, scene):
+        self.current_scene_index = scene
+
+    def get_channel_names(self):
+        return list(CHANNELS)
+
+
+@pytest.fixture
+def make_loader(tmp_path, monkeypatch):
+    """a factory of (params, loader) over files of synthetic scenes"""
+    monkeypatch.setattr(_read, 'CziReader', SceneReader)
+    monkeypatch.setattr(SceneReader, 'files', {})
+
+    def make(files, **params):
+        SceneReader.files.update(files)
+        for name in files:
+            (tmp_path / name).write_bytes(name.encode())
+        with open(PARAMS_PATH) as f:
+            config = EasyDict(json.load(f))
+        config.update({'data_directory': str(tmp_path), 'files': sorted(files),
+                       'output_directory': str(tmp_path / "out"), 'parallel_procs': 2,
+                       'grid_shape': [2, 2]}, **params)
+        os.makedirs(config['output_directory'], exist_ok=True)
+        return config, _read.cziLoader(config)
+    return make
+
+
+@pytest.mark.filterwarnings("ignore:Current pipeline optimized")
+def test_expand_units_and_names(make_loader):
+    _, loader = make_loader({'file0.czi': make_data(T=5),
+                             'file1.czi': make_data(T=4, scenes=2)})
+    units = _sched.expand_units(loader, time_chunk=2)
+
+    assert [u['unit_id'] for u in units[:3]] == [
+        'file0_T00000-00001', 'file0_T00002-00003', 'file0_T00004-00004']
+    assert [u['unit_id'] for u in units[3:]] == [
+        'file1_S0_T00000-00001', 'file1_S0_T00002-00003',
+        'file1_S1_T00000-00001', 'file1_S1_T00002-00003']
+    assert _sched.expand_units(loader)[0]['unit_id'] == 'file0'
+
+
+def test_manifest_tracks_done_units(make_loader, tmp_path):
+    _, loader = make_loader({'file0.czi': make_data(T=4, scenes=2)})
+    units = _sched.expand_units(loader, time_chunk=2)
+    manifest = _sched.Manifest(str(tmp_path), "test")
+    manifest.save(units, "test.json")
+
+    other = _sched.Manifest(str(tmp_path), "test")
+    assert other.exists()
+    assert other.load() == units
+    assert other.pending() == [0, 1, 2, 3]
+
+    manifest.mark_done(units[1], {'minutes': 0.1})
+    assert other.is_done(units[1])
+    assert other.pending() == [0, 2, 3]
+
+
+def test_every_scene_is_planned_fitted_and_run(make_loader, make_transformer, tmp_path):
+    data = make_data(T=2, scenes=2)
+    data[1] = data[1] // 2 + 5000
+    params, loader = make_loader({'multi.czi': data}, process_channels=GLOBAL_CHANNELS,
+                                 global_stats_samples=0)
+
+    units = _sched.expand_units(loader)
+    assert [(u['unit_id'], u['scene']) for u in units] == [('multi_S0', 0), ('multi_S1', 1)]
+
+    # the range spans both scenes
+    _run.fit_intensity_ranges(params, units)
+    ranges = units[0]['intensity_ranges']
+    assert ranges['At425'] == [float(data[:, :, 1].min()), float(data[:, :, 1].max())]
+
+    for unit in units:
+        _run.run_unit(params, unit)
+        stored = tifffile.imread(str(tmp_path / "out" / f"OME_{unit['unit_id']}.tiff"))
+
+        s = unit['scene']
+        transformer = make_transformer(metadata={'work_unit': unit}, intensity_ranges=ranges,
+                                       process_channels=GLOBAL_CHANNELS)
+        expected = transformer.process_tiles(data[s:s + 1])
+        assert np.array_equal(stored, np.moveaxis(expected[0], 1, 2))
+
+
+def test_intensity_ranges_are_fitted_over_the_file(make_transformer):
+    data = make_data(T=4, scenes=2)
+    data[1] = data[1] // 2 + 5000
+    transformer = make_transformer(process_channels=GLOBAL_CHANNELS, global_stats_samples=0)
+    ranges = transformer.fit_intensity_ranges(data)
+
+    assert set(ranges) == {'At520', 'At425'}
+    assert ranges['At425'] == [float(data[:, :, 1].min()), float(data[:, :, 1].max())]
+
+
+def test_units_share_the_planned_range(make_transformer):
+    data = make_data(T=4)
+    data[0, 2:] = data[0, 2:] // 2
+    planner = make_transformer(process_channels=GLOBAL_CHANNELS, global_stats_samples=0)
+    ranges = planner.fit_intensity_ranges(data)
+
+    def run_unit(t_start, t_stop, **params):
+        unit = {'unit_id': f"t{t_start}", 'scene': 0, 't_start': t_start, 't_stop': t_stop}
+        transformer = make_transformer(metadata={'work_unit': unit},
+                                       process_channels=GLOBAL_CHANNELS,
+                                       global_stats_samples=0, **params)
+        return transformer.process_tiles(data[:, t_start:t_stop])
+
+    whole = run_unit(0, 4)
+    planned = np.concatenate([run_unit(0, 2, intensity_ranges=ranges),
+                              run_unit(2, 4, intensity_ranges=ranges)], axis=1)
+    assert np.array_equal(planned, whole)
+
+    # without the planned range each unit would fit its own
+    unplanned = np.concatenate([run_unit(0, 2), run_unit(2, 4)], axis=1)
+    assert not np.array_equal(unplanned, whole)
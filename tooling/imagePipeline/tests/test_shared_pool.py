@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+import imagePipeline.utils.shared_pool as _pool
+from conftest import make_data
+
+
+def test_get_batches_cover_every_frame():
+    batches = _pool.get_batches(10, 4, 2)
+    assert batches == [(0, 4), (4, 8), (8, 10)]
+    assert _pool.get_batches(10, 8, 4) == [(0, 3), (3, 6), (6, 9), (9, 10)]
+
+
+@pytest.mark.parametrize("batch_size", [1, 4])
+def test_map_frames_matches_serial(make_transformer, batch_size):
+    transformer = make_transformer(procs=2)
+    frames = make_data(T=2)[0, :, 1].reshape(-1, 64, 80)
+    func_list = transformer.process_channels['At425']
+
+    with _pool.SharedMemoryPool(transformer, 2) as pool:
+        processed = pool.map_frames(frames, func_list, (64, 80), batch_size=batch_size)
+        processed = processed.copy()
+        stats = pool.last_stats
+
+    expected = np.stack([transformer._process_frame(f, func_list) for f in frames])
+    assert np.array_equal(processed, expected)
+
+    # busy time is worker time, bounded by the wall time of every worker
+    assert 0 < stats['busy_s'] <= stats['wall_s'] * stats['n_procs']
@@ -0,0 +1,24 @@
+import numpy as np
+import dask.array as da
+import pytest
+
+from conftest import make_data
+
+
+@pytest.mark.parametrize("stitch", [False, True])
+def test_blocks_match_the_whole_run(make_transformer, stitch):
+    data = make_data(T=3)
+    # one timepoint of 4 tiles fills both workers, so blocks hold one
+    transformer = make_transformer()
+    with transformer.open_pool() as pool:
+        blocks = list(transformer.iter_blocks(da.from_array(data), pool=pool, stitch=stitch))
+    assert len(blocks) == 3
+
+    reference = make_transformer()
+    expected = reference.process_tiles(data)
+    if stitch:
+        expected = reference.process_stitched(reference.stitch(expected))
+
+    streamed = np.concatenate(blocks, axis=1)
+    assert streamed.shape == transformer.get_output_shape(data, stitch=stitch)
+    assert np.array_equal(streamed, expected)
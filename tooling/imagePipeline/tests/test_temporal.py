@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from conftest import make_data
+
+
+def static_series(T=4):
+    """a [0, 1] series whose every timepoint repeats the first one"""
+    data = make_data(T=1) / 4000
+    return np.repeat(data, T, axis=1)
+
+
+def run(make_transformer, data, func_list, **params):
+    transformer = make_transformer(process_channels={'At425': func_list}, **params)
+    return transformer, transformer.process_tiles(data)
+
+
+@pytest.mark.parametrize("op", ['ball', 'dilate', 'dilate_s'])
+def test_static_background_matches_the_frame_op(make_transformer, op):
+    data = static_series()
+    _, temporal = run(make_transformer, data, ['gamma', f"{op}_t", 'rescale'])
+    _, per_frame = run(make_transformer, data, ['gamma', op, 'rescale'])
+    # the model is held in float32
+    assert np.allclose(temporal, per_frame, rtol=0, atol=1e-5)
+
+
+def test_window_fits_a_model_per_block_of_timepoints(make_transformer):
+    # a background that changes at every timepoint
+    data = static_series()
+    data *= np.linspace(0.5, 1, data.shape[1])[None, :, None, None, None, None]
+
+    _, windowed = run(make_transformer, data, ['dilate_t'], temporal_background_window=1)
+    _, per_frame = run(make_transformer, data, ['dilate'])
+    _, whole = run(make_transformer, data, ['dilate_t'], temporal_background_window=0)
+    assert np.allclose(windowed, per_frame, rtol=0, atol=1e-6)
+    assert not np.allclose(whole, per_frame, rtol=0, atol=1e-6)
+
+
+def test_samples_bound_the_frames_of_a_model(make_transformer):
+    data = make_data(T=4)
+    transformer, processed = run(make_transformer, data, ['dilate_t'],
+                                 temporal_background_samples=1)
+
+    # a single sample is the first timepoint of the window
+    frames = data[0, :, 1].astype(np.float64)
+    background = frames[0] - np.stack([transformer.dilate(tile) for tile in frames[0]])
+    expected = frames - background.astype(np.float32)
+    assert np.allclose(processed[0, :, 0], expected, rtol=0, atol=1e-6)
+
+
+def test_temporal_ops_need_a_model(make_transformer):
+    transformer = make_transformer()
+    with pytest.raises(ValueError):
+        transformer.temporal_subtract(make_data(T=1)[0, 0, 0, 0])
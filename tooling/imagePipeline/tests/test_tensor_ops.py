@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from skimage import util
+
+import imagePipeline.utils.tensor_ops as _tensor
+
+
+def test_montage_matches_skimage():
+    stack = np.random.default_rng(0).random((2, 3, 6, 8, 10))
+    montaged = _tensor.montage(stack, (2, 3))
+
+    assert montaged.shape == (2, 3, 16, 30)
+    for t in range(2):
+        for c in range(3):
+            expected = util.montage(stack[t, c], grid_shape=(2, 3))
+            assert np.array_equal(montaged[t, c], expected)
+
+
+def test_missing_tiles_are_filled_with_the_mean():
+    stack = np.random.default_rng(1).random((5, 4, 4))
+    expected = util.montage(stack, grid_shape=(2, 3))
+    assert np.allclose(_tensor.montage(stack, (2, 3)), expected)
+
+
+def test_snake_order_and_out():
+    stack = np.arange(6 * 2 * 2).reshape(1, 6, 2, 2)
+    cells = _tensor.get_tile_cells((3, 2), 'snake')
+    assert cells.tolist() == [0, 1, 3, 2, 4, 5]
+
+    # snake tiles are row-major tiles put back in their cells
+    reordered = np.empty_like(stack)
+    reordered[:, cells] = stack
+    out = np.zeros((1, 6, 4), dtype=stack.dtype)
+    montaged = _tensor.montage(stack, (3, 2), 'snake', out=out)
+    assert montaged is out
+    assert np.array_equal(out, _tensor.montage(reordered, (3, 2)))
+
+
+def test_montage_errors():
+    stack = np.zeros((5, 4, 4))
+    with pytest.raises(ValueError):
+        _tensor.montage(stack, (2, 2))
+    with pytest.raises(ValueError):
+        _tensor.montage(stack, (2, 3), 'column-major')
+    with pytest.raises(ValueError):
+        _tensor.montage(stack, (2, 3), out=np.zeros((12, 8)).T)
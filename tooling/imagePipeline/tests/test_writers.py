@@ -0,0 +1,109 @@
+import os
+import numpy as np
+import pytest
+import tifffile
+
+import imagePipeline.data_io.writers as _write
+import imagePipeline.utils.tensor_ops as _tensor
+from conftest import make_data
+
+
+def make_writer(tmp_path, **params):
+    params = dict({'output_directory': str(tmp_path), 'output_dtype': 'float32',
+                   'output_chunk_size': 32, 'output_pyramid_levels': 2,
+                   'parallel_procs': 2, 'grid_shape': [1, 2]}, **params)
+    return _write.OutputWriter(params, {'czi_path': "/data/run.czi"})
+
+
+def make_blocks(T=3, C=2, Z=2, Y=64, X=80, seed=0):
+    """a 6d image and its blocks of up to two timepoints"""
+    rng = np.random.default_rng(seed)
+    data = rng.random((1, T, C, Z, Y, X)).astype(np.float32)
+    return data, [data[:, t:t + 2] for t in range(0, T, 2)]
+
+
+@pytest.mark.parametrize("compression", ['zstd', 'zlib', None])
+def test_zarr_stream_levels(tmp_path, compression):
+    import zarr
+    data, blocks = make_blocks()
+    writer = make_writer(tmp_path, output_format='ome-zarr', output_compression=compression)
+    writer.write_stream(iter(blocks), data.shape)
+
+    root = zarr.open_group(str(tmp_path / "OME_run.zarr"), mode='r')
+    assert np.array_equal(root['0'][:], data[0])
+    assert np.array_equal(root['1'][:], _tensor.block_mean(data[0], 2))
+    datasets = root.attrs['multiscales'][0]['datasets']
+    assert [d['coordinateTransformations'][0]['scale'] for d in datasets] == [
+        [1, 1, 1, 1, 1], [1, 1, 1, 2, 2]]
+
+
+def test_pyramidal_tiff_stream_levels(tmp_path):
+    data, blocks = make_blocks()
+    writer = make_writer(tmp_path, output_format='pyramidal-ome-tiff')
+    writer.write_stream(iter(blocks), data.shape)
+
+    outpath = tmp_path / "OME_run.tiff"
+    with tifffile.TiffFile(str(outpath)) as tif:
+        levels = tif.series[0].levels
+        full, half = levels[0].asarray(), levels[1].asarray()
+    assert np.array_equal(full, np.moveaxis(data[0], 1, 2))
+    assert np.array_equal(half, np.moveaxis(_tensor.block_mean(data[0], 2), 1, 2))
+    # the spooled levels are removed
+    assert os.listdir(str(tmp_path)) == ["OME_run.tiff"]
+
+
+def test_ome_stream_matches_write_ome(tmp_path):
+    data, blocks = make_blocks()
+    writer = make_writer(tmp_path, output_format='ome-tiff')
+    writer.write_stream(iter(blocks), data.shape)
+
+    stored = tifffile.imread(str(tmp_path / "OME_run.tiff"))
+    assert np.array_equal(stored, np.moveaxis(data[0], 1, 2))
+
+
+def test_unknown_format_is_an_error(tmp_path):
+    data, blocks = make_blocks()
+    with pytest.raises(ValueError):
+        make_writer(tmp_path, output_format='png').write_stream(blocks, data.shape)
+
+
+@pytest.mark.parametrize("compression", ['zstd', None])
+def test_write_tiles_one_file_per_tile(tmp_path, compression):
+    data, _ = make_blocks(Z=2)
+    writer = make_writer(tmp_path, output_compression=compression, output_write_threads=2)
+    # an earlier, partial run left a file behind
+    os.makedirs(str(tmp_path / "run"))
+    (tmp_path / "run" / "OME_tile_1-2.tiff").write_bytes(b"partial")
+
+    writer.write_tiles(data)
+
+    files = sorted(os.listdir(str(tmp_path / "run")))
+    assert files == ["OME_tile_1-1.tiff", "OME_tile_1-2.tiff"]
+    for z, name in enumerate(files):
+        stored = tifffile.imread(str(tmp_path / "run" / name))
+        assert np.array_equal(stored.reshape(data[0, :, :, z].shape), data[0, :, :, z])
+
+
+def test_integer_output_dtype_end_to_end(make_transformer):
+    data = make_data(T=2)
+    transformer = make_transformer(output_dtype='uint16')
+    processed = transformer.process_tiles(data)
+    expected = make_transformer(output_dtype='float64').process_tiles(data)
+    assert processed.dtype == np.uint16
+    assert np.array_equal(processed, _tensor.as_dtype(expected, 'uint16'))
+
+    writer = _write.OutputWriter(transformer.params, transformer.metadata)
+    os.makedirs(writer.output_dir)
+    writer.write_stream(transformer.iter_blocks(data), transformer.get_output_shape(data))
+    stored = tifffile.imread(os.path.join(writer.output_dir, f"OME_{writer.base_name}.tiff"))
+    assert np.array_equal(stored, np.moveaxis(processed[0], 1, 2))
+    # every channel keeps its full range, rather than being clipped to 0 and 1
+    assert all(stored[:, :, c].max() == 65535 for c in range(stored.shape[2]))
+
+
+@pytest.mark.parametrize("func_list", [['dilate'], ['rescale', 'log'], ['rescale', 'otsu']])
+def test_integer_output_dtype_needs_unit_range(make_transformer, func_list):
+    channels = {'At520': func_list, 'At425': ['rescale'], 'mCher': ['rescale']}
+    with pytest.raises(ValueError, match="At520"):
+        make_transformer(output_dtype='uint8', process_channels=channels)
+    make_transformer(output_dtype='float32', process_channels=channels)
@@ -0,0 +1,138 @@
+"""
+per-timepoint checkpoints of processed blocks, with a progress journal
+
+Each finished (channel, timepoint) result is saved as a `.npy` chunk of
+(tiles, Y, X) and appended to `journal.jsonl` once its chunk is on
+disk, so a run that is killed loses at most the block in flight. The
+first journal line holds a fingerprint of everything the results depend
+on (input file, params); a rerun with a different fingerprint starts
+over.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+
+############################################################
+# CLASSES
+############################################################
+
+class Checkpoint():
+    """A class to save processed blocks and resume from them """
+
+    def __init__(self, directory, fingerprint):
+        """
+        Parameters:
+        -----------------------------
+            : directory (str): checkpoint directory, created if needed
+            : fingerprint (dict): what the results depend on
+        """
+        self.directory = os.path.abspath(directory)
+        self.journal_path = os.path.join(self.directory, 'journal.jsonl')
+        spec = json.dumps(fingerprint, sort_keys=True, default=str)
+        self.fingerprint = hashlib.sha256(spec.encode()).hexdigest()
+        self.completed = set()
+        self._open()
+
+
+    def _open(self):
+        """A function to read the journal, and reset the checkpoint if it
+        was written by a different run """
+        entries = []
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # a partial last line, from a run killed mid write
+                        break
+
+        if not entries or entries[0].get('fingerprint') != self.fingerprint:
+            self.clear()
+            os.makedirs(self.directory)
+            self._append({'fingerprint': self.fingerprint})
+            return
+
+        for entry in entries[1:]:
+            key = (entry['channel'], entry['t'])
+            if os.path.exists(self._chunk_path(*key)):
+                self.completed.add(key)
+        if self.completed:
+            print(f"resuming: {len(self.completed)} (channel, timepoint) blocks checkpointed")
+
+
+    def _append(self, entry):
+        with open(self.journal_path, 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def _chunk_path(self, channel, t):
+        return os.path.join(self.directory, f"{channel}_t{t:06d}.npy")
+
+
+    #############################################
+    # progress
+    #############################################
+    def is_done(self, channel, timepoints):
+        """A function to check that every timepoint of a channel is saved
+
+        Parameters:
+        -----------------------------
+            : channel (str): channel name
+            : timepoints (iterable of int): the timepoints needed
+
+        Returns:
+        -----------------------------
+            : done (bool)
+        """
+        return all((channel, t) in self.completed for t in timepoints)
+
+
+    def load(self, channel, timepoints):
+        """A function to load saved timepoints of a channel
+
+        Parameters:
+        -----------------------------
+            : channel (str): channel name
+            : timepoints (iterable of int): the timepoints to load
+
+        Returns:
+        -----------------------------
+            : block (np.array): (time, tiles, Y, X)
+        """
+        return np.stack([np.load(self._chunk_path(channel, t)) for t in timepoints])
+
+
+    def save(self, channel, t_start, block):
+        """A function to save a processed block, one chunk per timepoint,
+        and record it in the journal
+
+        Parameters:
+        -----------------------------
+            : channel (str): channel name
+            : t_start (int): the first timepoint of the block
+            : block (np.array): (time, tiles, Y, X) results
+        """
+        for i, chunk in enumerate(block):
+            t = t_start + i
+            path = self._chunk_path(channel, t)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(chunk))
+            os.replace(tmp_path, path)
+            self._append({'channel': channel, 't': t})
+            self.completed.add((channel, t))
+
+
+    def clear(self):
+        """A function to delete the checkpoint, e.g. once the outputs
+        are written """
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        self.completed = set()
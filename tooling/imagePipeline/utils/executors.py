@@ -0,0 +1,264 @@
+"""
+executors that run `ParallelTransformer` pipelines over stacks of frames
+
+`SharedMemoryPool` (see `utils/shared_pool.py`) runs frames in worker
+processes, which pays for copying the frames through shared memory and
+for one interpreter per core. Ops whose kernels release the GIL (numpy
+ufuncs, numba `nogil` kernels, most of scipy.ndimage) run as fast on
+threads, which read the input and write the output arrays in place.
+
+`ThreadFramePool` has the `map_frames` interface of `SharedMemoryPool` and
+runs frames on threads, or in the calling thread ('serial'). Each thread
+runs its own copy of the transformer (`ParallelTransformer._clone`), so
+the per-frame state of one frame is never seen by another.
+
+`ExecutorPool` holds the executors of a run and dispatches each call to
+the one the transformer picks for the pipeline (see
+`ParallelTransformer._get_executor`).
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import imagePipeline.utils.shared_pool as _pool
+import imagePipeline.utils.profiler as _profiler
+
+
+# 'auto' picks threads or processes per pipeline, from each op's executor
+EXECUTORS = ('auto', 'processes', 'threads', 'serial')
+
+# worker-thread state, set once per thread by `_init_thread`
+_LOCAL = threading.local()
+
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def _init_thread(transformer):
+    """A function to give a worker thread its own copy of the transformer
+
+    Parameters:
+    -----------------------------
+        : transformer (ParallelTransformer): the transformer to run
+    """
+    _LOCAL.transformer = transformer._clone()
+
+
+############################################################
+# CLASSES
+############################################################
+
+class ThreadFramePool():
+    """A class to run `_process_frame` over stacks of frames on a pool of
+    threads, or in the calling thread """
+
+    def __init__(self, transformer, n_threads):
+        """
+        Parameters:
+        -----------------------------
+            : transformer (ParallelTransformer): the transformer to run
+            : n_threads (int): number of worker threads, 0 to run serially
+            in the calling thread
+        """
+        self.n_threads = int(n_threads)
+        self.transformer = transformer
+        self.pool = None
+        if self.n_threads > 0:
+            self.pool = ThreadPoolExecutor(self.n_threads,
+                                           initializer=_init_thread,
+                                           initargs=(transformer,))
+        self.last_stats = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def _process_batch(self, frames, dst, start, stop, func_list, backgrounds, kwargs):
+        """A function to process a batch of frames into the output
+
+        Returns:
+        -----------------------------
+            : dtype (str): the dtype of the processed frames, before they
+            were written to the output
+            : busy_s (float): time spent on the batch
+            : op_stats (dict or None): per-op stats, if the transformer profiles
+        """
+        start_s = time.perf_counter()
+        transformer = self.transformer if self.pool is None else _LOCAL.transformer
+
+        # single frames keep their (Y, X) shape
+        index = start if stop - start == 1 else slice(start, stop)
+        if backgrounds is not None:
+            kwargs = dict(kwargs, background=backgrounds[index])
+
+        image = np.ascontiguousarray(frames[index])
+        image = transformer._process_frame(image, func_list, **kwargs)
+        dst[index] = image
+
+        op_stats = None
+        if transformer.op_profiler is not None:
+            op_stats = transformer.op_profiler.pop()
+        return image.dtype.str, time.perf_counter() - start_s, op_stats
+
+
+    def map_frames(self, frames, func_list, out_shape, out_dtype=np.float64,
+                   backgrounds=None, keep_dtype=False, batch_size=1, out=None,
+                   **kwargs):
+        """A function to process each frame of a stack, see
+        `SharedMemoryPool.map_frames`
+
+        Parameters:
+        -----------------------------
+            : frames, func_list, out_shape, out_dtype, backgrounds,
+            keep_dtype, batch_size, kwargs: see `SharedMemoryPool.map_frames`
+            : out (np.array): optional (n, Y, X) array of `out_dtype` to
+            write the processed frames to
+
+        Returns:
+        -----------------------------
+            : processed (np.array): (n, Y, X) processed frames (`out`, if given)
+        """
+        start = time.perf_counter()
+        n = frames.shape[0]
+        dst = out
+        if dst is None:
+            dst = np.empty((n,) + tuple(out_shape), dtype=out_dtype)
+
+        batches = _pool.get_batches(n, batch_size, max(1, self.n_threads))
+        args = (frames, dst)
+        tail = (func_list, backgrounds, kwargs)
+        if self.pool is None:
+            results = [self._process_batch(*args, b0, b1, *tail) for b0, b1 in batches]
+        else:
+            futures = [self.pool.submit(self._process_batch, *args, b0, b1, *tail)
+                       for b0, b1 in batches]
+            results = [f.result() for f in futures]
+        dtypes = [r[0] for r in results]
+
+        self.last_stats = {
+            'n_frames': n,
+            'n_procs': max(1, self.n_threads),
+            'wall_s': time.perf_counter() - start,
+            'busy_s': sum(r[1] for r in results),
+            'ops': _profiler.merge_op_stats(r[2] for r in results),
+        }
+
+        if keep_dtype:
+            return dst.astype(np.result_type(*dtypes) if dtypes else dst.dtype)
+        return dst
+
+
+    def close(self, terminate=False):
+        """A function to stop the worker threads
+
+        Parameters:
+        -----------------------------
+            : terminate (bool): if True, drop the batches not yet started
+        """
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=terminate)
+            self.pool = None
+
+
+class ExecutorPool():
+    """A class to run stacks of frames on the executor chosen for each
+    call: worker processes, worker threads, or serially """
+
+    def __init__(self, transformer, n_procs, executors=('processes',)):
+        """
+        Parameters:
+        -----------------------------
+            : transformer (ParallelTransformer): the transformer to run
+            : n_procs (int): number of worker processes or threads
+            : executors (iterable of str): the executors the run will use.
+            Worker processes are started here, before any thread, and the
+            other executors on first use.
+        """
+        self.transformer = transformer
+        self.n_procs = int(n_procs)
+        self.executors = {}
+        self.last_stats = None
+
+        # forking after threads have started can copy their held locks
+        if 'processes' in executors:
+            self._get_executor('processes')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(terminate=exc_type is not None)
+
+
+    def _get_executor(self, executor):
+        """A function to return an executor, starting it on first use
+
+        Parameters:
+        -----------------------------
+            : executor (str): 'processes', 'threads' or 'serial'
+
+        Returns:
+        -----------------------------
+            : pool (SharedMemoryPool or ThreadFramePool)
+        """
+        if executor not in self.executors:
+            if executor == 'threads':
+                self.executors[executor] = ThreadFramePool(self.transformer, self.n_procs)
+            elif executor == 'serial':
+                self.executors[executor] = ThreadFramePool(self.transformer, 0)
+            elif executor == 'processes':
+                self.executors[executor] = _pool.SharedMemoryPool(self.transformer, self.n_procs)
+            else:
+                raise ValueError(f"executor must be one of {EXECUTORS[1:]}, got {executor}")
+        return self.executors[executor]
+
+
+    def map_frames(self, frames, func_list, out_shape, executor='processes',
+                   out=None, **kwargs):
+        """A function to process each frame of a stack on an executor
+
+        Parameters:
+        -----------------------------
+            : frames, func_list, out_shape, kwargs: see `SharedMemoryPool.map_frames`
+            : executor (str): 'processes', 'threads' or 'serial'
+            : out (np.array): optional (n, Y, X) output array. Threads write
+            to it in place, processes copy their output to it.
+
+        Returns:
+        -----------------------------
+            : processed (np.array): (n, Y, X) processed frames (`out`, if
+            given). NOTE: without `out`, processes return a view of their
+            shared output, overwritten by the next call.
+        """
+        pool = self._get_executor(executor)
+        if executor == 'processes':
+            processed = pool.map_frames(frames, func_list, out_shape, **kwargs)
+            if out is not None:
+                np.copyto(out, processed)
+                processed = out
+        else:
+            processed = pool.map_frames(frames, func_list, out_shape, out=out, **kwargs)
+
+        self.last_stats = dict(pool.last_stats, executor=executor)
+        return processed
+
+
+    def close(self, terminate=False):
+        """A function to tear down every executor
+
+        Parameters:
+        -----------------------------
+            : terminate (bool): if True, kill workers instead of waiting
+        """
+        for key in list(self.executors):
+            self.executors.pop(key).close(terminate=terminate)
@@ -0,0 +1,112 @@
+"""
+one-pass intensity statistics of a channel
+
+`StreamingHistogram` counts values into a fixed number of equal bins over
+a range that grows to fit the data: when a batch falls outside, the bin
+width doubles and neighbouring bins are merged, which is exact for the
+counts already held. It tracks the exact min and max, and its quantiles
+are accurate to one bin width (at most twice the data range / n_bins).
+"""
+
+import numpy as np
+
+
+# bins of the histogram: quantiles are within 2 / DEFAULT_BINS of the range
+DEFAULT_BINS = 1 << 14
+
+
+############################################################
+# CLASSES
+############################################################
+
+class StreamingHistogram():
+    """A class to accumulate a histogram of values, batch by batch """
+
+    def __init__(self, n_bins=DEFAULT_BINS):
+        """
+        Parameters:
+        -----------------------------
+            : n_bins (int): number of bins, even
+        """
+        self.n_bins = int(n_bins) + int(n_bins) % 2
+        self.counts = np.zeros(self.n_bins, dtype=np.int64)
+        self.lo = None
+        self.width = None
+        self.min = np.inf
+        self.max = -np.inf
+
+
+    @property
+    def n(self):
+        return int(self.counts.sum())
+
+
+    def _grow(self, v_min, v_max):
+        """A function to double the bin width until [v_min, v_max] fits,
+        extending the range down when v_min is below it """
+        while v_min < self.lo or v_max >= self.lo + self.width * self.n_bins:
+            merged = self.counts.reshape(-1, 2).sum(axis=1)
+            self.counts = np.zeros_like(self.counts)
+            if v_min < self.lo:
+                # the old range becomes the upper half
+                self.lo -= self.width * self.n_bins
+                self.counts[self.n_bins // 2:] = merged
+            else:
+                self.counts[:self.n_bins // 2] = merged
+            self.width *= 2
+
+
+    def update(self, values):
+        """A function to add values to the histogram. NaNs and infinities
+        are ignored.
+
+        Parameters:
+        -----------------------------
+            : values (np.array): any shape
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+
+        v_min, v_max = float(values.min()), float(values.max())
+        self.min = min(self.min, v_min)
+        self.max = max(self.max, v_max)
+
+        if self.lo is None:
+            self.lo = v_min
+            span = v_max - v_min
+            # a constant first batch gets a small, non-zero range
+            self.width = (span or max(abs(v_min), 1.0) * 1e-6) * (1 + 1e-9) / self.n_bins
+        self._grow(v_min, v_max)
+
+        index = ((values - self.lo) / self.width).astype(np.int64)
+        np.clip(index, 0, self.n_bins - 1, out=index)
+        self.counts += np.bincount(index, minlength=self.n_bins)
+
+
+    def quantile(self, q):
+        """A function to estimate quantiles, interpolating within bins
+
+        Parameters:
+        -----------------------------
+            : q (float or array): quantiles in [0, 1]
+
+        Returns:
+        -----------------------------
+            : values (float or np.array): clipped to the exact min and max
+        """
+        if self.lo is None:
+            raise ValueError("the histogram is empty")
+
+        cumulative = np.cumsum(self.counts)
+        target = np.asarray(q, dtype=np.float64) * cumulative[-1]
+        index = np.searchsorted(cumulative, target, side='left')
+        index = np.minimum(index, self.n_bins - 1)
+
+        below = np.where(index > 0, cumulative[np.maximum(index - 1, 0)], 0)
+        in_bin = np.maximum(self.counts[index], 1)
+        fraction = np.clip((target - below) / in_bin, 0, 1)
+
+        values = self.lo + (index + fraction) * self.width
+        return np.clip(values, self.min, self.max)
@@ -0,0 +1,183 @@
+"""
+a content-addressed on-disk cache of intermediate op results
+
+An entry is the result of running an op prefix (e.g. ["log", "gamma"])
+on one channel of one scene of an input file. Its key is a hash of the
+file identity (path, size, mtime, and the scene), the channel, the prefix
+and the value of every parameter the prefix uses, so changing any of them
+gives a new entry. Each entry is a directory of one `.npy` chunk per
+timepoint of the scene (absolute, so work units over different time
+ranges share an entry), holding (tiles, Y, X), which is loaded
+memory-mapped. When the cache grows
+beyond its size bound, the least recently used chunks are evicted.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+
+# bump when op semantics change, to invalidate existing entries
+CACHE_VERSION = 2
+
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def file_identity(path):
+    """A function to identify an input file by path, size and mtime
+
+    Parameters:
+    -----------------------------
+        : path (str): input file
+
+    Returns:
+    -----------------------------
+        : identity (dict)
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+############################################################
+# CLASSES
+############################################################
+
+class OpCache():
+    """A class to store and look up op prefix results on disk """
+
+    def __init__(self, directory, max_bytes):
+        """
+        Parameters:
+        -----------------------------
+            : directory (str): cache root, created if needed
+            : max_bytes (int): size bound, enforced on opening and after 
+            each write
+        """
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = int(max_bytes)
+        os.makedirs(self.directory, exist_ok=True)
+        self.evict()
+
+
+    #############################################
+    # keys
+    #############################################
+    def get_key(self, source, channel, prefix, op_params):
+        """A function to return the key of an op prefix result
+
+        Parameters:
+        -----------------------------
+            : source (dict): input identity from `file_identity`, with the
+            scene
+            : channel (str): channel name
+            : prefix (list of str): the ops run so far
+            : op_params (dict): the value of every parameter the prefix uses
+
+        Returns:
+        -----------------------------
+            : key (str): hex digest
+        """
+        spec = {
+            'version': CACHE_VERSION,
+            'source': source,
+            'channel': channel,
+            'prefix': list(prefix),
+            'params': op_params,
+        }
+        spec = json.dumps(spec, sort_keys=True, default=str)
+        return hashlib.sha256(spec.encode()).hexdigest()
+
+
+    def _chunk_path(self, key, t):
+        return os.path.join(self.directory, key, f"t{t:06d}.npy")
+
+
+    #############################################
+    # lookup and storage
+    #############################################
+    def has(self, key, timepoints):
+        """A function to check that every chunk of an entry is cached
+
+        Parameters:
+        -----------------------------
+            : key (str): entry key
+            : timepoints (iterable of int): the timepoints needed
+
+        Returns:
+        -----------------------------
+            : cached (bool)
+        """
+        return all(os.path.exists(self._chunk_path(key, t)) for t in timepoints)
+
+
+    def load(self, key, timepoints):
+        """A function to load the chunks of an entry, memory-mapped, and
+        mark them as recently used
+
+        Parameters:
+        -----------------------------
+            : key (str): entry key
+            : timepoints (iterable of int): the timepoints to load
+
+        Returns:
+        -----------------------------
+            : chunks (list of np.array): read-only (tiles, Y, X) arrays
+        """
+        chunks = []
+        for t in timepoints:
+            path = self._chunk_path(key, t)
+            chunks.append(np.load(path, mmap_mode='r'))
+            os.utime(path)
+        return chunks
+
+
+    def store(self, key, t_start, block):
+        """A function to write a block of timepoints to an entry, one
+        chunk per timepoint, then evict down to the size bound
+
+        Parameters:
+        -----------------------------
+            : key (str): entry key
+            : t_start (int): the first timepoint of the block
+            : block (np.array): (time, tiles, Y, X) results
+        """
+        os.makedirs(os.path.join(self.directory, key), exist_ok=True)
+        for i, chunk in enumerate(block):
+            path = self._chunk_path(key, t_start + i)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(chunk))
+            os.replace(tmp_path, path)
+        self.evict()
+
+
+    def evict(self):
+        """A function to delete the least recently used chunks until the
+        cache fits its size bound
+        """
+        chunks = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.npy'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    chunks.append((stat.st_mtime_ns, stat.st_size, path))
+
+        total = sum(size for _, size, _ in chunks)
+        for _, size, path in sorted(chunks):
+            if total <= self.max_bytes:
+                break
+            total -= size
+            try:
+                # another process sharing the cache may evict it first
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
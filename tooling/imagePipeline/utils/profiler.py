@@ -0,0 +1,205 @@
+"""
+per-op timing and memory instrumentation
+
+`OpProfiler` runs inside each worker and measures every op (or fused run
+of ops) of `_process_image`: wall time, CPU time of the calling thread,
+the peak RSS of the worker after the op, and the peak bytes the op
+allocated through Python and numpy (tracked with `tracemalloc`). Stats
+are popped after each frame and sent back with it.
+
+`tracemalloc` traces (and resets the peak of) the whole process, so the
+allocation peaks of ops running concurrently on threads would include,
+and reset, each other's: profilers of worker threads do not track memory
+and report `peak_alloc_bytes` as None (unavailable).
+
+`ProfileReport` aggregates the stats per channel in the parent, along
+with the utilisation of the pool for each dispatch.
+"""
+
+import time
+import resource
+import tracemalloc
+from contextlib import contextmanager
+
+
+_MB = 1024 ** 2
+
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def _peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def merge_op_stats(stats_list):
+    """A function to merge per-op stats
+
+    Parameters:
+    -----------------------------
+        : stats_list (iterable of dict): op name -> stats, from
+        `OpProfiler.pop`
+
+    Returns:
+    -----------------------------
+        : merged (dict): op name -> stats
+    """
+    merged = {}
+    for stats in stats_list:
+        for op, s in (stats or {}).items():
+            if op not in merged:
+                merged[op] = dict(s)
+                continue
+            m = merged[op]
+            m['calls'] += s['calls']
+            m['wall_s'] += s['wall_s']
+            m['cpu_s'] += s['cpu_s']
+            m['peak_rss_bytes'] = max(m['peak_rss_bytes'], s['peak_rss_bytes'])
+            if m['peak_alloc_bytes'] is None or s['peak_alloc_bytes'] is None:
+                m['peak_alloc_bytes'] = None
+            else:
+                m['peak_alloc_bytes'] = max(m['peak_alloc_bytes'], s['peak_alloc_bytes'])
+    return merged
+
+
+############################################################
+# CLASSES
+############################################################
+
+class OpProfiler():
+    """A class to measure ops in the process that runs them """
+
+    def __init__(self, track_memory=True):
+        """
+        Parameters:
+        -----------------------------
+            : track_memory (bool): trace allocation peaks, only for a
+            profiler that is alone in its process (not on worker threads)
+        """
+        self.track_memory = track_memory
+        self.stats = {}
+
+
+    @contextmanager
+    def measure(self, op):
+        """A context to measure one call of an op
+
+        Parameters:
+        -----------------------------
+            : op (str): op name
+        """
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            base, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            alloc = None
+            if self.track_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                alloc = max(0, peak - base)
+
+            s = {
+                'calls': 1,
+                'wall_s': wall,
+                'cpu_s': cpu,
+                'peak_rss_bytes': _peak_rss_bytes(),
+                'peak_alloc_bytes': alloc,
+            }
+            self.stats = merge_op_stats([self.stats, {op: s}])
+
+
+    def pop(self):
+        """A function to return and reset the stats
+
+        Returns:
+        -----------------------------
+            : stats (dict): op name -> stats
+        """
+        stats, self.stats = self.stats, {}
+        return stats
+
+
+class ProfileReport():
+    """A class to aggregate op stats and pool dispatches per channel """
+
+    def __init__(self):
+        self.channels = {}
+
+
+    def _get_channel(self, label):
+        if label not in self.channels:
+            self.channels[label] = {
+                'ops': {},
+                'dispatch': {'calls': 0, 'frames': 0, 'wall_s': 0.0,
+                             'busy_s': 0.0, 'capacity_s': 0.0},
+            }
+        return self.channels[label]
+
+
+    def add(self, label, dispatch):
+        """A function to record one pool dispatch
+
+        Parameters:
+        -----------------------------
+            : label (str): channel (or stage) name
+            : dispatch (dict): `SharedMemoryPool.last_stats`
+        """
+        channel = self._get_channel(label)
+        channel['ops'] = merge_op_stats([channel['ops'], dispatch['ops']])
+
+        d = channel['dispatch']
+        d['calls'] += 1
+        d['frames'] += dispatch['n_frames']
+        d['wall_s'] += dispatch['wall_s']
+        d['busy_s'] += dispatch['busy_s']
+        d['capacity_s'] += dispatch['wall_s'] * dispatch['n_procs']
+
+
+    def to_dict(self):
+        """A function to return the report, with derived fields
+
+        Returns:
+        -----------------------------
+            : report (dict): JSON serializable
+        """
+        channels = {}
+        for label, channel in self.channels.items():
+            ops = {}
+            for op, s in channel['ops'].items():
+                alloc = s['peak_alloc_bytes']
+                ops[op] = {
+                    'calls': s['calls'],
+                    'wall_s': round(s['wall_s'], 6),
+                    'cpu_s': round(s['cpu_s'], 6),
+                    'wall_ms_per_call': round(1e3 * s['wall_s'] / s['calls'], 3),
+                    'peak_rss_mb': round(s['peak_rss_bytes'] / _MB, 2),
+                    'peak_alloc_mb': None if alloc is None else round(alloc / _MB, 2),
+                }
+
+            d = channel['dispatch']
+            utilisation = d['busy_s'] / d['capacity_s'] if d['capacity_s'] else 0.0
+            channels[label] = {
+                'ops': ops,
+                'dispatch': {
+                    'calls': d['calls'],
+                    'frames': d['frames'],
+                    'wall_s': round(d['wall_s'], 6),
+                    'worker_busy_s': round(d['busy_s'], 6),
+                    'worker_utilisation': round(utilisation, 4),
+                },
+            }
+
+        return {
+            'channels': channels,
+            'parent_peak_rss_mb': round(_peak_rss_bytes() / _MB, 2),
+        }
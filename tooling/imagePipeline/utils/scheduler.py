@@ -0,0 +1,235 @@
+"""
+expands a parameter file into work units and tracks their completion
+
+A work unit is one (file, scene, timepoint range) of the input. Units are
+listed once in a manifest next to the outputs, so every array task of a
+job sees the same numbering, and each finished unit leaves a marker file
+that is written atomically (array tasks never write the same file). When
+a job is resubmitted, finished units are skipped.
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import subprocess
+
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def expand_units(loader, time_chunk=0):
+    """A function to list the work units of every input file
+
+    Parameters:
+    -----------------------------
+        : loader (cziLoader): loader for the parameter file
+        : time_chunk (int): timepoints per unit, 0 for whole scenes
+
+    Returns:
+    -----------------------------
+        : units (list of dict): with `unit_id`, `file_index`, `file`,
+        `scene`, `t_start` and `t_stop`
+    """
+    units = []
+    for file_index, path in enumerate(loader.input_paths):
+        metadata = loader.get_metadata(index=file_index)
+        # the reader's shape only holds its current scene
+        n_scenes = metadata['n_scenes']
+        n_timepoints = metadata['file_shape'][1]
+        chunk = int(time_chunk) or n_timepoints
+        stem = os.path.splitext(os.path.basename(path))[0]
+
+        for scene in range(n_scenes):
+            for t_start in range(0, n_timepoints, chunk):
+                t_stop = min(t_start + chunk, n_timepoints)
+                units.append({
+                    'unit_id': get_unit_name(stem, scene, t_start, t_stop, n_scenes, n_timepoints),
+                    'file_index': file_index,
+                    'file': path,
+                    'scene': scene,
+                    't_start': t_start,
+                    't_stop': t_stop,
+                })
+    return units
+
+
+def get_unit_name(stem, scene, t_start, t_stop, n_scenes=None, n_timepoints=None):
+    """A function to name a unit's outputs. Whole files keep the input
+    name, so a single scene, single unit run writes the same files as
+    the other runners.
+
+    Parameters:
+    -----------------------------
+        : stem (str): input file name without extension
+        : scene (int): scene index
+        : t_start, t_stop (int): the timepoint range
+        : n_scenes (int): scenes in the file
+        : n_timepoints (int): timepoints in the file
+
+    Returns:
+    -----------------------------
+        : name (str)
+    """
+    name = stem
+    if n_scenes != 1:
+        name = f"{name}_S{scene}"
+    if (t_start, t_stop) != (0, n_timepoints):
+        name = f"{name}_T{t_start:05d}-{t_stop - 1:05d}"
+    return name
+
+
+def get_sbatch_command(script_path, params_path, task_ids, extra_args=(),
+                       max_concurrent=None, job_name=None):
+    """A function to build the `sbatch` command for an array job with one
+    task per pending unit
+
+    Parameters:
+    -----------------------------
+        : script_path (str): the runner to execute per task
+        : params_path (str): the parameter file
+        : task_ids (list of int): the unit indices to run
+        : extra_args (list of str): more arguments for the runner
+        : max_concurrent (int): optional cap on simultaneously running tasks
+        : job_name (str): optional job name
+
+    Returns:
+    -----------------------------
+        : command (list of str)
+    """
+    array = ",".join(str(i) for i in task_ids)
+    if max_concurrent:
+        array = f"{array}%{int(max_concurrent)}"
+
+    task = [sys.executable, script_path, "--params", params_path] + list(extra_args)
+    command = ["sbatch", f"--array={array}"]
+    if job_name:
+        command.append(f"--job-name={job_name}")
+    command.append(f"--wrap={shlex.join(task)} --task-id $SLURM_ARRAY_TASK_ID")
+    return command
+
+
+def run_local(script_path, params_path, task_ids, extra_args=(), n_workers=1):
+    """A function to run units as concurrent local processes, the same way
+    array tasks run them
+
+    Parameters:
+    -----------------------------
+        : script_path (str): the runner to execute per task
+        : params_path (str): the parameter file
+        : task_ids (list of int): the unit indices to run
+        : extra_args (list of str): more arguments for the runner
+        : n_workers (int): units running at once
+
+    Returns:
+    -----------------------------
+        : failed (list of int): task ids that exited with an error
+    """
+    pending = list(task_ids)
+    running = {}
+    failed = []
+
+    while pending or running:
+        while pending and len(running) < max(1, int(n_workers)):
+            task_id = pending.pop(0)
+            command = [sys.executable, script_path, "--params", params_path,
+                       "--task-id", str(task_id)] + list(extra_args)
+            running[task_id] = subprocess.Popen(command)
+
+        for task_id, proc in list(running.items()):
+            returncode = proc.poll()
+            if returncode is None:
+                continue
+            if returncode != 0:
+                failed.append(task_id)
+            del running[task_id]
+        time.sleep(0.5)
+    return failed
+
+
+############################################################
+# CLASSES
+############################################################
+
+class Manifest():
+    """A class to store the work units of a run and track which are done """
+
+    def __init__(self, output_dir, name):
+        """
+        Parameters:
+        -----------------------------
+            : output_dir (str): the run's output directory
+            : name (str): manifest name, e.g. the parameter file name
+        """
+        self.path = os.path.join(os.path.abspath(output_dir), f"MANIFEST_{name}.json")
+        self.done_dir = os.path.join(os.path.abspath(output_dir), f".done_{name}")
+        self.units = []
+
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+
+    def save(self, units, params_path):
+        """A function to write the manifest
+
+        Parameters:
+        -----------------------------
+            : units (list of dict): from `expand_units`
+            : params_path (str): the parameter file the units came from
+        """
+        self.units = units
+        os.makedirs(self.done_dir, exist_ok=True)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'params_path': params_path, 'units': units}, f, indent=1)
+        os.replace(tmp_path, self.path)
+        print(f"Saved: `{self.path}`")
+
+
+    def load(self):
+        """A function to read the manifest
+
+        Returns:
+        -----------------------------
+            : units (list of dict)
+        """
+        with open(self.path) as f:
+            self.units = json.load(f)['units']
+        return self.units
+
+
+    def _marker(self, unit):
+        return os.path.join(self.done_dir, f"{unit['unit_id']}.json")
+
+
+    def is_done(self, unit):
+        return os.path.exists(self._marker(unit))
+
+
+    def mark_done(self, unit, info=None):
+        """A function to record a finished unit
+
+        Parameters:
+        -----------------------------
+            : unit (dict): the unit
+            : info (dict): optional details to store, e.g. run time
+        """
+        os.makedirs(self.done_dir, exist_ok=True)
+        tmp_path = f"{self._marker(unit)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({**unit, **(info or {})}, f)
+        os.replace(tmp_path, self._marker(unit))
+
+
+    def pending(self):
+        """A function to list the units that are not done
+
+        Returns:
+        -----------------------------
+            : task_ids (list of int): indices of pending units
+        """
+        return [i for i, unit in enumerate(self.units) if not self.is_done(unit)]
@@ -0,0 +1,290 @@
+"""
+a persistent worker pool that exchanges frames through shared memory
+"""
+
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+import numpy as np
+
+import imagePipeline.utils.profiler as _profiler
+
+
+# worker-side state, set once per worker by `_init_worker`
+_TRANSFORMER = None
+_ATTACHED = {}
+_MAX_ATTACHED = 8
+
+
+############################################################
+# WORKER FUNCTIONS
+############################################################
+
+def get_batches(n, batch_size, n_workers):
+    """A function to split a stack into contiguous batches of frames, no
+    larger than needed to give every worker one
+
+    Parameters:
+    -----------------------------
+        : n (int): number of frames
+        : batch_size (int): the most frames per batch
+        : n_workers (int): number of workers
+
+    Returns:
+    -----------------------------
+        : batches (list of tuple): (start, stop) of each batch
+    """
+    batch_size = max(1, min(int(batch_size), -(-n // max(1, n_workers))))
+    return [(i, min(i + batch_size, n)) for i in range(0, n, batch_size)]
+
+
+def _init_worker(transformer):
+    """A function to store the transformer once per worker process
+
+    Parameters:
+    -----------------------------
+        : transformer (ParallelTransformer): the transformer whose
+        `_process_image` is run by the worker
+    """
+    global _TRANSFORMER
+    _TRANSFORMER = transformer
+    _ATTACHED.clear()
+
+
+def _attach(spec):
+    """A function to return an array backed by a named shared memory
+    block, attaching (once) if needed. The least recently used block is 
+    closed when more than _MAX_ATTACHED are attached.
+
+    Parameters:
+    -----------------------------
+        : spec (tuple): (name, shape, dtype) of the buffer
+
+    Returns:
+    -----------------------------
+        : arr (np.array): array view of the shared block
+    """
+    name, shape, dtype = spec
+    if name in _ATTACHED:
+        # keep the most recently used last: the blocks of the current task
+        # must never be the ones evicted, closing them unmaps their arrays
+        _ATTACHED[name] = _ATTACHED.pop(name)
+    else:
+        if len(_ATTACHED) >= _MAX_ATTACHED:
+            old_name = next(iter(_ATTACHED))
+            old_shm, _ = _ATTACHED.pop(old_name)
+            try:
+                old_shm.close()
+            except BufferError:
+                # still exported: the mapping is freed with the last view
+                pass
+
+        shm = shared_memory.SharedMemory(name=name)
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        _ATTACHED[name] = (shm, arr)
+    return _ATTACHED[name][1]
+
+
+def _process_frames(task):
+    """A function to process a contiguous batch of frames of the shared 
+    input, as one stack, into the same indices of the shared output
+
+    Parameters:
+    -----------------------------
+        : task (tuple): (in_spec, out_spec, bg_spec, start, stop, func_list, 
+        kwargs) where kwargs are passed on to `ParallelTransformer._process_frame`
+
+    Returns:
+    -----------------------------
+        : dtype (str): the dtype of the processed frames, before they were
+        written to the shared output
+        : busy_s (float): time spent on the task
+        : op_stats (dict or None): per-op stats, if the transformer profiles
+    """
+    start_s = time.perf_counter()
+    in_spec, out_spec, bg_spec, start, stop, func_list, kwargs = task
+    src = _attach(in_spec)
+    dst = _attach(out_spec)
+    
+    # single frames keep their (Y, X) shape
+    index = start if stop - start == 1 else slice(start, stop)
+    if bg_spec is not None:
+        kwargs = dict(kwargs, background=_attach(bg_spec)[index])
+
+    image = np.array(src[index])
+    image = _TRANSFORMER._process_frame(image, func_list, **kwargs)
+    dst[index] = image
+    
+    op_stats = None
+    if _TRANSFORMER.op_profiler is not None:
+        op_stats = _TRANSFORMER.op_profiler.pop()
+    return image.dtype.str, time.perf_counter() - start_s, op_stats
+
+
+############################################################
+# CLASSES
+############################################################
+
+class SharedMemoryPool():
+    """A class to run `_process_image` over stacks of frames on a
+    single persistent pool. Frames are read from and written to shared
+    memory buffers by index, so only small task tuples are pickled """
+
+    def __init__(self, transformer, n_procs):
+        """
+        Parameters:
+        -----------------------------
+            : transformer (ParallelTransformer): the transformer to run
+            : n_procs (int): number of worker processes
+        """
+        self.n_procs = int(n_procs)
+        
+        # workers must share the parent's tracker, otherwise each one 
+        # unlinks the blocks it attached to when it exits
+        resource_tracker.ensure_running()
+        self.pool = mp.Pool(self.n_procs,
+                            initializer=_init_worker,
+                            initargs=(transformer,))
+        self.buffers = {}
+        self.last_stats = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(terminate=exc_type is not None)
+
+
+    #############################################
+    # buffer management
+    #############################################
+    def _get_buffer(self, key, shape, dtype):
+        """A function to return a shared buffer, reusing the existing
+        block for `key` when the frame shape and dtype match and it holds 
+        at least as many frames
+
+        Parameters:
+        -----------------------------
+            : key (str): buffer role, e.g. 'in' or 'out'
+            : shape (tuple): array shape, frames first
+            : dtype (np.dtype): array dtype
+
+        Returns:
+        -----------------------------
+            : spec (tuple): (name, shape, dtype) to send to workers
+            : arr (np.array): array view of the first `shape[0]` frames
+        """
+        shape = tuple(int(s) for s in shape)
+        dtype = np.dtype(dtype)
+
+        if key in self.buffers:
+            shm, spec, arr = self.buffers[key]
+            if (spec[1][1:] == shape[1:] and spec[1][0] >= shape[0] 
+                and spec[2] == dtype.str):
+                return spec, arr[:shape[0]]
+            self._release(key)
+
+        nbytes = max(1, int(np.prod(shape)) * dtype.itemsize)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        spec = (shm.name, shape, dtype.str)
+        self.buffers[key] = (shm, spec, arr)
+        return spec, arr
+
+
+    def _release(self, key):
+        """A function to close and unlink a shared buffer
+
+        Parameters:
+        -----------------------------
+            : key (str): buffer role
+        """
+        shm, _, arr = self.buffers.pop(key)
+        del arr
+        try:
+            shm.close()
+        except BufferError:
+            # a caller still holds a view: the mapping is freed with it
+            pass
+        shm.unlink()
+
+
+    #############################################
+    # execution
+    #############################################
+    def map_frames(self, frames, func_list, out_shape, out_dtype=np.float64, 
+                   backgrounds=None, keep_dtype=False, batch_size=1, **kwargs):
+        """A function to process each frame of a stack in parallel
+
+        Parameters:
+        -----------------------------
+            : frames (np.array): (n, Y, X) stack of input frames
+            : func_list (list of str): the op names to run on each frame
+            : out_shape (tuple): the (Y, X) shape of a processed frame
+            : out_dtype (np.dtype): dtype of the processed frames
+            : backgrounds (np.array): optional (n, Y, X) temporal background 
+            model for each frame
+            : keep_dtype (bool): if True, return a copy with the dtype the 
+            frames were processed to (use with a float64 `out_dtype`, which 
+            holds any of the pipeline's dtypes exactly)
+            : batch_size (int): the most frames to process as one stack per 
+            task. Batches are smaller when there are too few frames to 
+            give every worker one.
+            : kwargs: passed on to `ParallelTransformer._process_frame`
+
+        Returns:
+        -----------------------------
+            : processed (np.array): (n, Y, X) view of the shared output.
+            NOTE: the view is overwritten by the next call, copy it out.
+            Timing and per-op stats of the call are kept in `last_stats`.
+        """
+        start = time.perf_counter()
+        n = frames.shape[0]
+        in_spec, src = self._get_buffer('in', frames.shape, frames.dtype)
+        out_spec, dst = self._get_buffer('out', (n,) + tuple(out_shape), out_dtype)
+        np.copyto(src, frames)
+        
+        bg_spec = None
+        if backgrounds is not None:
+            bg_spec, bg = self._get_buffer('bg', backgrounds.shape, backgrounds.dtype)
+            np.copyto(bg, backgrounds)
+
+        tasks = [(in_spec, out_spec, bg_spec, start, stop, func_list, kwargs) 
+                 for start, stop in get_batches(n, batch_size, self.n_procs)]
+        chunksize = max(1, len(tasks) // (4 * self.n_procs))
+        results = self.pool.map(_process_frames, tasks, chunksize=chunksize)
+        dtypes = [r[0] for r in results]
+        
+        self.last_stats = {
+            'n_frames': n,
+            'n_procs': self.n_procs,
+            'wall_s': time.perf_counter() - start,
+            'busy_s': sum(r[1] for r in results),
+            'ops': _profiler.merge_op_stats(r[2] for r in results),
+        }
+        
+        if keep_dtype:
+            return dst.astype(np.result_type(*dtypes) if dtypes else dst.dtype)
+        return dst
+
+
+    def close(self, terminate=False):
+        """A function to tear down the workers and free all shared buffers
+
+        Parameters:
+        -----------------------------
+            : terminate (bool): if True, kill workers instead of waiting
+        """
+        if self.pool is not None:
+            if terminate:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        for key in list(self.buffers):
+            self._release(key)
@@ -1,48 +1,231 @@
 import numpy as np
+from skimage import util
 
 
-class SceneBlocker():
-    """A class to rebuild each tile into a single image """
+# output dtypes the pipeline can write
+OUTPUT_DTYPES = ('float64', 'float32', 'uint16', 'uint8')
+
+# acquisition orders of the tiles of a grid, see `get_tile_cells`
+TILE_ORDERS = ('row-major', 'snake')
+
+
+def as_dtype(image, dtype):
+    """A function to convert an image to an output dtype. Floats are cast 
+    directly. Integer outputs are rescaled from [0, 1] floats (values
+    outside are clipped) or converted between integer ranges, as with 
+    skimage's `img_as_uint` and `img_as_ubyte`. The transformer rejects 
+    integer outputs of pipelines that may leave [0, 1] (see 
+    `op_registry.get_out_range`)
+    
+    Parameters:
+    -----------------------------
+        : image (np.array): the image
+        : dtype (str or np.dtype): one of OUTPUT_DTYPES
+        
+    Returns:
+    -----------------------------
+        : image (np.array): the converted image (the input if it already
+        has the dtype)
+    """
+    dtype = np.dtype(dtype)
+    if dtype.name not in OUTPUT_DTYPES:
+        raise ValueError(f"output dtype must be one of {OUTPUT_DTYPES}, got {dtype}")
     
-    def __init__(self, scene):
-        self.scene = scene
+    if image.dtype == dtype:
+        return image
+    
+    if np.issubdtype(dtype, np.floating):
+        return image.astype(dtype)
+    
+    if np.issubdtype(image.dtype, np.floating):
+        image = np.clip(image, 0, 1)
+        
+    if dtype == np.uint16:
+        return util.img_as_uint(image)
+    return util.img_as_ubyte(image)
+
+
+def block_mean(image, factor):
+    """A function to downsample the last two axes by an integer factor, 
+    averaging each factor x factor block. Trailing rows and columns that 
+    do not fill a block are dropped. Integer images are rounded back to 
+    their dtype.
     
-    def _stich(self, arr):
-        """A function to stitch together tiles per
-        channel per time point
+    Parameters:
+    -----------------------------
+        : image (np.array): (..., Y, X) image or stack
+        : factor (int): downsampling factor
         
-        Parameters:
-        -----------------------------
-            : arr (np.array): single channel set of 9 images
-            
-        Returns:
-        -----------------------------
-            : blocked_img (np.array): a blocked image
-        """
-    
-        row1 = np.concatenate(arr[0:3], axis=0)
-        row2 = np.concatenate(arr[3:6], axis=0)
-        row3 = np.concatenate(arr[6:9], axis=0)
+    Returns:
+    -----------------------------
+        : downsampled (np.array): (..., Y // factor, X // factor) with the
+        image dtype
+    """
+    f = int(factor)
+    ny = image.shape[-2] // f
+    nx = image.shape[-1] // f
+    trimmed = image[..., :ny * f, :nx * f]
+    
+    blocks = trimmed.reshape(image.shape[:-2] + (ny, f, nx, f))
+    mean = blocks.mean(axis=(-3, -1))
+    
+    if np.issubdtype(image.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(image.dtype)
+
+
+def apply_per_frame(func, image):
+    """A function to apply a function of a single (Y, X) frame to each
+    frame of an image or stack
+    
+    Parameters:
+    -----------------------------
+        : func (callable): frame -> processed frame
+        : image (np.array): (..., Y, X) image or stack
+        
+    Returns:
+    -----------------------------
+        : processed (np.array): (..., Y', X') the processed frames
+    """
+    if image.ndim == 2:
+        return func(image)
+    
+    frames = [func(frame) for frame in image.reshape((-1,) + image.shape[-2:])]
+    return np.stack(frames).reshape(image.shape[:-2] + frames[0].shape)
+
+
+def rescale_frames(image):
+    """A function to rescale each frame of a stack to [0, 1] by its own
+    min and max, with the arithmetic (and result) of 
+    `exposure.rescale_intensity(frame, out_range=(0, 1))` on each frame
+    
+    Parameters:
+    -----------------------------
+        : image (np.array): (..., Y, X) image or stack
         
-        return np.concatenate([row1, row2, row3], axis=1)
+    Returns:
+    -----------------------------
+        : rescaled (np.array): float32 for float32 input, else float64
+    """
+    axes = (-2, -1)
+    imin = image.min(axis=axes, keepdims=True).astype(np.float64)
+    imax = image.max(axis=axes, keepdims=True).astype(np.float64)
+    
+    # float32 frames are computed in float32, like a python float bound
+    calc_type = np.float32 if image.dtype == np.float32 else np.float64
+    constant = imin == imax
+    scale = np.where(constant, 1.0, imax - imin).astype(calc_type)
+    
+    clipped = np.clip(image, imin.astype(calc_type), imax.astype(calc_type))
+    rescaled = (clipped - imin.astype(calc_type)) / scale
+    if constant.any():
+        rescaled = np.where(constant, np.clip(clipped, 0, 1), rescaled)
+    return rescaled.astype(calc_type, copy=False)
+
+
+def get_strips(n_rows, n_strips, halo):
+    """A function to split the rows of a frame into strips, each read
+    from a window of the same height that holds the strip and `halo` rows
+    on either side (fewer at the edges of the frame, which the window
+    then shares)
 
+    Parameters:
+    -----------------------------
+        : n_rows (int): rows of the frame
+        : n_strips (int): number of strips
+        : halo (int): rows of context on either side of a strip
+
+    Returns:
+    -----------------------------
+        : height (int): rows of every window
+        : strips (list of tuple): (window start, strip start, strip stop)
+        rows of each strip
+    """
+    size = -(-n_rows // max(1, n_strips))
+    height = min(n_rows, size + 2 * halo)
+
+    strips = []
+    for start in range(0, n_rows, size):
+        window_start = min(max(start - halo, 0), n_rows - height)
+        strips.append((window_start, start, min(start + size, n_rows)))
+    return height, strips
+
+
+def get_tile_cells(grid_shape, tile_order='row-major'):
+    """A function to return the grid cell of each tile, in the order the 
+    tiles were acquired. Cells are numbered row-major.
     
-    def block(self):
-        """A function to block the tiles of the mosiac
+    Parameters:
+    -----------------------------
+        : grid_shape (tuple): (rows, columns) of tiles
+        : tile_order (str): one of TILE_ORDERS. 'row-major' fills each row 
+        left to right, 'snake' goes right to left on every other row
         
-        Returns:
-        -----------------------------
-            : blocked_scene (np.array) where the `tiles`
-            channel has been eliminated
-        """
-        blocked_scene = np.zeros(shape=(self.scene.shape[0],
-                                        1416, 1920,
-                                        self.scene.shape[-1]))
+    Returns:
+    -----------------------------
+        : cells (np.array): (rows * columns,) cell index of each tile
+    """
+    if tile_order not in TILE_ORDERS:
+        raise ValueError(f"tile_order must be one of {TILE_ORDERS}, got {tile_order}")
+    
+    rows, cols = grid_shape
+    cells = np.arange(rows * cols).reshape(rows, cols)
+    if tile_order == 'snake':
+        cells[1::2] = cells[1::2, ::-1]
+    return cells.ravel()
+
+
+def montage(stack, grid_shape, tile_order='row-major', out=None):
+    """A function to lay out the tiles of a stack on a grid, for every 
+    leading index at once. Row-major tiles are placed with a single 
+    reshape/transpose, which is a view when the layout allows it (e.g. a 
+    single column of tiles) and one copy otherwise; snake ordered tiles 
+    are copied once. Missing tiles are filled with the mean of the tile 
+    set, as `skimage.util.montage` does.
+    
+    Parameters:
+    -----------------------------
+        : stack (np.array): (..., tiles, Y, X) stack
+        : grid_shape (tuple): (rows, columns) of tiles
+        : tile_order (str): one of TILE_ORDERS, see `get_tile_cells`
+        : out (np.array): optional, C contiguous (..., rows * Y, columns * X) 
+        array to write into
         
-        for t in range(self.scene.shape[0]):
-            for c in range(self.scene.shape[-1]):
-                mosaic = self.scene[t, :, :, :, c]
-                blocked_img = self._stich(mosaic)
-                
-                blocked_scene[t, :, :, c] = blocked_img
-        return blocked_scene
\ No newline at end of file
+    Returns:
+    -----------------------------
+        : montaged (np.array): (..., rows * Y, columns * X)
+    """
+    rows, cols = grid_shape
+    lead = stack.shape[:-3]
+    n_tiles, ny, nx = stack.shape[-3:]
+    
+    if n_tiles > rows * cols:
+        raise ValueError(f"{n_tiles} tiles do not fit a {rows}x{cols} grid")
+    if tile_order not in TILE_ORDERS:
+        raise ValueError(f"tile_order must be one of {TILE_ORDERS}, got {tile_order}")
+    
+    if n_tiles < rows * cols:
+        fill = stack.mean(axis=(-3, -2, -1), keepdims=True)
+        fill = np.broadcast_to(fill, lead + (rows * cols - n_tiles, ny, nx))
+        stack = np.concatenate([stack, fill.astype(stack.dtype)], axis=-3)
+    
+    # (..., rows, Y, columns, X)
+    grid = stack.reshape(lead + (rows, cols, ny, nx))
+    grid = np.moveaxis(grid, -3, -2)
+    out_shape = lead + (rows * ny, cols * nx)
+    
+    if tile_order == 'row-major' and out is None:
+        return grid.reshape(out_shape)
+    
+    if out is None:
+        out = np.empty(out_shape, dtype=stack.dtype)
+    if not out.flags.c_contiguous:
+        raise ValueError("`out` must be C contiguous")
+    out_grid = out.reshape(lead + (rows, ny, cols, nx))
+    
+    if tile_order == 'snake':
+        out_grid[..., 0::2, :, :, :] = grid[..., 0::2, :, :, :]
+        out_grid[..., 1::2, :, :, :] = grid[..., 1::2, :, ::-1, :]
+    else:
+        out_grid[...] = grid
+    return out